@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Helpers shared by benchmarks: timing, peak memory, and results.
+
+A result is a dict, which is printed as one line of JSON by each benchmark
+process, and collected by `run.py`::
+
+    {"name": "micro.mapper", "records": 100000, "bytes": 6200000,
+     "seconds": 1.23, "records_per_sec": 81300.8, "mb_per_sec": 4.8,
+     "peak_rss_kb": 10240}
+"""
+
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+class Timer(object):
+    """measure wall clock time of a ``with`` block"""
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.time() - self.start
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    """peak resident set size in KB"""
+    rss = resource.getrusage(who).ru_maxrss
+    # linux reports KB, mac os reports bytes
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def make_result(name, records, num_bytes, seconds, rss_kb=None, **extra):
+    seconds = max(seconds, 1e-9)
+    result = {
+        'name': name,
+        'records': records,
+        'bytes': num_bytes,
+        'seconds': round(seconds, 4),
+        'records_per_sec': round(records / seconds, 1),
+        'mb_per_sec': round(num_bytes / seconds / (1 << 20), 3),
+        'peak_rss_kb': peak_rss_kb() if rss_kb is None else rss_kb,
+    }
+    result.update(extra)
+    return result
+
+
+def emit(result):
+    """print a result for `run.py`"""
+    sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+    sys.stdout.flush()
+
+
+def temp_path(prefix):
+    fd, path = tempfile.mkstemp(prefix='mrjob-bench-{}-'.format(prefix))
+    os.close(fd)
+    return path
+
+
+def silence_logging():
+    logging.disable(logging.CRITICAL)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""Deterministic synthetic input data for benchmarks.
+
+Every generator takes a `seed`, so the same arguments always produce the same
+bytes, and results of different runs (or commits) are comparable.
+
+Kinds of data:
+    words     lines of Zipf-distributed words, like natural language text
+    numeric   a Zipf-distributed key followed by integer and float columns
+    wide      many tab-separated fields of mixed types per line
+
+Usage:
+    python benchmarks/datagen.py KIND NUM_LINES OUTPUT_PATH
+"""
+
+import bisect
+import random
+import sys
+
+
+DEFAULT_SEED = 20190416
+
+
+class Zipf(object):
+    """draw integers in ``[0, n)`` with probability proportional to
+    ``1 / (rank + 1) ** s``"""
+
+    def __init__(self, n, s=1.1, rng=None):
+        self._rng = rng or random.Random(DEFAULT_SEED)
+        total = 0.0
+        self._cumulative = []
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** s
+            self._cumulative.append(total)
+        self._total = total
+
+    def draw(self):
+        return bisect.bisect_left(self._cumulative, self._rng.random() * self._total)
+
+
+def _vocabulary(size, rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(2, 10))))
+    return sorted(words)
+
+
+def word_lines(num_lines, words_per_line=12, vocab_size=50000, s=1.1, seed=DEFAULT_SEED):
+    """lines of Zipf-distributed words"""
+    rng = random.Random(seed)
+    vocab = _vocabulary(vocab_size, rng)
+    zipf = Zipf(vocab_size, s, rng)
+    for _ in range(num_lines):
+        n = rng.randint(words_per_line // 2, words_per_line * 3 // 2)
+        yield (' '.join(vocab[zipf.draw()] for _ in range(n)) + '\n').encode('ascii')
+
+
+def numeric_lines(num_lines, columns=8, num_keys=10000, s=1.1, seed=DEFAULT_SEED):
+    """lines of a Zipf-distributed key, followed by integer and float columns"""
+    rng = random.Random(seed)
+    zipf = Zipf(num_keys, s, rng)
+    for _ in range(num_lines):
+        fields = ['k{}'.format(zipf.draw())]
+        for i in range(columns):
+            if i % 2:
+                fields.append(repr(round(rng.gauss(100.0, 30.0), 4)))
+            else:
+                fields.append(str(rng.randint(0, 1000000)))
+        yield ('\t'.join(fields) + '\n').encode('ascii')
+
+
+def wide_lines(num_lines, fields=60, num_keys=1000, seed=DEFAULT_SEED):
+    """lines of many tab-separated fields: a Zipf-distributed key, then
+    integers, floats and short strings in turn"""
+    rng = random.Random(seed)
+    zipf = Zipf(num_keys, 1.1, rng)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    for _ in range(num_lines):
+        values = ['k{}'.format(zipf.draw())]
+        for i in range(1, fields):
+            kind = i % 3
+            if kind == 0:
+                values.append(str(rng.randint(0, 1 << 30)))
+            elif kind == 1:
+                values.append(repr(round(rng.random() * 1000, 3)))
+            else:
+                values.append(''.join(rng.choice(letters) for _ in range(rng.randint(3, 12))))
+        yield ('\t'.join(values) + '\n').encode('ascii')
+
+
+GENERATORS = {
+    'words': word_lines,
+    'numeric': numeric_lines,
+    'wide': wide_lines,
+}
+
+
+def write_dataset(kind, num_lines, path, seed=DEFAULT_SEED):
+    """write `num_lines` lines of data `kind` to `path`.
+    :return: number of bytes written."""
+    size = 0
+    with open(path, 'wb') as f:
+        for line in GENERATORS[kind](num_lines, seed=seed):
+            f.write(line)
+            size += len(line)
+    return size
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] not in GENERATORS:
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+    write_dataset(sys.argv[1], int(sys.argv[2]), sys.argv[3])
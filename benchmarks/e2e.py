@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""End-to-end benchmarks: whole jobs run by `LocalRunner` (and `InlineRunner`)
+over generated data.
+
+Each job runs in a child process, the same way as a user would run it, e.g.
+``python e2e.py -r local -input ... -output ...``. Peak memory is the largest
+of the runner and its mapper/combiner/reducer processes.
+
+Usage:
+    python benchmarks/e2e.py --list
+    python benchmarks/e2e.py NAME [NUM_LINES]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchlib import Timer, emit, make_result
+from datagen import write_dataset
+
+from mrjob import MRJob
+
+
+class WordCount(MRJob):
+    """word count with a combiner, over `words` data"""
+
+    def mapper(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def combiner(self, word, counts):
+        yield word, sum(counts)
+
+    def reducer(self, word, counts):
+        yield word, sum(counts)
+
+
+class WordCountSalted(WordCount):
+    """word count with hot words salted, see `MRJob.SALT_HOT_KEYS`"""
+    SALT_HOT_KEYS = True
+
+
+class NumericStats(MRJob):
+    """count, sum, min and max of a column per key, over `numeric` data"""
+
+    def mapper(self, _, line):
+        fields = line.split('\t')
+        value = float(fields[2])
+        yield fields[0], (1, value, value, value)
+
+    def combiner(self, key, stats):
+        count, total, low, high = 0, 0.0, float('inf'), float('-inf')
+        for c, t, l, h in stats:
+            count += c
+            total += t
+            low = min(low, l)
+            high = max(high, h)
+        yield key, (count, total, low, high)
+
+    reducer = combiner
+
+
+class WideProjection(MRJob):
+    """project a few fields of wide records, and count distinct values per key,
+    over `wide` data"""
+
+    def mapper(self, _, line):
+        fields = line.split('\t')
+        yield fields[0], (fields[2], fields[5])
+
+    def reducer(self, key, values):
+        yield key, len(set(values))
+
+
+# name: (job class, kind of data, extra command line arguments)
+JOBS = {
+    'local.wordcount': (WordCount, 'words', ['-r', 'local', '-jobs', '2']),
+    'local.wordcount.salted': (WordCountSalted, 'words', ['-r', 'local', '-jobs', '4']),
+    'local.wordcount.typedbytes': (WordCount, 'words', ['-r', 'local', '-jobs', '2', '-io', 'typedbytes']),
+    'local.numeric': (NumericStats, 'numeric', ['-r', 'local', '-jobs', '2']),
+    'local.wide': (WideProjection, 'wide', ['-r', 'local', '-jobs', '2']),
+    'inline.wordcount': (WordCount, 'words', ['-r', 'inline']),
+}
+
+
+def run_job(name, num_lines):
+    job_class, kind, args = JOBS[name]
+    tmp_dir = tempfile.mkdtemp(prefix='mrjob-bench-e2e-')
+    try:
+        input_path = os.path.join(tmp_dir, 'input')
+        output_path = os.path.join(tmp_dir, 'output')
+        num_bytes = write_dataset(kind, num_lines, input_path)
+
+        cmd = [sys.executable, os.path.abspath(__file__)] + args + ['-input', input_path, '-output', output_path]
+        env = dict(os.environ, BENCH_JOB=name)
+        with open(os.devnull, 'wb') as devnull, Timer() as t:
+            proc = subprocess.Popen(cmd, env=env, stdout=devnull, stderr=devnull)
+            # rusage of the runner includes its (waited) mapper/reducer processes
+            _, status, rusage = os.wait4(proc.pid, 0)
+        if status != 0:
+            raise RuntimeError('job {} failed, command: {}'.format(name, ' '.join(cmd)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    rss_kb = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return make_result('e2e.' + name, num_lines, num_bytes, t.seconds, rss_kb=rss_kb,
+                       cpu_seconds=round(rusage.ru_utime + rusage.ru_stime, 4))
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in JOBS and sys.argv[1] != '--list':
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+
+    if sys.argv[1] == '--list':
+        for name in sorted(JOBS):
+            print(name)
+        return
+
+    num_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    emit(run_job(sys.argv[1], num_lines))
+
+
+if __name__ == '__main__':
+    if 'BENCH_JOB' in os.environ:
+        JOBS[os.environ['BENCH_JOB']][0]().run(runner='local')
+    else:
+        main()
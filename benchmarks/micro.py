@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""Per-stage microbenchmarks: protocol encode/decode, the mapper loop, the
+grouping reducer, and the sort and pipes of LocalRunner.
+
+Each benchmark runs in the current process, and prints its result as a line
+of JSON (see benchlib.py). Use `run.py` to run them all in fresh processes,
+so that peak memory is measured per benchmark.
+
+Usage:
+    python benchmarks/micro.py --list
+    python benchmarks/micro.py NAME [NUM_RECORDS]
+"""
+
+from collections import Counter
+import os
+import subprocess
+import sys
+
+from benchlib import Timer, emit, make_result, silence_logging, temp_path
+from datagen import word_lines, write_dataset
+
+from mrjob import MRJob
+from mrjob.protocol import BinaryPickleProtocol, JSONProtocol, PickleProtocol, SortKeyProtocol
+from mrjob.sort import ExternalSorter
+from mrjob.runner.taskio import non_blocking_communicate
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fun):
+        BENCHMARKS[name] = fun
+        return fun
+    return register
+
+
+# protocols
+# -----------------------------------------------------------
+
+PROTOCOLS = {
+    'pickle': PickleProtocol,
+    'json': JSONProtocol,
+    'binary_pickle': BinaryPickleProtocol,
+    'sort_key': SortKeyProtocol,
+}
+
+
+def protocol_records(num_records):
+    """a mix of word counts, tuple keys with lists of floats, int keys with
+    dicts, and values with characters that need escaping"""
+    records = []
+    for i, line in enumerate(word_lines(num_records, words_per_line=2)):
+        word = line.split()[0].decode('ascii')
+        kind = i % 4
+        if kind == 0:
+            records.append((word, 1))
+        elif kind == 1:
+            records.append(((word, i % 100), [i * 0.5, i * 0.25, 1.0 / (i + 1)]))
+        elif kind == 2:
+            records.append((i, {'count': i, 'name': word, 'tags': ['a', 'b']}))
+        else:
+            records.append((word, 'some\ttext with\nspecial\\chars'))
+    return records
+
+
+def bench_protocol(protocol_name, num_records, decode):
+    protocol = PROTOCOLS[protocol_name]()
+    records = protocol_records(num_records)
+    lines = [protocol.write(key, value) for key, value in records]
+    num_bytes = sum(len(line) + 1 for line in lines)
+
+    with Timer() as t:
+        if decode:
+            for line in lines:
+                protocol.read(line)
+        else:
+            for key, value in records:
+                protocol.write(key, value)
+    return make_result(None, num_records, num_bytes, t.seconds)
+
+
+def _register_protocols():
+    for protocol_name in PROTOCOLS:
+        for op in ('encode', 'decode'):
+            benchmark('protocol.{}.{}'.format(protocol_name, op))(
+                lambda n, p=protocol_name, d=(op == 'decode'): bench_protocol(p, n, d))
+
+_register_protocols()
+
+
+# mapper/reducer tasks
+# -----------------------------------------------------------
+
+class WordCount(MRJob):
+
+    def mapper(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def combiner(self, word, counts):
+        yield word, sum(counts)
+
+    def reducer(self, word, counts):
+        yield word, sum(counts)
+
+
+class WordCountNoCombiner(WordCount):
+    combiner = None
+
+
+class WordCountFlush(WordCountNoCombiner):
+    OUTPUT_BUFFER_SIZE = 0
+
+
+class WordCountBatch(WordCount):
+    mapper = None
+
+    def mapper_batch(self, lines):
+        counts = Counter(word for line in lines for word in line.split())
+        return list(counts.keys()), list(counts.values())
+
+
+class WordCountInMapperCombine(WordCount):
+    MAPPER_COMBINE = True
+
+
+class WordCountLazy(WordCount):
+
+    def reducer(self, word, counts):
+        yield word, counts.count()
+
+
+def run_task(job_class, task, input_path):
+    """run mapper/combiner/reducer `task` of a job over `input_path` in the
+    current process, discarding its output"""
+    job = job_class()
+    with open(input_path, 'rb') as fin, open(os.devnull, 'wb') as fout:
+        job._stdin = fin
+        job._stdout = job._stderr = fout
+        with Timer() as t:
+            getattr(job, '_run_' + task)()
+    return t.seconds
+
+
+def bench_mapper(job_class, num_records):
+    input_path = temp_path('mapper')
+    try:
+        num_bytes = write_dataset('words', num_records, input_path)
+        seconds = run_task(job_class, 'mapper', input_path)
+    finally:
+        os.remove(input_path)
+    return make_result(None, num_records, num_bytes, seconds)
+
+
+def sorted_word_counts(num_records, path):
+    """write sorted mapper output of word count to `path`.
+    :return: number of records and bytes written."""
+    write = WordCount().internal_protocol.write
+    lines = sorted(write(word, 1) + b'\n' for line in word_lines(num_records) for word in line.split())
+    with open(path, 'wb') as f:
+        f.writelines(lines)
+    return len(lines), sum(len(line) for line in lines)
+
+
+def bench_reducer(job_class, num_records):
+    input_path = temp_path('reducer')
+    try:
+        records, num_bytes = sorted_word_counts(num_records, input_path)
+        seconds = run_task(job_class, 'reducer', input_path)
+    finally:
+        os.remove(input_path)
+    return make_result(None, records, num_bytes, seconds)
+
+
+benchmark('mapper')(lambda n: bench_mapper(WordCountNoCombiner, n))
+benchmark('mapper.flush_per_record')(lambda n: bench_mapper(WordCountFlush, n))
+benchmark('mapper.batch')(lambda n: bench_mapper(WordCountBatch, n))
+benchmark('mapper.in_mapper_combine')(lambda n: bench_mapper(WordCountInMapperCombine, n))
+benchmark('reducer')(lambda n: bench_reducer(WordCount, n))
+benchmark('reducer.count_only')(lambda n: bench_reducer(WordCountLazy, n))
+
+
+# sort
+# -----------------------------------------------------------
+
+def bench_sort(num_records, buffer_size):
+    write = WordCount().internal_protocol.write
+    lines = [write(word, 1) + b'\n' for line in word_lines(num_records) for word in line.split()]
+    num_bytes = sum(len(line) for line in lines)
+
+    with Timer() as t:
+        sorter = ExternalSorter(buffer_size=buffer_size)
+        sorter.extend(lines)
+        for _ in sorter:
+            pass
+    return make_result(None, len(lines), num_bytes, t.seconds, spills=sorter.spills)
+
+
+benchmark('sort.in_memory')(lambda n: bench_sort(n, 1 << 40))
+benchmark('sort.spill')(lambda n: bench_sort(n, 1 << 20))
+
+
+# pipes
+# -----------------------------------------------------------
+
+@benchmark('pipe')
+def bench_pipe(num_records):
+    """pipe mapper output through `cat`, the way LocalRunner pipes records
+    through mapper/combiner/reducer processes"""
+    write = WordCount().internal_protocol.write
+    lines = [write(word, 1) + b'\n' for line in word_lines(num_records) for word in line.split()]
+    num_bytes = sum(len(line) for line in lines)
+
+    with Timer() as t:
+        proc = subprocess.Popen('cat', stdin=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
+        records = sum(1 for _ in non_blocking_communicate(proc, lines))
+    if records != len(lines):
+        raise RuntimeError('{} records piped, {} expected'.format(records, len(lines)))
+    return make_result(None, records, num_bytes, t.seconds)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS and sys.argv[1] != '--list':
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+
+    if sys.argv[1] == '--list':
+        for name in sorted(BENCHMARKS):
+            print(name)
+        return
+
+    name = sys.argv[1]
+    num_records = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    silence_logging()
+    result = BENCHMARKS[name](num_records)
+    result['name'] = 'micro.' + name
+    emit(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""Run all benchmarks, each in a fresh process, and report or compare results.
+
+Results are saved as JSON, with some information about the machine and the
+commit, so that a later run can be compared to them::
+
+    python benchmarks/run.py -o before.json
+    # ... change something ...
+    python benchmarks/run.py --baseline before.json
+
+With `--baseline`, the exit status is 1 if records/s of any benchmark drops by
+more than `--tolerance` (10% by default).
+
+Usage:
+    python benchmarks/run.py [-k PATTERN] [--records N] [-o RESULTS]
+                             [--baseline RESULTS] [--tolerance RATIO]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(cur_dir)
+
+# benchmark script: default number of records of its benchmarks
+SCRIPTS = {
+    'micro.py': 100000,
+    'e2e.py': 20000,
+    'startup.py': 20,
+}
+
+
+def benchmark_env():
+    """environment of benchmark processes, which import mrjob of this source
+    tree (and so do the tasks they start)"""
+    python_path = os.environ.get('PYTHONPATH')
+    return dict(os.environ, PYTHONPATH=root_dir + os.pathsep + python_path if python_path else root_dir)
+
+
+def list_benchmarks(pattern=None):
+    """:return: a list of (script, name of benchmark)"""
+    res = []
+    for script in sorted(SCRIPTS):
+        names = subprocess.check_output([sys.executable, os.path.join(cur_dir, script), '--list'],
+                                        env=benchmark_env())
+        prefix = script[:-len('.py')] + '.'
+        for name in names.decode('utf-8').split():
+            if pattern is None or pattern in prefix + name:
+                res.append((script, name))
+    return res
+
+
+def run_benchmark(script, name, num_records=None):
+    if num_records is None:
+        num_records = SCRIPTS[script]
+    cmd = [sys.executable, os.path.join(cur_dir, script), name, str(num_records)]
+    output = subprocess.check_output(cmd, env=benchmark_env())
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        with open(os.devnull, 'wb') as devnull:
+            rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=cur_dir, stderr=devnull)
+        return rev.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """print changes of records/s against `baseline`.
+    :return: names of benchmarks which are slower than baseline by more than
+        `tolerance`."""
+    old = dict((r['name'], r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        if result['name'] not in old:
+            continue
+        before = old[result['name']]['records_per_sec']
+        change = result['records_per_sec'] / before - 1 if before else 0.0
+        flag = ''
+        if change < -tolerance:
+            flag = '  REGRESSION'
+            regressions.append(result['name'])
+        print('{:<40} {:>12.1f} -> {:>12.1f} records/s {:>+7.1%}{}'.format(
+            result['name'], before, result['records_per_sec'], change, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run benchmarks of mrjob')
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks whose name contains PATTERN')
+    parser.add_argument('--records', type=int, help='number of records (or input lines) of each benchmark')
+    parser.add_argument('-o', '--output', help='save results to this JSON file')
+    parser.add_argument('--baseline', help='compare to results saved by a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='max ratio that records/s may drop compared to baseline')
+    args = parser.parse_args()
+
+    results = []
+    print('{:<40} {:>10} {:>9} {:>12} {:>9} {:>10}'.format(
+        'name', 'records', 'seconds', 'records/s', 'MB/s', 'rss KB'))
+    for script, name in list_benchmarks(args.pattern):
+        result = run_benchmark(script, name, args.records)
+        results.append(result)
+        print('{name:<40} {records:>10} {seconds:>9.3f} {records_per_sec:>12.1f} '
+              '{mb_per_sec:>9.3f} {peak_rss_kb:>10}'.format(**result))
+        sys.stdout.flush()
+
+    if args.output:
+        report = {
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+            },
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print('')
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('{} benchmark(s) regressed: {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""Startup benchmarks: how long it takes to import mrjob, and to start a
+mapper task over empty input, the way hadoop streaming starts thousands of
+them. Each start is a fresh python process; `records` is the number of starts.
+
+- `import`: ``python -c "import mrjob"``
+- `task`: ``python job.py --mapper``, importing mrjob from the source tree
+- `task.bundle`: the same, importing the zipped bundle which `HadoopRunner`
+  ships to tasks (see `mrjob.runner.hadoop.bundle`)
+
+With `--importtime`, the time spent in importing each module is reported
+instead, like ``python -X importtime`` of python 3.7+ (which python 2 lacks)::
+
+    python benchmarks/startup.py --importtime [MODULE]
+
+Usage:
+    python benchmarks/startup.py --list
+    python benchmarks/startup.py NAME [NUM_STARTS]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchlib import Timer, emit, make_result
+
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+JOB_SCRIPT = b'''
+from mrjob import MRJob
+
+
+class WordCount(MRJob):
+
+    def mapper(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def reducer(self, word, counts):
+        yield word, sum(counts)
+
+
+if __name__ == '__main__':
+    WordCount().run()
+'''
+
+# run in a fresh process by --importtime, with the name of the module to
+# import as argv[1]. prints one line per newly imported module, in the order
+# they are imported, indented by depth.
+IMPORTTIME_CODE = '''
+import sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+_import = builtins.__import__
+records = []
+stack = []
+
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return _import(name, *args, **kwargs)
+    record = [name, len(stack), 0.0, 0.0]
+    records.append(record)
+    stack.append(0.0)
+    start = time.time()
+    try:
+        return _import(name, *args, **kwargs)
+    finally:
+        cumulative = time.time() - start
+        children = stack.pop()
+        if stack:
+            stack[-1] += cumulative
+        record[2] = cumulative - children
+        record[3] = cumulative
+
+builtins.__import__ = timed_import
+start = time.time()
+__import__(sys.argv[1])
+total = time.time() - start
+builtins.__import__ = _import
+
+sys.stdout.write('import time: self [us] | cumulative | imported package\\n')
+for name, depth, self_seconds, cumulative in records:
+    sys.stdout.write('import time: {:>9} | {:>10} | {}{}\\n'.format(
+        int(self_seconds * 1e6), int(cumulative * 1e6), '  ' * depth, name))
+sys.stdout.write('total: {} us\\n'.format(int(total * 1e6)))
+'''
+
+
+def _start(cmd, env, cwd, stdin):
+    """run `cmd` once.
+    :return: peak rss (KB) of it"""
+    with open(stdin, 'rb') as fin, open(os.devnull, 'wb') as devnull:
+        proc = subprocess.Popen(cmd, env=env, cwd=cwd, stdin=fin, stdout=devnull, stderr=devnull)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    if status != 0:
+        raise RuntimeError('command failed: {}'.format(' '.join(cmd)))
+    return rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+
+
+def bench_startup(name, num_starts):
+    tmp_dir = tempfile.mkdtemp(prefix='mrjob-bench-startup-')
+    try:
+        script = os.path.join(tmp_dir, 'job.py')
+        with open(script, 'wb') as f:
+            f.write(JOB_SCRIPT)
+
+        python_path = root_dir
+        if name == 'import':
+            cmd = [sys.executable, '-c', 'import mrjob']
+        else:
+            cmd = [sys.executable, 'job.py', '--mapper']
+            if name == 'task.bundle':
+                sys.path.insert(0, root_dir)
+                from mrjob.runner.hadoop import bundle
+                # like `-file` of hadoop streaming, tasks run beside the bundle
+                python_path = os.path.basename(bundle())
+                shutil.copy(os.path.join(root_dir, 'mrjob', 'bundle', python_path), tmp_dir)
+        env = dict(os.environ, PYTHONPATH=python_path)
+
+        # the first start compiles .pyc files of the source tree
+        _start(cmd, env, tmp_dir, os.devnull)
+
+        rss_kb = 0
+        with Timer() as t:
+            for _ in range(num_starts):
+                rss_kb = max(rss_kb, _start(cmd, env, tmp_dir, os.devnull))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return make_result('startup.' + name, num_starts, 0, t.seconds, rss_kb=rss_kb,
+                       ms_per_start=round(t.seconds * 1000.0 / num_starts, 2))
+
+
+BENCHMARKS = ('import', 'task', 'task.bundle')
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--importtime':
+        module = sys.argv[2] if len(sys.argv) > 2 else 'mrjob'
+        env = dict(os.environ, PYTHONPATH=root_dir)
+        sys.exit(subprocess.call([sys.executable, '-c', IMPORTTIME_CODE, module], env=env))
+
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS and sys.argv[1] != '--list':
+        sys.stderr.write(__doc__)
+        sys.exit(2)
+
+    if sys.argv[1] == '--list':
+        for name in BENCHMARKS:
+            print(name)
+        return
+
+    num_starts = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    emit(bench_startup(sys.argv[1], num_starts))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,18 @@
 
 
 from job import MRJob
-from runner.hadoop import bundle, set_hadoop_python
+from step import MRStep
+
+
+# runners are imported lazily, so that tasks importing mrjob start faster
+def bundle(*args, **kwargs):
+    from runner.hadoop import bundle
+    return bundle(*args, **kwargs)
+
+
+def set_hadoop_python(*args, **kwargs):
+    from runner.hadoop import set_hadoop_python
+    return set_hadoop_python(*args, **kwargs)
 
 
 __title__ = 'mrjob'
@@ -25,4 +36,4 @@ __author__ = 'zhuhe212'
 __author_email__ = 'zhuhe212@163.com'
 
 
-__all__ = ['__version__', '__author__', 'MRJob']
+__all__ = ['__version__', '__author__', 'MRJob', 'MRStep']
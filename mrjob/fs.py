@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+
+"""Filesystems used by `HadoopRunner` to manage input and output of jobs.
+
+`HadoopFilesystem` runs the ``hadoop fs`` client, which starts a JVM (taking
+a few seconds) for each command, so several paths are passed to a single
+command where possible. `WebHdfsFilesystem` talks to the namenode over
+WebHDFS through a persistent HTTP connection instead, so that each operation
+takes milliseconds. `LocalFilesystem` provides the same interface over local
+files, as a stand-in of HDFS for testing.
+"""
+
+import errno
+import glob
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+
+try:
+    import httplib
+    from urllib import quote, urlencode
+    from urlparse import urlparse
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import quote, urlencode, urlparse
+
+from runner.taskio import PIPE_CHUNK_SIZE
+
+
+logger = logging.getLogger('mrjob')
+
+_HADOOP_RM_NO_SUCH_FILE = re.compile(r'\nrmr?: .*No such file.*\n')
+
+
+class FilesystemError(IOError): pass
+
+
+def _invoke_hadoop(cmd, ok_returncodes=None, ok_stderr=None, return_stdout=False):
+    """包装调用 hadoop 客户端的命令，并屏蔽指定的 stderr"""
+
+    logger.info('> {}'.format(' '.join(cmd)))
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+
+    # check if STDERR is okay
+    stderr_is_ok = False
+    if ok_stderr:
+        for stderr_re in ok_stderr:
+            if stderr_re.search(stderr):
+                stderr_is_ok = True
+                break
+
+    if not stderr_is_ok:
+        for line in io.BytesIO(stderr):
+            # skip HDFS info in stderr stream
+            if ' INFO ' in line:
+                continue
+            logger.error('STDERR: ' + line.rstrip())
+
+    ok_returncodes = ok_returncodes or [0]
+
+    if not stderr_is_ok and proc.returncode not in ok_returncodes:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    if return_stdout:
+        return stdout
+    else:
+        if stdout:
+            logger.info('STDOUT: ' + stdout)
+        return proc.returncode
+
+
+def _hdfs_path(path):
+    """strip scheme and authority (e.g. ``hdfs://namenode:9000``) of `path`"""
+    if '://' in path:
+        return urlparse(path).path or '/'
+    return path
+
+
+class Filesystem(object):
+    """interface of filesystems. Paths may be absolute, or relative to the
+    home directory of the user."""
+
+    def exists(self, path):
+        """check if `path` exists"""
+        raise NotImplementedError
+
+    def ls(self, path):
+        """:return: paths of files under directory `path` recursively, or
+            ``[path]`` if it's a file"""
+        raise NotImplementedError
+
+    def du(self, path):
+        """:return: a dict of ``{path: size in bytes}`` of each file and
+            directory directly under directory `path`, or of `path` itself if
+            it's a file"""
+        raise NotImplementedError
+
+    def rm(self, *paths):
+        """remove files and directories recursively, ignoring those which
+        don't exist"""
+        raise NotImplementedError
+
+    def mv(self, src, dst):
+        """move `src` to `dst`, or into `dst` if it's a directory"""
+        raise NotImplementedError
+
+    def cat(self, path):
+        """yield content of file `path` in chunks of bytes"""
+        raise NotImplementedError
+
+    def put(self, local_path, path):
+        """copy local file `local_path` to `path`"""
+        raise NotImplementedError
+
+    def concat(self, paths, dst):
+        """concatenate files `paths` into a new file `dst`, through a local
+        temp file by default"""
+        fd, tmp_path = tempfile.mkstemp(prefix='mrjob-concat-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for path in paths:
+                    for chunk in self.cat(path):
+                        f.write(chunk)
+            self.put(tmp_path, dst)
+        finally:
+            os.remove(tmp_path)
+
+
+class HadoopFilesystem(Filesystem):
+    """filesystem of the ``hadoop fs`` client. All paths given to `rm` are
+    removed by a single command."""
+
+    def __init__(self, hadoop):
+        self._hadoop = hadoop
+
+    def _fs(self, *args, **kwargs):
+        try:
+            return _invoke_hadoop([self._hadoop, 'fs'] + list(args), **kwargs)
+        except subprocess.CalledProcessError as e:
+            raise FilesystemError('command failed ({}): {}'.format(e.returncode, ' '.join(e.cmd)))
+
+    def exists(self, path):
+        return self._fs('-test', '-e', path, ok_returncodes=[0, 1]) == 0
+
+    def ls(self, path):
+        stdout = self._fs('-lsr', path, return_stdout=True)
+        paths = []
+        for line in io.BytesIO(stdout):
+            fields = line.split()
+            # skip directories, and "Found N items" lines
+            if len(fields) >= 8 and not fields[0].startswith(b'd'):
+                paths.append(fields[-1].decode('utf-8'))
+        return paths
+
+    def du(self, path):
+        stdout = self._fs('-du', path, return_stdout=True)
+        sizes = {}
+        for line in io.BytesIO(stdout):
+            # "size path" (hadoop 1) or "size disk_space_consumed path"
+            fields = line.split()
+            if len(fields) >= 2 and fields[0].isdigit():
+                sizes[fields[-1].decode('utf-8')] = int(fields[0])
+        return sizes
+
+    def rm(self, *paths):
+        if paths:
+            self._fs('-rmr', *paths, ok_stderr=[_HADOOP_RM_NO_SUCH_FILE])
+
+    def mv(self, src, dst):
+        self._fs('-mv', src, dst)
+
+    def cat(self, path):
+        cmd = [self._hadoop, 'fs', '-cat', path]
+        logger.info('> {}'.format(' '.join(cmd)))
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        try:
+            for chunk in iter(lambda: proc.stdout.read(PIPE_CHUNK_SIZE), b''):
+                yield chunk
+        finally:
+            proc.stdout.close()
+            proc.wait()
+        if proc.returncode != 0:
+            raise FilesystemError('command failed ({}): {}'.format(proc.returncode, ' '.join(cmd)))
+
+    def put(self, local_path, path):
+        self._fs('-put', local_path, path)
+
+    def concat(self, paths, dst):
+        # pipe `fs -cat` of all the files into `fs -put`, two JVMs in total
+        cat = [self._hadoop, 'fs', '-cat'] + list(paths)
+        put = [self._hadoop, 'fs', '-put', '-', dst]
+        logger.info('> {} | {}'.format(' '.join(cat), ' '.join(put)))
+        cat_proc = subprocess.Popen(cat, stdout=subprocess.PIPE)
+        try:
+            put_proc = subprocess.Popen(put, stdin=cat_proc.stdout)
+        finally:
+            cat_proc.stdout.close()
+        for proc, cmd in ((put_proc, put), (cat_proc, cat)):
+            if proc.wait() != 0:
+                raise FilesystemError('command failed ({}): {}'.format(proc.returncode, ' '.join(cmd)))
+
+
+class WebHdfsFilesystem(Filesystem):
+    """filesystem of WebHDFS, e.g. ``WebHdfsFilesystem('http://namenode:50070')``.
+
+    Requests to the namenode go through one persistent HTTP connection, which
+    is reopened if the server closes it. Data of `cat` and `put` is moved
+    from and to datanodes, to which the namenode redirects.
+    """
+
+    def __init__(self, url, user=None, timeout=60):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'webhdfs') or not parsed.hostname:
+            raise ValueError('invalid WebHDFS url: "{}"'.format(url))
+        self._host = parsed.hostname
+        self._port = parsed.port or 50070
+        self._user = user or os.environ.get('HADOOP_USER_NAME') or os.environ.get('USER')
+        self._timeout = timeout
+        self._conn = None
+        self._home = None
+
+    def _abs_path(self, path):
+        path = _hdfs_path(path)
+        if not path.startswith('/'):
+            if self._home is None:
+                self._home = self._json('GET', '/', 'GETHOMEDIRECTORY')['Path']
+            path = self._home.rstrip('/') + '/' + path
+        return path
+
+    def _url(self, path, op, **params):
+        path = self._abs_path(path)
+        params['op'] = op
+        if self._user:
+            params['user.name'] = self._user
+        return '/webhdfs/v1{}?{}'.format(quote(path), urlencode(sorted(params.items())))
+
+    def _request(self, method, path, op, ok_statuses=(200,), **params):
+        """send a request to the namenode, and read its response.
+        :return: a tuple of ``(response, body)``"""
+        url = self._url(path, op, **params)
+        logger.debug('webhdfs: {} {}'.format(method, url))
+        for retry in (True, False):
+            if self._conn is None:
+                self._conn = httplib.HTTPConnection(self._host, self._port, timeout=self._timeout)
+            try:
+                self._conn.request(method, url)
+                resp = self._conn.getresponse()
+                body = resp.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                # the server may close idle connections
+                self._conn.close()
+                self._conn = None
+                if not retry:
+                    raise
+        if resp.status not in ok_statuses:
+            raise FilesystemError(self._error_message(resp, body, method, path))
+        return resp, body
+
+    @staticmethod
+    def _error_message(resp, body, method, path):
+        try:
+            message = json.loads(body.decode('utf-8'))['RemoteException']['message']
+        except (ValueError, KeyError, TypeError):
+            message = resp.reason
+        return 'WebHDFS {} {} failed ({}): {}'.format(method, path, resp.status, message)
+
+    def _json(self, method, path, op, **params):
+        return json.loads(self._request(method, path, op, **params)[1].decode('utf-8'))
+
+    def _list(self, path):
+        """:return: a list of ``(path, FileStatus)`` of entries under
+            `path`, or of `path` itself if it's a file"""
+        path = self._abs_path(path).rstrip('/') or '/'
+        statuses = self._json('GET', path, 'LISTSTATUS')['FileStatuses']['FileStatus']
+        res = []
+        for status in statuses:
+            suffix = status['pathSuffix']
+            res.append((path if not suffix else path.rstrip('/') + '/' + suffix, status))
+        return res
+
+    def exists(self, path):
+        resp, _ = self._request('GET', path, 'GETFILESTATUS', ok_statuses=(200, 404))
+        return resp.status == 200
+
+    def ls(self, path):
+        paths = []
+        for entry, status in self._list(path):
+            if status['type'] == 'DIRECTORY':
+                paths.extend(self.ls(entry))
+            else:
+                paths.append(entry)
+        return paths
+
+    def du(self, path):
+        sizes = {}
+        for entry, status in self._list(path):
+            if status['type'] == 'DIRECTORY':
+                sizes[entry] = self._json('GET', entry, 'GETCONTENTSUMMARY')['ContentSummary']['length']
+            else:
+                sizes[entry] = status['length']
+        return sizes
+
+    def rm(self, *paths):
+        for path in paths:
+            self._request('DELETE', path, 'DELETE', recursive='true')
+
+    def mv(self, src, dst):
+        dst = self._abs_path(dst)
+        if not self._json('PUT', src, 'RENAME', destination=dst)['boolean']:
+            raise FilesystemError('WebHDFS failed to move {} to {}'.format(src, dst))
+
+    def _datanode(self, location):
+        """connect to the datanode of a redirect"""
+        parsed = urlparse(location)
+        conn = httplib.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self._timeout)
+        url = parsed.path + ('?' + parsed.query if parsed.query else '')
+        return conn, url
+
+    def cat(self, path):
+        resp, body = self._request('GET', path, 'OPEN', ok_statuses=(200, 307))
+        if resp.status == 200:
+            # served by the namenode (or a gateway like HttpFS) itself
+            yield body
+            return
+
+        conn, url = self._datanode(resp.getheader('Location'))
+        try:
+            conn.request('GET', url)
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise FilesystemError(self._error_message(resp, resp.read(), 'GET', path))
+            for chunk in iter(lambda: resp.read(PIPE_CHUNK_SIZE), b''):
+                yield chunk
+        finally:
+            conn.close()
+
+    def put(self, local_path, path):
+        resp, _ = self._request('PUT', path, 'CREATE', ok_statuses=(307,), overwrite='true')
+        conn, url = self._datanode(resp.getheader('Location'))
+        try:
+            with open(local_path, 'rb') as f:
+                conn.request('PUT', url, f, {'Content-Type': 'application/octet-stream',
+                                             'Content-Length': str(os.fstat(f.fileno()).st_size)})
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.status != 201:
+                raise FilesystemError(self._error_message(resp, body, 'PUT', path))
+        finally:
+            conn.close()
+
+
+class LocalFilesystem(Filesystem):
+    """local stand-in of HDFS. Paths (without scheme) are taken as relative
+    to `root` if it's given, e.g. ``/user/a`` is ``<root>/user/a``."""
+
+    def __init__(self, root=None):
+        self._root = root
+
+    def _local(self, path):
+        path = _hdfs_path(path)
+        if self._root:
+            path = os.path.join(self._root, path.lstrip('/'))
+        return path
+
+    def _hdfs(self, local_path, path):
+        """map `local_path` under local path of `path` back to its hdfs path"""
+        return path.rstrip('/') + local_path[len(self._local(path).rstrip('/')):]
+
+    def exists(self, path):
+        return os.path.exists(self._local(path))
+
+    def ls(self, path):
+        local_path = self._local(path)
+        if not os.path.isdir(local_path):
+            if not os.path.exists(local_path):
+                raise FilesystemError('No such file or directory: {}'.format(path))
+            return [path]
+        paths = []
+        for dir_path, _, file_names in os.walk(local_path):
+            paths.extend(self._hdfs(os.path.join(dir_path, name), path) for name in sorted(file_names))
+        return paths
+
+    def _size(self, local_path):
+        if not os.path.isdir(local_path):
+            return os.path.getsize(local_path)
+        return sum(os.path.getsize(os.path.join(dir_path, name))
+                   for dir_path, _, file_names in os.walk(local_path) for name in file_names)
+
+    def du(self, path):
+        local_path = self._local(path)
+        if not os.path.exists(local_path):
+            raise FilesystemError('No such file or directory: {}'.format(path))
+        if not os.path.isdir(local_path):
+            return {path: self._size(local_path)}
+        return dict((self._hdfs(entry, path), self._size(entry))
+                    for entry in glob.glob(os.path.join(local_path, '*')))
+
+    def rm(self, *paths):
+        for path in paths:
+            local_path = self._local(path)
+            if os.path.isdir(local_path):
+                shutil.rmtree(local_path)
+            elif os.path.exists(local_path):
+                os.remove(local_path)
+
+    def mv(self, src, dst):
+        local_src, local_dst = self._local(src), self._local(dst)
+        if os.path.isdir(local_dst):
+            local_dst = os.path.join(local_dst, os.path.basename(local_src.rstrip('/')))
+        try:
+            os.rename(local_src, local_dst)
+        except OSError as e:
+            raise FilesystemError('failed to move {} to {}: {}'.format(src, dst, e.strerror))
+
+    def cat(self, path):
+        with open(self._local(path), 'rb') as f:
+            for chunk in iter(lambda: f.read(PIPE_CHUNK_SIZE), b''):
+                yield chunk
+
+    def put(self, local_path, path):
+        dst = self._local(path)
+        dir_name = os.path.dirname(dst)
+        if dir_name and not os.path.isdir(dir_name):
+            try:
+                os.makedirs(dir_name)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        shutil.copyfile(local_path, dst)
@@ -1,16 +1,16 @@
 # -*- coding: utf-8 -*-
 
-import argparse
 import itertools
 import logging
 import os
 from operator import itemgetter
 import sys
+import time
 
-from runner.hadoop import HadoopRunner
-from runner.local import LocalRunner
-from protocol import TextValueProtocol, PickleProtocol
-from util import flatten
+from protocol import TextValueProtocol, BinaryPickleProtocol, KeyFieldProtocol, TypedBytesProtocol
+from step import MRStep
+from sink import OutputSink, CombiningSink, SaltingSink, DEFAULT_BUFFER_SIZE
+from util import combine_key_value, LazyValues
 
 
 logger = logging.getLogger('mrjob')
@@ -21,8 +21,175 @@ logger.addHandler(handler)
 logger.propagate = False
 
 
+# options of mapper/combiner/reducer tasks started by runners, e.g.
+# `python wc.py --reducer --step-num 1`. option: (name, type), type is None for
+# switches.
+TASK_OPTIONS = {
+    '--mapper': ('run_mapper', None),
+    '--combiner': ('run_combiner', None),
+    '--reducer': ('run_reducer', None),
+    '--step-num': ('step_num', int),
+    '--io': ('io', str),
+    '--profile': ('profile', None),
+    '--profile-dir': ('profile_dir', str),
+    '--split-path': ('split_path', str),
+    '--split-offset': ('split_offset', int),
+    '--split-length': ('split_length', int),
+}
+
+TASK_DEFAULTS = {
+    'run_mapper': False,
+    'run_combiner': False,
+    'run_reducer': False,
+    'step_num': 0,
+    'io': 'text',
+    'profile': False,
+    'profile_dir': None,
+    'split_path': None,
+    'split_offset': 0,
+    'split_length': None,
+}
+
+
+def _parse_task_args(args):
+    """parse command line `args` of a mapper/combiner/reducer task, without
+    building an argparse parser, which is slow to import and to set up.
+
+    :return: a dict of options, or None if `args` don't start a task, or have
+        anything but options in TASK_OPTIONS (left to argparse to complain
+        about)
+    """
+    options = dict(TASK_DEFAULTS)
+    i = 0
+    while i < len(args):
+        flag, eq, value = args[i].partition('=')
+        if flag not in TASK_OPTIONS:
+            return None
+        name, type_ = TASK_OPTIONS[flag]
+        if type_ is None:
+            if eq:
+                return None
+            options[name] = True
+        else:
+            if not eq:
+                i += 1
+                if i == len(args):
+                    return None
+                value = args[i]
+            try:
+                options[name] = type_(value)
+            except ValueError:
+                return None
+        i += 1
+
+    if not (options['run_mapper'] or options['run_combiner'] or options['run_reducer']):
+        return None
+    if options['io'] not in ('text', 'typedbytes'):
+        return None
+    return options
+
+
+def _salted(fun):
+    """wrap combiner `fun` of a step with salted keys, to combine by the
+    original keys, and to keep the salt of each group in its output"""
+    def combiner(salted_key, values):
+        key, salt = salted_key
+        for out_key, out_value in fun(key, values) or ():
+            yield (out_key, salt), out_value
+    return combiner
+
+
+def _unsalted(fun):
+    """wrap reducer `fun` of a step with salted keys, to reduce each salted
+    group by its original key"""
+    def reducer(salted_key, values):
+        return fun(salted_key[0], values)
+    return reducer
+
+
+def _with_salt(fun, salt=None):
+    """wrap init/final hooks of combiner `fun`, to salt keys of its output
+    with `salt`"""
+    def hook():
+        for out_key, out_value in fun() or ():
+            yield (out_key, salt), out_value
+    return hook
+
+
+def _reporter_text(text):
+    """decode `text` (a counter name or a status message), and replace line
+    breaks, which would end a ``reporter:`` line of hadoop streaming"""
+    if isinstance(text, bytes):
+        text = text.decode('utf8')
+    return text.replace(u'\n', u' ').replace(u'\r', u' ')
+
+
 class MRJob(object):
-    """map-reducer job base class"""
+    """map-reducer job base class
+
+    `combiner` and `reducer` are called with a key and a lazy iterator of its
+    values (see `LazyValues`), which decodes each value only when it is
+    consumed. ``values.count()`` consumes the remaining values without
+    decoding them, and returns how many there were, e.g.::
+
+        def reducer(self, key, values):
+            yield key, values.count()
+    """
+
+    # task output is written in blocks of this size (in bytes). set it to 0 to
+    # flush every single record.
+    OUTPUT_BUFFER_SIZE = DEFAULT_BUFFER_SIZE
+
+    # protocols (classes) used to read input, to pass data between
+    # mapper/combiner/reducer, and to write output
+    INPUT_PROTOCOL = TextValueProtocol
+    INTERNAL_PROTOCOL = BinaryPickleProtocol
+    OUTPUT_PROTOCOL = TextValueProtocol
+
+    # in-mapper combining: buffer mapper output by key, and apply `combiner`
+    # inside the mapper whenever the buffer holds more than MAPPER_COMBINE_MAX_KEYS
+    # keys or (roughly) MAPPER_COMBINE_MAX_BYTES bytes, and at the end of mapper.
+    # the combiner is then not run as a separate step.
+    MAPPER_COMBINE = False
+    MAPPER_COMBINE_MAX_KEYS = 100000
+    MAPPER_COMBINE_MAX_BYTES = 64 * 1024 * 1024
+
+    # number of input lines passed to each `mapper_batch` call
+    MAPPER_BATCH_SIZE = 1000
+
+    # secondary sort: with KEY_FIELDS set, keys are tuples of KEY_FIELDS fields,
+    # which are partitioned and grouped (for reducer) by their first
+    # PARTITION_FIELDS fields, and sorted by SORT_FIELDS, a sequence of field
+    # indexes or `(index, reverse)` tuples (all fields in ascending order by
+    # default). KeyFieldProtocol is used as the internal protocol.
+    KEY_FIELDS = None
+    PARTITION_FIELDS = 1
+    SORT_FIELDS = None
+
+    # counters and status (see `increment_counter` and `set_status`) are
+    # aggregated in memory, and written to stderr at most once in this many
+    # seconds, and at the end of each task
+    COUNTER_FLUSH_INTERVAL = 10
+
+    # hot-key salting, for skewed keys of steps with an associative reducer
+    # (e.g. sum, max): with SALT_HOT_KEYS set, mappers count their output keys
+    # with a sketch of HOT_KEY_SKETCH_SIZE keys, and a key becomes hot once it
+    # has more than HOT_KEY_MIN_RECORDS records, and more than HOT_KEY_FRACTION
+    # of the mapper output so far. Records of hot keys are spread over
+    # HOT_KEY_SALTS salted keys, which are reduced to partial results, and a
+    # second step is inserted after each such step, where the reducer merges
+    # partial results by the original keys. The reducer should yield its input
+    # key, with a value that it accepts as input again.
+    SALT_HOT_KEYS = False
+    HOT_KEY_SALTS = 16
+    HOT_KEY_SKETCH_SIZE = 1000
+    HOT_KEY_FRACTION = 0.01
+    HOT_KEY_MIN_RECORDS = 1000
+
+    # fail the task on input lines which can't be decoded by the protocol.
+    # set it to False to skip such lines, which are counted as
+    # `decode_errors` in group `mrjob` either way.
+    STRICT_PROTOCOLS = True
 
     def __init__(self):
         # always read and write bytes, instead of unicodes
@@ -31,9 +198,21 @@ class MRJob(object):
         self._stdout = getattr(sys.stdout, 'buffer', sys.stdout)
         self._stderr = getattr(sys.stderr, 'buffer', sys.stderr)
 
-        self.input_protocol = TextValueProtocol()
-        self.internal_protocol = PickleProtocol()
-        self.output_protocol = TextValueProtocol()
+        self.input_protocol = self.INPUT_PROTOCOL()
+        key_fields = self._key_fields()
+        if key_fields:
+            self.internal_protocol = KeyFieldProtocol(key_fields[0])
+        else:
+            self.internal_protocol = self.INTERNAL_PROTOCOL()
+        self.output_protocol = self.OUTPUT_PROTOCOL()
+
+        # data passed from a step to the next one of multi-step jobs
+        self._step_protocol = self.INTERNAL_PROTOCOL()
+
+        # counters and status not written yet
+        self._counters = {}
+        self._status = None
+        self._next_counter_flush = time.time() + self.COUNTER_FLUSH_INTERVAL
 
         # enable logging if user haven't
         logging.basicConfig(level=logging.INFO)
@@ -44,12 +223,21 @@ class MRJob(object):
     #     """for end users to implement"""
     #     raise NotImplementedError
 
+    # def mapper_batch(self, lines):
+    #     """for end users to implement, instead of `mapper`.
+    #     `lines` is a list of up to MAPPER_BATCH_SIZE input lines (bytes,
+    #     without trailing newline; `input_protocol` is not used). Yield
+    #     `(key, value)` pairs, or return a tuple of two equal-length sequences
+    #     `(keys, values)`, e.g. arrays computed in a vectorized way."""
+    #     raise NotImplementedError
+
     # def combiner(self, key, values):
-    #     """for end users to implement"""
+    #     """for end users to implement. `values` is a `LazyValues`"""
     #     raise NotImplementedError
 
     # def reducer(self, key, values):
-    #     """for end users to implement"""
+    #     """for end users to implement. `values` is a `LazyValues`, use
+    #     `values.count()` to count values without decoding them"""
     #     raise NotImplementedError
 
     # def mapper_init(self):
@@ -71,96 +259,511 @@ class MRJob(object):
     #     raise NotImplementedError
     # -----------------------------------------------------------
 
-    def _has_mr_fun(self, fun_name):
-        """check if mapper/combiner/reducer is overided by sub-class"""
-        for s in ('mapper', 'combiner', 'reducer'):
-            if fun_name.startswith(s): break
+    def increment_counter(self, group, counter, amount=1):
+        """increment hadoop counter `counter` of `group` by `amount`.
+
+        Increments are summed up in memory, and written to stderr in the format
+        of hadoop streaming (``reporter:counter:group,counter,amount``) every
+        COUNTER_FLUSH_INTERVAL seconds and at the end of the task, so it's
+        cheap to call this method for each record.
+        Commas are not allowed in names, and are replaced with semicolons.
+        """
+        if not isinstance(group, basestring) or not isinstance(counter, basestring):
+            raise ValueError('group and counter should be strings')
+        if not isinstance(amount, (int, long)):
+            raise ValueError('amount of counter should be an integer')
+
+        key = (_reporter_text(group).replace(u',', u';'), _reporter_text(counter).replace(u',', u';'))
+        self._counters[key] = self._counters.get(key, 0) + amount
+        if time.time() >= self._next_counter_flush:
+            self._flush_counters()
+
+    def set_status(self, msg):
+        """set status message of the task, which is written to stderr in the
+        format of hadoop streaming (``reporter:status:msg``) together with
+        counters, see `increment_counter`. Only the latest message is kept.
+        """
+        if not isinstance(msg, basestring):
+            raise ValueError('status message should be a string')
+        self._status = _reporter_text(msg)
+        if time.time() >= self._next_counter_flush:
+            self._flush_counters()
+
+    def _flush_counters(self):
+        """write counters and status set since the last flush to stderr"""
+        lines = [u'reporter:counter:{},{},{}\n'.format(group, counter, amount)
+                 for (group, counter), amount in sorted(self._counters.items())]
+        if self._status is not None:
+            lines.append(u'reporter:status:{}\n'.format(self._status))
+        if lines:
+            self._stderr.write(u''.join(lines).encode('utf8'))
+            self._stderr.flush()
+        self._counters.clear()
+        self._status = None
+        self._next_counter_flush = time.time() + self.COUNTER_FLUSH_INTERVAL
+
+    def _count_output(self, stage, sink):
+        """count records and bytes written by `stage` into `sink`"""
+        self.increment_counter('mrjob', stage + '_output_records', sink.records)
+        self.increment_counter('mrjob', stage + '_output_bytes', sink.bytes)
+
+    # steps of the job, see `steps`, and the step currently running
+    _steps = None
+    _step_num = 0
+
+    # numbers of steps whose mapper salts hot keys, see `_salt_steps`
+    _salted_steps = ()
+
+    # profiler of the running task, see `_run_task`
+    _profiler = None
+
+    def steps(self):
+        """override this method to define a multi-step job: return a list of
+        `MRStep`, each of which has its own mapper/combiner/reducer and their
+        init/final hooks. Output of each step is passed to the next one.
+
+        By default, the job has a single step of the methods defined above.
+        """
+        funs = dict((name, getattr(self, name, None)) for name in MRStep.FUN_NAMES)
+        return [MRStep(**funs)]
+
+    def _get_steps(self):
+        if self._steps is None:
+            steps = list(self.steps())
+            if not steps:
+                raise ValueError('a job should have at least one step')
+            for step_num, step in enumerate(steps):
+                if not (step.get('mapper') or step.get('mapper_batch') or step.get('reducer')):
+                    raise ValueError('step {} should have a mapper or a reducer'.format(step_num))
+                if step_num > 0 and step.get('mapper_batch'):
+                    raise ValueError('only the first step can use mapper_batch')
+            if self.SALT_HOT_KEYS:
+                steps = self._salt_steps(steps)
+            self._steps = steps
+        return self._steps
+
+    def _salt_steps(self, steps):
+        """split each step with a reducer into a step that reduces salted keys
+        to partial results, and a step that merges partial results by the
+        original keys, see SALT_HOT_KEYS.
+        :return: the new list of steps"""
+        if self.KEY_FIELDS:
+            raise ValueError('SALT_HOT_KEYS is not supported with secondary sort (KEY_FIELDS)')
+        if not isinstance(self.HOT_KEY_SALTS, (int, long)) or self.HOT_KEY_SALTS <= 0:
+            raise ValueError('HOT_KEY_SALTS should be a positive integer')
+
+        res = []
+        salted_steps = set()
+        for step_num, step in enumerate(steps):
+            reducer = step.get('reducer')
+            if reducer is None:
+                res.append(step)
+                continue
+            if step.get('reducer_init') or step.get('reducer_final'):
+                raise ValueError('SALT_HOT_KEYS is not supported with reducer_init or reducer_final '
+                                 '(step {})'.format(step_num))
+            if step_num == 0 and not (step.get('mapper') or step.get('mapper_batch')):
+                raise ValueError('SALT_HOT_KEYS needs a mapper to salt keys (step 0)')
+
+            funs = dict((name, step.get(name)) for name in MRStep.FUN_NAMES)
+            if funs['combiner']:
+                funs['combiner'] = _salted(funs['combiner'])
+            for name in ('combiner_init', 'combiner_final'):
+                if funs[name]:
+                    funs[name] = _with_salt(funs[name])
+            funs['reducer'] = _unsalted(reducer)
+
+            salted_steps.add(len(res))
+            res.append(MRStep(**funs))
+            res.append(MRStep(reducer=reducer))
+
+        if not salted_steps:
+            raise ValueError('SALT_HOT_KEYS needs a step with a reducer')
+        self._salted_steps = salted_steps
+        return res
+
+    def _num_steps(self):
+        return len(self._get_steps())
+
+    def _is_last_step(self, step_num=None):
+        return (self._step_num if step_num is None else step_num) == self._num_steps() - 1
+
+    def _mr_fun(self, fun_name, step_num=None):
+        """get mapper/combiner/reducer (or their init/final hooks) of a step,
+        the current step by default. When profiling, the function is wrapped
+        to be timed as user code."""
+        step = self._get_steps()[self._step_num if step_num is None else step_num]
+        fun = step.get(fun_name)
+        if fun is not None and self._profiler is not None:
+            fun = self._profiler.timed_user_fun(fun)
+        return fun
+
+    def _timed(self, phase, fun):
+        """wrap `fun` to be timed as `phase` when profiling"""
+        if self._profiler is None:
+            return fun
+        return self._profiler.timed(phase, fun)
+
+    def _timed_iter(self, phase, iterable):
+        """wrap `iterable` to be timed as `phase` when profiling"""
+        if self._profiler is None:
+            return iterable
+        return self._profiler.timed_iter(phase, iterable)
+
+    def _combines_in_mapper(self, step_num=None):
+        """check if combiner is applied inside mapper"""
+        return bool(self.MAPPER_COMBINE) and self._has_mr_fun('combiner', step_num)
+
+    def _has_mr_step(self, name, step_num=None):
+        """check if mapper/combiner/reducer should run as a separate stage"""
+        if name == 'mapper':
+            # later steps always run mapper, which passes on the output of the
+            # previous step if there is no mapper function, so that it is
+            # encoded for the shuffle
+            if (self._step_num if step_num is None else step_num) > 0:
+                return True
+            return self._has_mr_fun('mapper', step_num) or self._has_mr_fun('mapper_batch', step_num)
+        if name == 'combiner':
+            return self._has_mr_fun('combiner', step_num) and not self._combines_in_mapper(step_num)
+        return self._has_mr_fun(name, step_num)
+
+    def _key_fields(self):
+        """check secondary sort settings.
+        :return: None if KEY_FIELDS is not set, or a tuple of
+            ``(num_fields, partition_fields, sort_fields)``, where `sort_fields`
+            is a list of ``(index, reverse)`` tuples.
+        """
+        if not self.KEY_FIELDS:
+            return None
+
+        num_fields = self.KEY_FIELDS
+        if not isinstance(num_fields, (int, long)) or num_fields <= 0:
+            raise ValueError('KEY_FIELDS should be a positive integer')
+
+        partition_fields = self.PARTITION_FIELDS
+        if not isinstance(partition_fields, (int, long)) or not 0 < partition_fields <= num_fields:
+            raise ValueError('PARTITION_FIELDS should be an integer between 1 and KEY_FIELDS')
+
+        if self.SORT_FIELDS is None:
+            sort_fields = [(i, False) for i in range(num_fields)]
         else:
-            return False
-
-        return bool(getattr(self, fun_name, None))
-
-    def _read_lines(self, protocol):
+            sort_fields = []
+            for field in self.SORT_FIELDS:
+                index, reverse = field if isinstance(field, tuple) else (field, False)
+                if not isinstance(index, (int, long)) or not 0 <= index < num_fields:
+                    raise ValueError('invalid field of SORT_FIELDS: {!r}'.format(field))
+                sort_fields.append((index, bool(reverse)))
+
+        # each group of reducer must be sorted together
+        if set(i for i, _ in sort_fields[:partition_fields]) != set(range(partition_fields)):
+            raise ValueError('SORT_FIELDS should start with the first PARTITION_FIELDS fields')
+
+        return num_fields, partition_fields, sort_fields
+
+    def _has_mr_fun(self, fun_name, step_num=None):
+        """check if mapper/combiner/reducer is defined in a step, the current
+        step by default"""
+        return self._mr_fun(fun_name, step_num) is not None
+
+    def _has_reducer(self):
+        """check if any step of the job has a reducer"""
+        return any(self._has_mr_fun('reducer', i) for i in range(self._num_steps()))
+
+    def _read_lines(self, protocol, stage):
+        """read and decode input lines of `stage`, counting records, bytes and
+        lines which can't be decoded"""
+        read = protocol.read
+        num_records = num_bytes = 0
         for line in self._stdin:
-            key, value = protocol.read(line.rstrip(b'\r\n'))
+            num_records += 1
+            num_bytes += len(line)
+            try:
+                key, value = read(line.rstrip(b'\r\n'))
+            except Exception:
+                self.increment_counter('mrjob', 'decode_errors')
+                if self.STRICT_PROTOCOLS:
+                    raise
+                continue
             yield key, value
+        self.increment_counter('mrjob', stage + '_input_records', num_records)
+        self.increment_counter('mrjob', stage + '_input_bytes', num_bytes)
+
+    def _counted(self, stage, records):
+        """yield `records`, and count them as input records of `stage`"""
+        num_records = 0
+        for num_records, record in enumerate(records, 1):
+            yield record
+        self.increment_counter('mrjob', stage + '_input_records', num_records)
+
+    def _counted_raw_pairs(self, stage, raw_pairs, delimiters):
+        """yield `raw_pairs`, and count them as input records and bytes of
+        `stage`. Each pair is counted with `delimiters` more bytes (a tab and a
+        newline of text lines)."""
+        num_records = num_bytes = 0
+        for raw_pair in raw_pairs:
+            num_records += 1
+            num_bytes += len(raw_pair[0]) + len(raw_pair[1]) + delimiters
+            yield raw_pair
+        self.increment_counter('mrjob', stage + '_input_records', num_records)
+        self.increment_counter('mrjob', stage + '_input_bytes', num_bytes)
+
+    def _map_batches(self, lines):
+        """call `mapper_batch` over batches of input lines, and yield its output"""
+        lines = (line.rstrip(b'\r\n') for line in lines)
+        batch_size = self.MAPPER_BATCH_SIZE
+        mapper_batch = self._mr_fun('mapper_batch', 0)
+        num_records = num_bytes = 0
+        while True:
+            batch = list(itertools.islice(lines, batch_size))
+            if not batch:
+                break
+            num_records += len(batch)
+            num_bytes += sum(len(line) + 1 for line in batch)
+            out = mapper_batch(batch)
+            if isinstance(out, tuple):
+                keys, values = out
+                out = zip(keys, values)
+            for out_key, out_value in out or ():
+                yield out_key, out_value
+        self.increment_counter('mrjob', 'mapper_input_records', num_records)
+        self.increment_counter('mrjob', 'mapper_input_bytes', num_bytes)
+
+    def _read_pairs(self, protocol, stage):
+        """read key-value pairs of the previous stage"""
+        if isinstance(protocol, TypedBytesProtocol):
+            return self._counted(stage, protocol.read_pairs(self._stdin))
+        return self._read_lines(protocol, stage)
+
+    def _read_groups(self, protocol, stage, group_fields=None):
+        """read key-value pairs of the previous stage, and group them by key,
+        or by the first `group_fields` fields of keys (secondary sort).
+
+        Pairs are grouped on their raw (encoded) keys, each key is decoded only
+        once, and values are decoded lazily as they are consumed.
+        """
+        if not hasattr(protocol, 'read_raw_pairs'):
+            pairs = self._timed_iter('read', self._read_pairs(protocol, stage))
+            for key, kv_pairs in itertools.groupby(pairs, key=itemgetter(0)):
+                yield key, LazyValues(kv_pairs)
+            return
 
-    def _write_line(self, key, value, protocol):
-        self._stdout.write(protocol.write(key, value) + b'\n')
-        self._stdout.flush()
+        group_key = itemgetter(0)
+        if group_fields is not None:
+            group_key = lambda pair: pair[0].split(b'\t', group_fields)[:group_fields]
+
+        loads_key = self._timed('read', protocol._loads_key)
+        loads = self._timed('read', protocol._loads)
+        delimiters = 0 if isinstance(protocol, TypedBytesProtocol) else 2
+        raw_pairs = self._counted_raw_pairs(stage, protocol.read_raw_pairs(self._stdin), delimiters)
+        for raw_key, raw_pairs in itertools.groupby(self._timed_iter('read', raw_pairs), key=group_key):
+            if group_fields is not None:
+                raw_key = b'\t'.join(raw_key)
+            yield loads_key(raw_key), LazyValues(raw_pairs, loads)
+
+    def _make_sink(self, protocol):
+        delimiter = b'' if isinstance(protocol, TypedBytesProtocol) else b'\n'
+        sink = OutputSink(self._stdout, protocol, self.OUTPUT_BUFFER_SIZE, delimiter)
+        if self._profiler is not None:
+            sink.write = self._profiler.timed('write', sink.write)
+            sink.flush = self._profiler.timed('write', sink.flush)
+        return sink
 
     def _run_mapper(self):
+        # map-only steps pass their output to the next step, not to the shuffle
+        if self._has_mr_fun('reducer') or self._is_last_step():
+            sink = self._make_sink(self.internal_protocol)
+        else:
+            sink = self._make_sink(self._step_protocol)
+
+        if self._combines_in_mapper():
+            if self._has_mr_fun('combiner_init'):
+                logger.info('running combiner_init ...')
+                for out_key, out_value in self._mr_fun('combiner_init')() or ():
+                    sink.write(out_key, out_value)
+                logger.info('combiner_init completed')
+
+            output_sink = sink
+            sink = CombiningSink(
+                output_sink, self._mr_fun('combiner'),
+                self.MAPPER_COMBINE_MAX_KEYS, self.MAPPER_COMBINE_MAX_BYTES)
+
+        write = sink.write
+
+        salting_sink = None
+        if self._step_num in self._salted_steps:
+            salting_sink = self._salting_sink(sink)
+            write = salting_sink.write
+
         if self._has_mr_fun('mapper_init'):
             logger.info('running mapper_init ...')
-            for out_key, out_value in self.mapper_init() or ():
-                self._write_line(out_key, out_value, self.internal_protocol)
+            for out_key, out_value in self._mr_fun('mapper_init')() or ():
+                write(out_key, out_value)
             logger.info('mapper_init completed')
 
         logger.info('running mapper ...')
-        for key, value in self._read_lines(self.input_protocol):
-            for out_key, out_value in self.mapper(key, value) or ():
-                self._write_line(out_key, out_value, self.internal_protocol)
+        if self._has_mr_fun('mapper_batch'):
+            for out_key, out_value in self._map_batches(self._timed_iter('read', self._stdin)):
+                write(out_key, out_value)
+        else:
+            # later steps read the output of the previous step
+            protocol = self.input_protocol if self._step_num == 0 else self._step_protocol
+            mapper = self._mr_fun('mapper')
+            for key, value in self._timed_iter('read', self._read_lines(protocol, 'mapper')):
+                if mapper is None:
+                    write(key, value)
+                    continue
+                for out_key, out_value in mapper(key, value) or ():
+                    write(out_key, out_value)
+        sink.flush()
         logger.info('mapper completed')
 
         if self._has_mr_fun('mapper_final'):
             logger.info('running mapper_final ...')
-            for out_key, out_value in self.mapper_final() or ():
-                self._write_line(out_key, out_value, self.internal_protocol)
+            for out_key, out_value in self._mr_fun('mapper_final')() or ():
+                write(out_key, out_value)
+            sink.flush()
             logger.info('mapper_final completed')
 
+        if self._combines_in_mapper():
+            if self._has_mr_fun('combiner_final'):
+                logger.info('running combiner_final ...')
+                for out_key, out_value in self._mr_fun('combiner_final')() or ():
+                    output_sink.write(out_key, out_value)
+                output_sink.flush()
+                logger.info('combiner_final completed')
+
+            logger.info('in-mapper combining reduced {} records to {} ({:.1%})'.format(
+                sink.input_records, sink.output_records,
+                float(sink.output_records) / max(sink.input_records, 1)))
+            self.increment_counter('mrjob', 'mapper_combine_input_records', sink.input_records)
+            self.increment_counter('mrjob', 'mapper_combine_output_records', sink.output_records)
+            sink = output_sink
+
+        if salting_sink is not None:
+            self._count_salting(salting_sink)
+
+        self._count_output('mapper', sink)
+
+    def _salting_sink(self, sink):
+        """make a `SaltingSink` over `sink` for mapper output of a salted step"""
+        return SaltingSink(sink, self.HOT_KEY_SALTS, self.HOT_KEY_SKETCH_SIZE,
+                           self.HOT_KEY_FRACTION, self.HOT_KEY_MIN_RECORDS)
+
+    def _count_salting(self, salting_sink):
+        """log and count hot keys and salted records of `salting_sink`"""
+        logger.info('salted {} hot keys, {} of {} records ({:.1%})'.format(
+            len(salting_sink.hot_keys), salting_sink.salted_records, salting_sink.records,
+            float(salting_sink.salted_records) / max(salting_sink.records, 1)))
+        self.increment_counter('mrjob', 'hot_keys', len(salting_sink.hot_keys))
+        self.increment_counter('mrjob', 'salted_records', salting_sink.salted_records)
+
+    def _salt_pairs(self, pairs):
+        """salt keys of mapper output `pairs` of a salted step, for runners
+        which call mapper in-process"""
+        salting_sink = self._salting_sink(None)
+        salt = salting_sink.salt
+        for key, value in pairs:
+            yield salt(key), value
+        self._count_salting(salting_sink)
+
     def _run_combiner(self):
+        sink = self._make_sink(self.internal_protocol)
+        write = sink.write
+
         if self._has_mr_fun('combiner_init'):
             logger.info('running combiner_init ...')
-            for out_key, out_value in self.combiner_init() or ():
-                self._write_line(out_key, out_value, self.internal_protocol)
+            for out_key, out_value in self._mr_fun('combiner_init')() or ():
+                write(out_key, out_value)
             logger.info('combiner_init completed')
 
         logger.info('running combiner ...')
-        for key, kv_pairs in itertools.groupby(
-                self._read_lines(self.internal_protocol), key=itemgetter(0)):
-            values = (v for k, v in kv_pairs)
-            for out_key, out_value in self.combiner(key, values) or ():
-                self._write_line(out_key, out_value, self.internal_protocol)
+        combiner = self._mr_fun('combiner')
+        for key, values in self._read_groups(self.internal_protocol, 'combiner'):
+            for out_key, out_value in combiner(key, values) or ():
+                write(out_key, out_value)
+        sink.flush()
         logger.info('combiner completed')
 
         if self._has_mr_fun('combiner_final'):
             logger.info('running combiner_final ...')
-            for out_key, out_value in self.combiner_final() or ():
-                self._write_line(out_key, out_value, self.internal_protocol)
+            for out_key, out_value in self._mr_fun('combiner_final')() or ():
+                write(out_key, out_value)
+            sink.flush()
             logger.info('combiner_final completed')
 
+        self._count_output('combiner', sink)
+
     def _run_reducer(self):
+        if self._is_last_step():
+            sink = self._make_sink(self.output_protocol)
 
-        # out_key or out_value might be None and should not be output when being None,
-        # so we merge out_key into out_value and use TextValueProtocol,
-        # instead of TextProtocol, as the output protocol.
-        def combine_key_value(key, value):
-            if key is None and value is None:
-                raise ValueError('reducer should return `(key, value)` pairs, and at least one is not None.')
-            if key is None: return value
-            if value is None: return key
-            return flatten([key, value])
+            def write(key, value):
+                sink.write(None, combine_key_value(key, value))
+        else:
+            # pass output to the next step
+            sink = self._make_sink(self._step_protocol)
+            write = sink.write
 
         if self._has_mr_fun('reducer_init'):
             logger.info('running reducer_init ...')
-            for out_key, out_value in self.reducer_init() or ():
-                self._write_line(None, combine_key_value(out_key, out_value), self.output_protocol)
+            for out_key, out_value in self._mr_fun('reducer_init')() or ():
+                write(out_key, out_value)
             logger.info('reducer_init completed')
 
+        # with secondary sort, reducer is called for each group of partition fields
+        key_fields = self._key_fields()
+        group_fields = key_fields[1] if key_fields else None
+
         logger.info('running reducer ...')
-        for key, kv_pairs in itertools.groupby(
-                self._read_lines(self.internal_protocol), key=itemgetter(0)):
-            values = (v for k, v in kv_pairs)
-            for out_key, out_value in self.reducer(key, values) or ():
-                self._write_line(None, combine_key_value(out_key, out_value), self.output_protocol)
+        reducer = self._mr_fun('reducer')
+        for key, values in self._read_groups(self.internal_protocol, 'reducer', group_fields):
+            for out_key, out_value in reducer(key, values) or ():
+                write(out_key, out_value)
+        sink.flush()
         logger.info('reducer completed')
 
         if self._has_mr_fun('reducer_final'):
             logger.info('running reducer_final ...')
-            for out_key, out_value in self.reducer_final() or ():
-                self._write_line(None, combine_key_value(out_key, out_value), self.output_protocol)
+            for out_key, out_value in self._mr_fun('reducer_final')() or ():
+                write(out_key, out_value)
+            sink.flush()
             logger.info('reducer_final completed')
 
+        self._count_output('reducer', sink)
+
+    def _run_task(self, name, profile=False, profile_dir=None):
+        """run mapper/combiner/reducer of the current step, and write its
+        counters to stderr. With `profile`, the task runs under
+        `TaskProfiler`, its report is written to stderr, and profile data is
+        saved into `profile_dir` if it's given."""
+        run = getattr(self, '_run_' + name)
+        if not profile:
+            try:
+                run()
+            finally:
+                self._flush_counters()
+            return
+
+        # the profiler is imported only by tasks which are profiled
+        from profiling import TaskProfiler
+        profiler = self._profiler = TaskProfiler()
+        try:
+            profiler.run(run)
+        finally:
+            self._profiler = None
+            self._flush_counters()
+
+        report = profiler.report('{} of step {} (pid {})'.format(name, self._step_num, os.getpid()))
+        if not isinstance(report, bytes):
+            report = report.encode('utf8')
+        self._stderr.write(report + b'\n')
+        self._stderr.flush()
+
+        if profile_dir:
+            path = os.path.join(profile_dir, 'step-{}-{}-{}.pstats'.format(self._step_num, name, os.getpid()))
+            profiler.dump_stats(path)
+            logger.info('profile data saved to {}'.format(path))
+
     @staticmethod
     def is_launched():
         """check if MRJob is initialized and then initialize it."""
@@ -175,17 +778,16 @@ class MRJob(object):
         """clear is_launched flag"""
         os.environ.pop('_MRJOB_LAUNCHED')
 
-    def run(self, runner='hadoop', **kwargs):
-        """入口函数，用户执行该方法即可启动作业"""
-        runner_class_mapper = {
-            'local': LocalRunner,
-            'hadoop': HadoopRunner,
-        }
+    def _parse_args(self):
+        """parse command line arguments of both launching a job and running a
+        task with argparse.
+        :return: a dict of options, and a list of arguments left for runners"""
+        import argparse
 
         parser = argparse.ArgumentParser()
         parser.add_argument(
             '-r', '--runner', dest='runner', default=None,
-            choices=runner_class_mapper.keys(),
+            choices=('local', 'inline', 'hadoop'),
             help='where to run the job')
         parser.add_argument(
             '--mapper', dest='run_mapper', default=False, action='store_true',
@@ -196,28 +798,80 @@ class MRJob(object):
         parser.add_argument(
             '--reducer', dest='run_reducer', default=False, action='store_true',
             help='run reducer')
+        parser.add_argument(
+            '--step-num', dest='step_num', type=int, default=0,
+            help='which step of a multi-step job to run')
+        parser.add_argument(
+            '--io', dest='io', default='text', choices=('text', 'typedbytes'),
+            help='format of data passed between mapper/combiner/reducer')
+        parser.add_argument(
+            '--profile', dest='profile', default=False, action='store_true',
+            help='profile mapper/combiner/reducer, and report to stderr')
+        parser.add_argument(
+            '--profile-dir', dest='profile_dir', default=None,
+            help='also save profile data of mapper/combiner/reducer into this directory')
+        parser.add_argument(
+            '--split-path', dest='split_path', default=None,
+            help='read input of mapper from this file, instead of stdin')
+        parser.add_argument(
+            '--split-offset', dest='split_offset', type=int, default=0,
+            help='where the input split of mapper starts in --split-path')
+        parser.add_argument(
+            '--split-length', dest='split_length', type=int, default=None,
+            help='bytes of the input split of mapper, up to the end of --split-path by default. '
+                 'compressed files are always read as a whole')
 
         args, unrecognized = parser.parse_known_args()
+        return vars(args), unrecognized
 
-        # 中间命令，只需调用相应方法
-        if args.run_mapper:
-            self._run_mapper()
-            return
-        if args.run_combiner:
-            self._run_combiner()
-            return
-        if args.run_reducer:
-            self._run_reducer()
-            return
+    def run(self, runner='hadoop', **kwargs):
+        """入口函数，用户执行该方法即可启动作业"""
+        # tasks are started many times by runners, so they take a shortcut
+        # around argparse and the import of runners
+        args = _parse_task_args(sys.argv[1:])
+        if args is None:
+            args, unrecognized = self._parse_args()
+
+        if not 0 <= args['step_num'] < self._num_steps():
+            raise ValueError('invalid step number: {}'.format(args['step_num']))
+        self._step_num = args['step_num']
+
+        # typed bytes mode: shuffle typed bytes instead of lines
+        if args['io'] == 'typedbytes':
+            self.internal_protocol = TypedBytesProtocol()
+
+        # 中间命令，只需调用相应方法。hadoop 上可通过环境变量（-cmdenv）开启 profile
+        profile = args['profile'] or os.environ.get('MRJOB_PROFILE', '') not in ('', '0')
+        profile_dir = args['profile_dir'] or os.environ.get('MRJOB_PROFILE_DIR')
+
+        # LocalRunner lets mappers read their input splits by themselves
+        if args['split_path'] is not None:
+            from runner.taskio import read_input_split
+            self._stdin = read_input_split(args['split_path'], args['split_offset'], args['split_length'])
+
+        for name in ('mapper', 'combiner', 'reducer'):
+            if args['run_' + name]:
+                self._run_task(name, profile, profile_dir)
+                return
 
         # set is_launched flag as True
         self._set_launch_flag()
 
         # 启动命令，由相应的 Runner 来执行，命令行中传入的 runner 可覆盖函数参数中传入的 runner。
         # 比如 HadoopRunner 会生成相应的 hadoop streaming 命令行并执行。
-        if getattr(args, 'runner', None):
-            runner = args.runner
-
+        if args.get('runner'):
+            runner = args['runner']
+
+        # runners are imported only when launching a job. they are not in the
+        # bundle shipped to hadoop tasks either
+        from runner.hadoop import HadoopRunner
+        from runner.inline import InlineRunner
+        from runner.local import LocalRunner
+        runner_class_mapper = {
+            'local': LocalRunner,
+            'inline': InlineRunner,
+            'hadoop': HadoopRunner,
+        }
         RunnerClass = runner_class_mapper[runner]
 
         # 将函数参数与命令行参数同时传给 runner。其中命令行参数会覆盖函数参数
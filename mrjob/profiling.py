@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class TaskProfiler(object):
+    """Profile a mapper/combiner/reducer task.
+
+    The task runs under cProfile, and its wall clock time is split into
+    framework phases: reading and decoding input (``read``), user code
+    (``user``), encoding and writing output (``write``), and everything else
+    (``other``, e.g. grouping and buffering). Functions and iterators wrapped
+    by `timed` and `timed_iter` switch to their phase while they run, and back
+    to the previous phase when they return, so that nested phases (e.g. values
+    decoded lazily inside a reducer) are not counted twice.
+    """
+
+    PHASES = ('read', 'user', 'write', 'other')
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.total_seconds = 0.0
+        self._phase = 'other'
+        self._since = None
+        # cProfile and pstats are only imported by tasks which are profiled
+        import cProfile
+        self._profile = cProfile.Profile()
+
+    def _switch(self, phase):
+        now = time.time()
+        self.seconds[self._phase] += now - self._since
+        self._since = now
+        prev, self._phase = self._phase, phase
+        return prev
+
+    def timed(self, phase, fun):
+        """wrap `fun`, so that calls to it are timed as `phase`"""
+        def wrapper(*args):
+            prev = self._switch(phase)
+            try:
+                return fun(*args)
+            finally:
+                self._switch(prev)
+        return wrapper
+
+    def timed_iter(self, phase, iterable):
+        """iterate over `iterable`, timing each step as `phase`"""
+        it = iter(iterable)
+        while True:
+            prev = self._switch(phase)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self._switch(prev)
+            yield item
+
+    def timed_user_fun(self, fun):
+        """wrap a user function (mapper, reducer, or their init/final hooks),
+        so that both calling it and iterating over its output are timed as
+        user code. Output which is not an iterator (e.g. None, or the tuple
+        returned by `mapper_batch`) is returned as it is."""
+        def wrapper(*args):
+            prev = self._switch('user')
+            try:
+                out = fun(*args)
+            finally:
+                self._switch(prev)
+            if out is None or isinstance(out, (tuple, list)):
+                return out
+            return self.timed_iter('user', out)
+        return wrapper
+
+    def run(self, fun):
+        """run `fun` under the profiler"""
+        start = self._since = time.time()
+        try:
+            self._profile.runcall(fun)
+        finally:
+            self._switch(self._phase)
+            self.total_seconds = time.time() - start
+
+    def report(self, title, num_functions=20):
+        """:return: report of time spent in each phase, and of the most
+            expensive functions by cumulative time"""
+        lines = ['profile of {}: {:.3f}s in total'.format(title, self.total_seconds)]
+        for phase in self.PHASES:
+            seconds = self.seconds[phase]
+            lines.append('  {:<6} {:>10.3f}s {:>6.1%}'.format(
+                phase, seconds, seconds / max(self.total_seconds, 1e-9)))
+
+        import pstats
+        stream = StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(num_functions)
+        lines.append(stream.getvalue())
+        return '\n'.join(lines)
+
+    def dump_stats(self, path):
+        """save profile data to `path`, which can be loaded by `pstats`"""
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.isdir(dir_name):
+            try:
+                os.makedirs(dir_name)
+            except OSError:
+                # created by another task
+                if not os.path.isdir(dir_name):
+                    raise
+        self._profile.dump_stats(path)
@@ -1,8 +1,21 @@
 # -*- coding: utf-8 -*-
 
-import inspect
 import json
 import pickle
+import re
+import string
+import struct
+from types import GeneratorType
+
+try:
+    import cPickle
+except ImportError:
+    cPickle = pickle
+
+try:
+    from cStringIO import StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
 
 
 class _KeyCachingProtocol(object):
@@ -18,6 +31,10 @@ class _KeyCachingProtocol(object):
         """Encode a single key/value, and return it."""
         raise NotImplementedError
 
+    def _loads_key(self, key):
+        """Decode a single key, and return it."""
+        return self._loads(key)
+
     def read(self, line):
         """Decode a line of input.
         :return: A tuple of ``(key, value)``."""
@@ -26,9 +43,15 @@ class _KeyCachingProtocol(object):
 
         if raw_key != self._last_key_encoded:
             self._last_key_encoded = raw_key
-            self._last_key_decoded = self._loads(raw_key)
+            self._last_key_decoded = self._loads_key(raw_key)
         return (self._last_key_decoded, self._loads(raw_value))
 
+    def read_raw_pairs(self, stream):
+        """Split lines of `stream` into ``(raw_key, raw_value)`` pairs, without
+        decoding them."""
+        for line in stream:
+            yield line.rstrip(b'\r\n').split(b'\t', 1)
+
     def write(self, key, value):
         """Encode a key and value.
         :return: A line, without trailing newline."""
@@ -40,7 +63,7 @@ class JSONProtocol(_KeyCachingProtocol):
         return json.loads(value)
 
     def _dumps(self, value):
-        if inspect.isgenerator(value):
+        if isinstance(value, GeneratorType):
             value = list(value)
         return json.dumps(value)
 
@@ -50,11 +73,279 @@ class PickleProtocol(_KeyCachingProtocol):
         return pickle.loads(value.decode('string_escape'))
 
     def _dumps(self, value):
-        if inspect.isgenerator(value):
+        if isinstance(value, GeneratorType):
             value = list(value)
         return pickle.dumps(value).encode('string_escape')
 
 
+def _escape(data):
+    """escape the bytes that break streaming text framing (\\t, \\n, \\r),
+    and the escape character itself"""
+    return (data.replace(b'\\', b'\\0')
+                .replace(b'\t', b'\\t')
+                .replace(b'\n', b'\\n')
+                .replace(b'\r', b'\\r'))
+
+
+def _unescape(data):
+    """reverse `_escape`. every backslash is followed by one of ``0tnr``, so
+    the replacements below can't interfere with each other."""
+    if b'\\' not in data:
+        return data
+    return (data.replace(b'\\t', b'\t')
+                .replace(b'\\n', b'\n')
+                .replace(b'\\r', b'\r')
+                .replace(b'\\0', b'\\'))
+
+
+class BinaryPickleProtocol(_KeyCachingProtocol):
+    """Pickle keys and values with the highest pickle protocol, escaping only
+    tabs, newlines, carriage returns and backslashes.
+
+    Much faster and more compact than `PickleProtocol`, which uses text
+    pickles and ``string_escape``. Keys are pickled without memoization, so
+    that equal keys are always encoded into equal bytes.
+
+    **This is the default internal protocol.**
+    """
+
+    def __init__(self):
+        self._key_buffer = BytesIO()
+        self._key_pickler = cPickle.Pickler(self._key_buffer, cPickle.HIGHEST_PROTOCOL)
+        self._key_pickler.fast = True
+
+    def _loads(self, value):
+        return cPickle.loads(_unescape(value))
+
+    def _dumps(self, value):
+        if isinstance(value, GeneratorType):
+            value = list(value)
+        return _escape(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+
+    def _dumps_key(self, key):
+        if isinstance(key, GeneratorType):
+            key = list(key)
+        buf = self._key_buffer
+        buf.seek(0)
+        buf.truncate()
+        self._key_pickler.dump(key)
+        return _escape(buf.getvalue())
+
+    def write(self, key, value):
+        return self._dumps_key(key) + b'\t' + self._dumps(value)
+
+
+# type tags of sort keys, in the order of the types. they are all above the
+# terminator/escape bytes below, and never clash with tabs or newlines.
+_SK_NONE = b'\x10'
+_SK_FALSE = b'\x11'
+_SK_TRUE = b'\x12'
+_SK_NEG_INT = b'\x13'
+_SK_ZERO = b'\x14'
+_SK_POS_INT = b'\x15'
+_SK_FLOAT = b'\x16'
+_SK_BYTES = b'\x17'
+_SK_UNICODE = b'\x18'
+_SK_TUPLE = b'\x19'
+
+# strings and tuples end with a terminator, which sorts before any content, so
+# that a prefix sorts before longer strings/tuples. bytes below 0x10 in
+# strings are escaped as `_SK_ESCAPE` followed by the byte plus 0x30.
+_SK_END = b'\x01'
+_SK_ESCAPE = b'\x02'
+_SK_ESCAPE_RE = re.compile(b'[\x00-\x0f]')
+_SK_UNESCAPE_RE = re.compile(b'\x02([\x30-\x3f])')
+
+_SK_DOUBLE = struct.Struct('>Q')
+_SK_SIGN_BIT = 1 << 63
+_SK_ALL_BITS = (1 << 64) - 1
+
+# hex digits, reversed, so that larger magnitudes of negative ints sort first
+_SK_COMPLEMENT = string.maketrans(b'0123456789abcdef', b'fedcba9876543210')
+
+
+def _sk_hex(n):
+    return ('%x' % n).encode('ascii')
+
+
+def _sk_encode(obj, parts):
+    if obj is None:
+        parts.append(_SK_NONE)
+    elif obj is True:
+        parts.append(_SK_TRUE)
+    elif obj is False:
+        parts.append(_SK_FALSE)
+    elif isinstance(obj, (int, long)):
+        if obj == 0:
+            parts.append(_SK_ZERO)
+            return
+        # hex digits, preceded by their number, which is itself preceded by
+        # its length, so that longer numbers sort after shorter ones
+        digits = _sk_hex(abs(obj))
+        length = _sk_hex(len(digits))
+        if obj > 0:
+            parts.extend((_SK_POS_INT, chr(0x30 + len(length)).encode('ascii'),
+                          length, digits))
+        else:
+            parts.extend((_SK_NEG_INT, chr(0x39 - len(length)).encode('ascii'),
+                          length.translate(_SK_COMPLEMENT), digits.translate(_SK_COMPLEMENT)))
+    elif isinstance(obj, float):
+        # flip the sign bit of positive numbers, and all bits of negative
+        # ones, so that the ieee 754 bits sort as numbers
+        bits = _SK_DOUBLE.unpack(struct.pack('>d', obj + 0.0))[0]
+        bits = bits ^ _SK_ALL_BITS if bits & _SK_SIGN_BIT else bits | _SK_SIGN_BIT
+        parts.append(_SK_FLOAT)
+        parts.append(('%016x' % bits).encode('ascii'))
+    elif isinstance(obj, bytes):
+        parts.extend((_SK_BYTES, _sk_escape(obj), _SK_END))
+    elif isinstance(obj, unicode):
+        # utf-8 preserves the order of code points
+        parts.extend((_SK_UNICODE, _sk_escape(obj.encode('utf-8')), _SK_END))
+    elif isinstance(obj, (tuple, list)) or isinstance(obj, GeneratorType):
+        parts.append(_SK_TUPLE)
+        for item in obj:
+            _sk_encode(item, parts)
+        parts.append(_SK_END)
+    else:
+        raise TypeError('unsupported type of sort key: {}'.format(type(obj).__name__))
+
+
+def _sk_escape(data):
+    return _SK_ESCAPE_RE.sub(lambda m: _SK_ESCAPE + chr(ord(m.group()) + 0x30).encode('latin-1'), data)
+
+
+def _sk_unescape(data):
+    if _SK_ESCAPE not in data:
+        return data
+    return _SK_UNESCAPE_RE.sub(lambda m: chr(ord(m.group(1)) - 0x30).encode('latin-1'), data)
+
+
+def _sk_decode(data, pos):
+    """decode the sort key starting at `pos` of `data`.
+    :return: A tuple of ``(obj, end position)``."""
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == _SK_NONE:
+        return None, pos
+    if tag == _SK_TRUE:
+        return True, pos
+    if tag == _SK_FALSE:
+        return False, pos
+    if tag == _SK_ZERO:
+        return 0, pos
+    if tag == _SK_POS_INT or tag == _SK_NEG_INT:
+        negative = tag == _SK_NEG_INT
+        n = ord(data[pos:pos + 1]) - 0x30
+        if negative:
+            n = 9 - n
+        pos += 1
+        length = data[pos:pos + n]
+        if negative:
+            length = length.translate(_SK_COMPLEMENT)
+        pos += n
+        n = int(length, 16)
+        digits = data[pos:pos + n]
+        pos += n
+        if negative:
+            return -int(digits.translate(_SK_COMPLEMENT), 16), pos
+        return int(digits, 16), pos
+    if tag == _SK_FLOAT:
+        bits = int(data[pos:pos + 16], 16)
+        bits = bits ^ _SK_SIGN_BIT if bits & _SK_SIGN_BIT else bits ^ _SK_ALL_BITS
+        return struct.unpack('>d', _SK_DOUBLE.pack(bits))[0], pos + 16
+    if tag == _SK_BYTES or tag == _SK_UNICODE:
+        end = data.index(_SK_END, pos)
+        obj = _sk_unescape(data[pos:end])
+        if tag == _SK_UNICODE:
+            obj = obj.decode('utf-8')
+        return obj, end + 1
+    if tag == _SK_TUPLE:
+        items = []
+        while data[pos:pos + 1] != _SK_END:
+            if pos >= len(data):
+                raise ValueError('unterminated tuple in sort key')
+            item, pos = _sk_decode(data, pos)
+            items.append(item)
+        return tuple(items), pos + 1
+    raise ValueError('unknown type tag of sort key: {!r}'.format(tag))
+
+
+def encode_sort_key(key):
+    """Encode `key` into bytes, whose byte order is the same as the natural
+    order of keys, and which contain no tab, newline or carriage return."""
+    parts = []
+    _sk_encode(key, parts)
+    return b''.join(parts)
+
+
+def decode_sort_key(data):
+    """reverse `encode_sort_key`"""
+    key, pos = _sk_decode(data, 0)
+    if pos != len(data):
+        raise ValueError('trailing bytes in sort key')
+    return key
+
+
+class SortKeyProtocol(BinaryPickleProtocol):
+    """Like `BinaryPickleProtocol`, but encode keys with `encode_sort_key`,
+    so that sorting the encoded keys as bytes (as the shuffle of both hadoop
+    and `LocalRunner` does) sorts them in their natural order, e.g. ``9``
+    before ``10``, and ``(u'a', -1.5)`` before ``(u'a', 2.0)``.
+
+    Keys may be None, bools, ints, floats, bytes, unicode strings, and
+    tuples of them (lists are decoded as tuples). Values of different types
+    don't interleave: types are ordered as None < bool < int < float < bytes
+    < unicode < tuple, so mixing ints and floats in the same position of keys
+    doesn't sort them numerically.
+    """
+
+    def _loads_key(self, key):
+        return decode_sort_key(key)
+
+    def _dumps_key(self, key):
+        return encode_sort_key(key)
+
+
+class KeyFieldProtocol(BinaryPickleProtocol):
+    """Encode each field of tuple keys of `num_fields` fields with
+    `encode_sort_key`, and write them as separate tab-separated fields, so that
+    the shuffle (hadoop's ``KeyFieldBasedPartitioner`` and
+    ``KeyFieldBasedComparator``, or `LocalRunner`) can partition and sort on
+    some of the fields, in their natural order. Values are binary pickles.
+
+    This is the internal protocol of jobs with secondary sort, see
+    ``MRJob.KEY_FIELDS``.
+    """
+
+    def __init__(self, num_fields):
+        super(KeyFieldProtocol, self).__init__()
+        self.num_fields = num_fields
+
+    def _loads_key(self, key):
+        return tuple(decode_sort_key(field) for field in key.split(b'\t'))
+
+    def _dumps_key(self, key):
+        if not isinstance(key, (tuple, list)) or len(key) != self.num_fields:
+            raise ValueError('key should be a tuple of {} fields, got {!r}'.format(self.num_fields, key))
+        return b'\t'.join(encode_sort_key(field) for field in key)
+
+    def read(self, line):
+        """Decode a line of input.
+        :return: A tuple of ``(key, value)``."""
+
+        # escaped values never contain tabs, but keys do
+        raw_key, raw_value = line.rsplit(b'\t', 1)
+
+        if raw_key != self._last_key_encoded:
+            self._last_key_encoded = raw_key
+            self._last_key_decoded = self._loads_key(raw_key)
+        return (self._last_key_decoded, self._loads(raw_value))
+
+    def read_raw_pairs(self, stream):
+        for line in stream:
+            yield line.rstrip(b'\r\n').rsplit(b'\t', 1)
+
+
 class TextProtocol(_KeyCachingProtocol):
     def _loads(self, value):
         return value
@@ -98,3 +389,226 @@ class TextValueProtocol(object):
             pass
 
         return str(value)
+
+
+# typed bytes type codes, see the javadoc of `org.apache.hadoop.typedbytes`
+_TB_BYTES = 0
+_TB_BYTE = 1
+_TB_BOOL = 2
+_TB_INT = 3
+_TB_LONG = 4
+_TB_FLOAT = 5
+_TB_DOUBLE = 6
+_TB_STRING = 7
+_TB_VECTOR = 8
+_TB_LIST = 9
+_TB_MAP = 10
+# application specific type for pickled python objects (the same as dumbo)
+_TB_PICKLE = 100
+_TB_MARKER = 255
+
+# struct formats of fixed-size types
+_TB_FIXED = {
+    _TB_BYTE: struct.Struct('>b'),
+    _TB_BOOL: struct.Struct('>?'),
+    _TB_INT: struct.Struct('>i'),
+    _TB_LONG: struct.Struct('>q'),
+    _TB_FLOAT: struct.Struct('>f'),
+    _TB_DOUBLE: struct.Struct('>d'),
+}
+_TB_CODE = struct.Struct('>B')
+_TB_LENGTH = struct.Struct('>i')
+_TB_CODE_LENGTH = struct.Struct('>Bi')
+
+
+def _tb_encode(obj, parts):
+    """append typed bytes of `obj` to list `parts`"""
+    t = type(obj)
+    if t is str:
+        parts.append(_TB_CODE_LENGTH.pack(_TB_STRING, len(obj)))
+        parts.append(obj)
+    elif t is unicode:
+        data = obj.encode('utf8')
+        parts.append(_TB_CODE_LENGTH.pack(_TB_STRING, len(data)))
+        parts.append(data)
+    elif t is bool:
+        parts.append(_TB_CODE.pack(_TB_BOOL) + _TB_FIXED[_TB_BOOL].pack(obj))
+    elif (t is int or t is long) and -0x80000000 <= obj <= 0x7fffffff:
+        parts.append(_TB_CODE_LENGTH.pack(_TB_INT, obj))
+    elif (t is int or t is long) and -0x8000000000000000 <= obj <= 0x7fffffffffffffff:
+        parts.append(_TB_CODE.pack(_TB_LONG) + _TB_FIXED[_TB_LONG].pack(obj))
+    elif t is float:
+        parts.append(_TB_CODE.pack(_TB_DOUBLE) + _TB_FIXED[_TB_DOUBLE].pack(obj))
+    elif t is tuple:
+        parts.append(_TB_CODE_LENGTH.pack(_TB_VECTOR, len(obj)))
+        for x in obj:
+            _tb_encode(x, parts)
+    elif t is list:
+        parts.append(_TB_CODE.pack(_TB_LIST))
+        for x in obj:
+            _tb_encode(x, parts)
+        parts.append(_TB_CODE.pack(_TB_MARKER))
+    elif t is dict:
+        parts.append(_TB_CODE_LENGTH.pack(_TB_MAP, len(obj)))
+        for k, v in obj.items():
+            _tb_encode(k, parts)
+            _tb_encode(v, parts)
+    elif t is bytearray:
+        parts.append(_TB_CODE_LENGTH.pack(_TB_BYTES, len(obj)))
+        parts.append(bytes(obj))
+    else:
+        data = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+        parts.append(_TB_CODE_LENGTH.pack(_TB_PICKLE, len(data)))
+        parts.append(data)
+
+
+def _tb_decode(data, pos):
+    """decode a typed bytes object of `data` starting at `pos`.
+    :return: A tuple of ``(obj, next_pos)``."""
+    code, = _TB_CODE.unpack_from(data, pos)
+    pos += 1
+    if code in _TB_FIXED:
+        fmt = _TB_FIXED[code]
+        return fmt.unpack_from(data, pos)[0], pos + fmt.size
+    if code == _TB_STRING or code == _TB_BYTES or code == _TB_PICKLE:
+        n, = _TB_LENGTH.unpack_from(data, pos)
+        pos += 4
+        obj = data[pos:pos + n]
+        if code == _TB_PICKLE:
+            obj = cPickle.loads(obj)
+        return obj, pos + n
+    if code == _TB_VECTOR:
+        n, = _TB_LENGTH.unpack_from(data, pos)
+        pos += 4
+        items = []
+        for _ in range(n):
+            item, pos = _tb_decode(data, pos)
+            items.append(item)
+        return tuple(items), pos
+    if code == _TB_LIST:
+        items = []
+        while _TB_CODE.unpack_from(data, pos)[0] != _TB_MARKER:
+            item, pos = _tb_decode(data, pos)
+            items.append(item)
+        return items, pos + 1
+    if code == _TB_MAP:
+        n, = _TB_LENGTH.unpack_from(data, pos)
+        pos += 4
+        obj = {}
+        for _ in range(n):
+            k, pos = _tb_decode(data, pos)
+            v, pos = _tb_decode(data, pos)
+            obj[k] = v
+        return obj, pos
+    raise ValueError('unsupported typed bytes type code: {}'.format(code))
+
+
+def _read_exactly(read, n):
+    data = read(n)
+    if len(data) != n:
+        raise EOFError('unexpected end of typed bytes stream')
+    return data
+
+
+def read_typedbytes(stream):
+    """read the raw bytes of the next typed bytes object from `stream`,
+    without decoding it.
+    :return: bytes, or ``b''`` at the end of stream."""
+    read = stream.read
+    head = read(1)
+    if not head:
+        return b''
+    code, = _TB_CODE.unpack(head)
+
+    if code in _TB_FIXED:
+        return head + _read_exactly(read, _TB_FIXED[code].size)
+    if code == _TB_MARKER:
+        return head
+
+    if code == _TB_LIST:
+        parts = [head]
+        while True:
+            item = read_typedbytes(stream)
+            if not item:
+                raise EOFError('unexpected end of typed bytes stream')
+            parts.append(item)
+            if item == b'\xff':
+                return b''.join(parts)
+
+    length = _read_exactly(read, 4)
+    n, = _TB_LENGTH.unpack(length)
+    if code == _TB_VECTOR or code == _TB_MAP:
+        parts = [head, length]
+        for _ in range(n if code == _TB_VECTOR else 2 * n):
+            item = read_typedbytes(stream)
+            if not item:
+                raise EOFError('unexpected end of typed bytes stream')
+            parts.append(item)
+        return b''.join(parts)
+
+    # bytes, string, and application specific types
+    return head + length + _read_exactly(read, n)
+
+
+def read_typedbytes_pairs(stream):
+    """read ``(raw_key, raw_value)`` pairs of typed bytes from `stream`"""
+    while True:
+        raw_key = read_typedbytes(stream)
+        if not raw_key:
+            return
+        raw_value = read_typedbytes(stream)
+        if not raw_value:
+            raise EOFError('unexpected end of typed bytes stream')
+        yield raw_key, raw_value
+
+
+class TypedBytesProtocol(object):
+    """Encode keys and values as hadoop typed bytes, which are framed by their
+    type codes and lengths instead of tabs and newlines, so binary data is
+    never escaped.
+
+    Python types are mapped as: str/unicode -> string, bytearray -> bytes,
+    bool -> bool, int -> int/long, float -> double, tuple -> vector,
+    list -> list, dict -> map. Other objects are pickled into the application
+    specific type 100.
+
+    Unlike line based protocols, records are read from a stream with
+    `read_pairs`, and written without trailing newline.
+    """
+
+    def _dumps(self, value):
+        if isinstance(value, GeneratorType):
+            value = list(value)
+        parts = []
+        _tb_encode(value, parts)
+        return b''.join(parts)
+
+    def _loads(self, data):
+        return _tb_decode(data, 0)[0]
+
+    _loads_key = _loads
+
+    def read(self, record):
+        """Decode the typed bytes of a key followed by a value.
+        :return: A tuple of ``(key, value)``."""
+        key, pos = _tb_decode(record, 0)
+        value, pos = _tb_decode(record, pos)
+        return key, value
+
+    def read_pairs(self, stream):
+        """Decode all ``(key, value)`` pairs of `stream`, caching the last key."""
+        last_raw_key = last_key = None
+        for raw_key, raw_value in read_typedbytes_pairs(stream):
+            if raw_key != last_raw_key:
+                last_raw_key = raw_key
+                last_key = self._loads(raw_key)
+            yield last_key, self._loads(raw_value)
+
+    def read_raw_pairs(self, stream):
+        """Read ``(raw_key, raw_value)`` pairs of `stream`, without decoding them."""
+        return read_typedbytes_pairs(stream)
+
+    def write(self, key, value):
+        """Encode a key and value.
+        :return: Typed bytes of the key followed by the value."""
+        return self._dumps(key) + self._dumps(value)
@@ -2,13 +2,20 @@
 
 import argparse
 import glob
-import io
+import hashlib
 import logging
 import pipes
 import os
+import py_compile
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import time
+import zipfile
+
+from ..fs import Filesystem, FilesystemError, HadoopFilesystem, WebHdfsFilesystem
 
 
 PYTHON_ARCHIVE = 'hdfs://localhost:9902/user/zhuhe212/python2.7.3.tar.gz'
@@ -27,11 +34,51 @@ QUEUE_MAPPER = {
     },
 }
 
-_HADOOP_RM_NO_SUCH_FILE = re.compile(r'\nrmr?: .*No such file.*\n')
+# partitioner and comparator of secondary sort
+KEY_FIELD_PARTITIONER = 'org.apache.hadoop.mapred.lib.KeyFieldBasedPartitioner'
+KEY_FIELD_COMPARATOR = 'org.apache.hadoop.mapred.lib.KeyFieldBasedComparator'
+
+# compression codecs of output and map output
+HADOOP_COMPRESSION_CODECS = {
+    'gzip': 'org.apache.hadoop.io.compress.GzipCodec',
+    'bz2': 'org.apache.hadoop.io.compress.BZip2Codec',
+    'default': 'org.apache.hadoop.io.compress.DefaultCodec',
+    'snappy': 'org.apache.hadoop.io.compress.SnappyCodec',
+}
 
 logger = logging.getLogger('mrjob')
 
 
+def plan_merge(sizes, num_files):
+    """plan to merge files into about `num_files` files of similar size.
+
+    Files are packed in the order of their names (so that sorted output stays
+    in order) into bins of at least the target size ``total size / num_files``
+    bytes, but a file is not added to a bin if that makes it larger than 1.5
+    times the target. So files which are near the target size stay alone in
+    their bins.
+
+    :param sizes: a dict of ``{path: size in bytes}``
+    :return: a list of bins, each of which is a list of paths. There is no
+        need to merge if no bin has more than one file.
+    """
+    paths = sorted(sizes)
+    if len(paths) <= num_files:
+        return [[path] for path in paths]
+
+    target = max(sum(sizes.values()) / float(num_files), 1.0)
+    bins = []
+    bin_size = 0
+    for path in paths:
+        if not bins or bin_size >= target or bin_size + sizes[path] > target * 1.5:
+            bins.append([])
+            bin_size = 0
+        bins[-1].append(path)
+        bin_size += sizes[path]
+    return bins
+
+
+
 def set_hadoop_python(python_archive, python_exec):
     """set python archive and python executable for hadoop streaming.
 
@@ -45,41 +92,6 @@ def set_hadoop_python(python_archive, python_exec):
     PYTHON_EXEC = python_exec
 
 
-def _invoke_hadoop(cmd, ok_returncodes=None, ok_stderr=None, return_stdout=False):
-    """包装调用 hadoop 客户端的命令，并屏蔽指定的 stderr"""
-
-    logger.info('> {}'.format(' '.join(cmd)))
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-
-    # check if STDERR is okay
-    stderr_is_ok = False
-    if ok_stderr:
-        for stderr_re in ok_stderr:
-            if stderr_re.search(stderr):
-                stderr_is_ok = True
-                break
-
-    if not stderr_is_ok:
-        for line in io.BytesIO(stderr):
-            # skip HDFS info in stderr stream
-            if ' INFO ' in line:
-                continue
-            logger.error('STDERR: ' + line.rstrip())
-
-    ok_returncodes = ok_returncodes or [0]
-
-    if not stderr_is_ok and proc.returncode not in ok_returncodes:
-        raise subprocess.CalledProcessError(proc.returncode, cmd)
-
-    if return_stdout:
-        return stdout
-    else:
-        if stdout:
-            logger.info('STDOUT: ' + stdout)
-        return proc.returncode
-
-
 class HadoopError(Exception): pass
 
 
@@ -100,6 +112,11 @@ class HadoopRunner(object):
         'partitioner',
         'others', # other opts in a list, will be passed to command line
         'merge_output', # merge output files as specific numbers
+        'io', # 'text' or 'typedbytes', format of data between mapper/combiner/reducer
+        'profile', # profile mapper/combiner/reducer tasks, reports are in stderr logs of tasks
+        'output_compression', # codec to compress output, see HADOOP_COMPRESSION_CODECS
+        'map_output_compression', # codec to compress map output, the same as output_compression by default
+        'fs', # a `Filesystem`, or url of WebHDFS, to manage input and output. `hadoop fs` by default
     }
 
     DEFAULT_OPTS = {
@@ -114,6 +131,17 @@ class HadoopRunner(object):
 
     REQUIRED_OPTS = {'input', 'output'}
 
+    # merge_output: files are concatenated through the client if there is no
+    # more than this many bytes to merge into no more than this many files
+    # (each costs a `hadoop fs -cat | hadoop fs -put` pair of JVMs), and only
+    # if the output is not compressed, or compressed by a codec whose files
+    # can be concatenated; otherwise, by a map-only job, which combines
+    # several files into each input split
+    MERGE_CONCAT_MAX_BYTES = 1 << 30
+    MERGE_CONCAT_MAX_FILES = 20
+    MERGE_CONCAT_CODECS = (HADOOP_COMPRESSION_CODECS['gzip'], HADOOP_COMPRESSION_CODECS['bz2'])
+    MERGE_INPUT_FORMAT = 'org.apache.hadoop.mapred.lib.CombineTextInputFormat'
+
 
     def __init__(self, mrjob, cmd_args=None, **kwargs):
         self.mrjob = mrjob
@@ -129,17 +157,34 @@ class HadoopRunner(object):
 
         options = self._validate_options(options)
 
+        # typed bytes only affect the shuffle, so map-only jobs ignore it
+        self._typedbytes = (options['io'] == 'typedbytes' and
+                            ('reducer' in options or self.mrjob._has_reducer()))
+        if self._typedbytes and self.mrjob._key_fields():
+            raise ValueError('secondary sort (KEY_FIELDS) is not supported with typed bytes')
+
         self._options = dict(self.DEFAULT_OPTS)
-        self._options.update(self._default_mr_options())
         self._options.update(options)
+        self._steps = self._step_commands(options)
 
         # check hadoop path
         if not os.path.isfile(self._options['hadoop']):
             raise ValueError('hadoop path not exist: "{}"'.format(self._options['hadoop']))
 
+        fs = self._options.get('fs')
+        if fs is None:
+            self.fs = HadoopFilesystem(self._options['hadoop'])
+        elif isinstance(fs, Filesystem):
+            self.fs = fs
+        else:
+            self.fs = WebHdfsFilesystem(fs)
+
         self._jobconf = dict(self.DEFAULT_JOBCONF)
         self._jobconf.update(jobconf)
 
+        # path of the zipped mrjob bundle, built by the first step
+        self._bundle = None
+
         # 根据设定的队列自动补全其他必要的配置
         queue_name = self._jobconf.get('mapred.job.queue.name')
         if queue_name in QUEUE_MAPPER:
@@ -165,6 +210,22 @@ class HadoopRunner(object):
             '-combiner', dest='combiner', help='Combiner executable for map output. The same as `hadoop streaming -combiner`.')
         parser.add_argument(
             '-reducer', dest='reducer', help='Reducer executable. If not specified, IdentityReducer is used as the default. The same as `hadoop streaming -reducer`.')
+        parser.add_argument(
+            '-io', dest='io', choices=('text', 'typedbytes'),
+            help='Format of data between mapper/combiner/reducer. The same as `hadoop streaming -io`.')
+        parser.add_argument(
+            '-profile', dest='profile', action='store_true',
+            help='Profile mapper/combiner/reducer tasks, and report to stderr logs of tasks.')
+        parser.add_argument(
+            '-output_compression', dest='output_compression', choices=sorted(HADOOP_COMPRESSION_CODECS),
+            help='Compress output with this codec.')
+        parser.add_argument(
+            '-map_output_compression', dest='map_output_compression', choices=sorted(HADOOP_COMPRESSION_CODECS),
+            help='Compress map output with this codec, the same as -output_compression by default.')
+        parser.add_argument(
+            '-fs', dest='fs',
+            help='Manage input and output through WebHDFS at this url (e.g. http://namenode:50070), '
+                 'instead of `hadoop fs`.')
         parser.add_argument(
             '-D', '--jobconf', dest='jobconf', action='append', default=[],
             help='Use value for given property. The same as `hadoop streaming -D/-jobconf`.')
@@ -172,7 +233,8 @@ class HadoopRunner(object):
         args = parser.parse_args(cmd_args)
 
         # parse options
-        for name in ('hadoop', 'input', 'output', 'mapper', 'combiner', 'reducer'):
+        for name in ('hadoop', 'input', 'output', 'mapper', 'combiner', 'reducer', 'io', 'profile',
+                     'output_compression', 'map_output_compression', 'fs'):
             if getattr(args, name, None):
                 options[name] = getattr(args, name)
 
@@ -232,6 +294,10 @@ class HadoopRunner(object):
         else:
             options['cmdenv'] = {}
 
+        # tasks are profiled if MRJOB_PROFILE is set in their environment
+        if options.get('profile'):
+            options['cmdenv'].setdefault('MRJOB_PROFILE', '1')
+
         # check file
         if 'file' in options:
             if isinstance(options['file'], basestring):
@@ -257,6 +323,28 @@ class HadoopRunner(object):
             if options[name].startswith('python '):
                 options[name] = options[name].replace('python', PYTHON_EXEC, 1)
 
+        # check io
+        options.setdefault('io', 'text')
+        if options['io'] not in ('text', 'typedbytes'):
+            raise ValueError('option "io" should be "text" or "typedbytes"')
+
+        # check compression
+        for name in ('output_compression', 'map_output_compression'):
+            if options.get(name) is not None and options[name] not in HADOOP_COMPRESSION_CODECS:
+                raise ValueError('option "{}" should be one of: {}'.format(
+                    name, ', '.join(sorted(HADOOP_COMPRESSION_CODECS))))
+        if options.get('output_compression'):
+            options.setdefault('map_output_compression', options['output_compression'])
+
+        # check merge_output
+        if 'merge_output' in options:
+            if not isinstance(options['merge_output'], (int, long)) or options['merge_output'] <= 0:
+                raise ValueError('option "merge_output" should be a positive integer')
+
+        # check fs
+        if options.get('fs') is not None and not isinstance(options['fs'], (Filesystem, basestring)):
+            raise ValueError('option "fs" should be a Filesystem, or url of WebHDFS')
+
         # check others
         if 'others' in options:
             if not isinstance(options['others'], (list, tuple)):
@@ -267,58 +355,146 @@ class HadoopRunner(object):
         logger.info('job config OK.')
         return options
 
-    def _default_mr_options(self):
-        """get default -mapper/-combiner/-reducer options"""
+    def _default_mr_options(self, typedbytes=False, step_num=0):
+        """get default -mapper/-combiner/-reducer options of a step"""
         res = {}
         py_script = os.path.split(sys.argv[0])[-1]
         for name in ('mapper', 'combiner', 'reducer'):
-            if not self.mrjob._has_mr_fun(name):
+            if not self.mrjob._has_mr_step(name, step_num):
                 continue
             res[name] = '{python} "{script}" --{name}'.format(
                 name=name, python=PYTHON_EXEC, script=py_script)
+            if self.mrjob._num_steps() > 1:
+                res[name] += ' --step-num {}'.format(step_num)
+            if typedbytes:
+                res[name] += ' --io typedbytes'
         return res
 
-    def _generate_cmd(self):
-        """generate hadoop streaming command"""
+    def _step_commands(self, options):
+        """get mapper/combiner/reducer commands of each step of the job.
+        mapper/combiner/reducer options override those of single-step jobs.
+        """
+        num_steps = self.mrjob._num_steps()
+        overrides = dict((name, options[name]) for name in ('mapper', 'combiner', 'reducer') if name in options)
+        if overrides and num_steps > 1:
+            raise ValueError('options "mapper", "combiner" and "reducer" are not supported by multi-step jobs')
+
+        steps = []
+        for step_num in range(num_steps):
+            typedbytes = self._typedbytes and (
+                'reducer' in overrides or self.mrjob._has_mr_fun('reducer', step_num))
+            step = self._default_mr_options(typedbytes, step_num)
+            step.update(overrides)
+            steps.append(step)
+        return steps
+
+    def _compression_jobconf(self, step_num=None):
+        """get jobconf to compress map output of step `step_num`, and the
+        final output. Map output of map-only steps is their output, which is
+        only compressed for the last step."""
+        jobconf = {}
+        codec = self._options.get('map_output_compression')
+        if codec and step_num is not None and 'reducer' in self._steps[step_num]:
+            jobconf['mapred.compress.map.output'] = 'true'
+            jobconf['mapred.map.output.compression.codec'] = HADOOP_COMPRESSION_CODECS[codec]
+
+        codec = self._options.get('output_compression')
+        if codec and (step_num is None or step_num == len(self._steps) - 1):
+            jobconf['mapred.output.compress'] = 'true'
+            jobconf['mapred.output.compression.codec'] = HADOOP_COMPRESSION_CODECS[codec]
+        return jobconf
+
+    def _generate_cmd(self, step_num=0, input=None, output=None):
+        """generate hadoop streaming command of a step, which reads `input`
+        (the input of the job by default) and writes `output` (the output of
+        the job by default)"""
         cmd = [self._options['hadoop'], 'streaming']
+        step = self._steps[step_num]
+        jobconf = dict(self._jobconf)
+        partitioner = self._options.get('partitioner')
 
         # set default job name as current python script name
         py_script = sys.argv[0]
-        if 'mapred.job.name' not in self._jobconf:
-            self._jobconf['mapred.job.name'] = 'mrjob-{}'.format(py_script)
-
-        for k, v in self._jobconf.items():
+        if 'mapred.job.name' not in jobconf:
+            jobconf['mapred.job.name'] = 'mrjob-{}'.format(py_script)
+        if len(self._steps) > 1:
+            jobconf['mapred.job.name'] += '-step-{}'.format(step_num)
+            # map-only steps pass mapper output to the next step as it is
+            if 'reducer' not in step:
+                jobconf['mapred.reduce.tasks'] = 0
+
+        # shuffle typed bytes, but keep reading input and writing output as text
+        typedbytes = self._typedbytes and 'reducer' in step
+        if typedbytes:
+            jobconf['stream.map.output'] = 'typedbytes'
+            jobconf['stream.reduce.input'] = 'typedbytes'
+
+        # secondary sort: partition and sort on fields of the key
+        key_fields = self.mrjob._key_fields()
+        if key_fields and 'reducer' in step:
+            num_fields, partition_fields, sort_fields = key_fields
+            jobconf['stream.num.map.output.key.fields'] = num_fields
+            jobconf['mapred.text.key.partitioner.options'] = '-k1,{}'.format(partition_fields)
+            jobconf['mapred.output.key.comparator.class'] = KEY_FIELD_COMPARATOR
+            jobconf['mapred.text.key.comparator.options'] = ' '.join(
+                '-k{0},{0}{1}'.format(i + 1, 'r' if reverse else '') for i, reverse in sort_fields)
+            if partitioner is None:
+                partitioner = KEY_FIELD_PARTITIONER
+            elif partitioner != KEY_FIELD_PARTITIONER:
+                logger.warning('partitioner "{}" is used instead of "{}" for secondary sort'.format(
+                    partitioner, KEY_FIELD_PARTITIONER))
+
+        # compression set by jobconf of the user is kept
+        for k, v in self._compression_jobconf(step_num).items():
+            jobconf.setdefault(k, v)
+
+        for k, v in jobconf.items():
             cmd.extend(['-jobconf', '{}={}'.format(k, v)])
 
-        for key in ('inputformat', 'outputformat', 'partitioner'):
+        for key in ('inputformat', 'outputformat'):
             if key in self._options:
                 cmd.extend(['-' + key, self._options[key]])
+        if partitioner is not None:
+            cmd.extend(['-partitioner', partitioner])
 
-        for path in set(self._options['input']):
+        for path in set(self._options['input'] if input is None else input):
             cmd.extend(['-input', path])
 
-        cmd.extend(['-output', self._options['output']])
+        cmd.extend(['-output', self._options['output'] if output is None else output])
+
+        if self._bundle is None or not os.path.isfile(self._bundle):
+            self._bundle = bundle(py_script)
 
-        for k, v in self._options['cmdenv'].items():
+        # the bundle is imported from the working directory of tasks, where
+        # files shipped by `-file` are linked to
+        cmdenv = dict(self._options['cmdenv'])
+        bundle_name = os.path.basename(self._bundle)
+        if cmdenv.get('PYTHONPATH'):
+            cmdenv['PYTHONPATH'] = '{}:{}'.format(bundle_name, cmdenv['PYTHONPATH'])
+        else:
+            cmdenv['PYTHONPATH'] = bundle_name
+
+        for k, v in cmdenv.items():
             cmd.extend(['-cmdenv', '{}={}'.format(k, v)])
 
         for archive in set(self._options['cacheArchive'] + [PYTHON_ARCHIVE]):
             cmd.extend(['-cacheArchive', archive])
 
-        cur_dir = os.path.dirname(os.path.abspath(__file__))
-        mrjob_py = os.path.join(os.path.dirname(cur_dir), 'bundle', 'mrjob.py')
-        if not os.path.isfile(mrjob_py):
-            bundle()
-
-        for file in set(self._options['file'] + [py_script, mrjob_py]):
+        for file in set(self._options['file'] + [py_script, self._bundle]):
             cmd.extend(['-file', file])
 
         # if not self.mrjob._has_mr_fun('mapper'):
         #     raise ValueError('You have to implement the "mapper" method')
 
         for name in ('mapper', 'combiner', 'reducer'):
-            if name in self._options:
-                cmd.extend(['-' + name, self._options[name]])
+            if name not in step:
+                continue
+            # hadoop streaming reads combiner output with the reducer's output
+            # format (text), which doesn't match typed bytes map output
+            if name == 'combiner' and typedbytes:
+                logger.warning('combiner is skipped in typedbytes mode')
+                continue
+            cmd.extend(['-' + name, step[name]])
 
         cmd.extend(self._options['others'])
 
@@ -337,6 +513,90 @@ class HadoopRunner(object):
         return shell_cmd
 
 
+    def _merge_cmd(self, output_tmp, merge_tmp, total_size):
+        """get the command of the map-only job which merges part files in
+        `output_tmp` (`total_size` bytes) into `merge_tmp`"""
+        cmd = [
+            self._options['hadoop'], 'streaming',
+            '-jobconf', 'mapred.reduce.tasks=0',
+            # only TextInputFormat has its byte offset keys dropped by default
+            '-jobconf', 'stream.map.input.ignoreKey=true',
+            '-jobconf', 'mapred.max.split.size={}'.format(total_size // self._options['merge_output'] + 1),
+            '-inputformat', self.MERGE_INPUT_FORMAT,
+            '-input', output_tmp,
+            '-output', merge_tmp,
+            '-mapper', 'cat', ]
+        if 'mapred.job.queue.name' in self._jobconf:
+            cmd += ['-jobconf', 'mapred.job.queue.name={}'.format(self._jobconf['mapred.job.queue.name'])]
+        if 'mapred.job.tracker' in self._jobconf:
+            cmd += ['-jobconf', 'mapred.job.tracker={}'.format(self._jobconf['mapred.job.tracker'])]
+        for k, v in self._compression_jobconf().items():
+            cmd += ['-jobconf', '{}={}'.format(k, self._jobconf.get(k, v))]
+        return cmd
+
+    def _can_concat_output(self):
+        """check if files of the final output are still valid when concatenated,
+        which is true of uncompressed files, and gzip/bz2 files (of several
+        members), but not of files of hadoop's DefaultCodec or SnappyCodec"""
+        jobconf = self._compression_jobconf()
+        jobconf.update(self._jobconf)
+        if str(jobconf.get('mapred.output.compress', 'false')).lower() != 'true':
+            return True
+        return jobconf.get('mapred.output.compression.codec') in self.MERGE_CONCAT_CODECS
+
+    def _merge_output(self, output_tmp):
+        """merge part files in `output_tmp` into about `merge_output` files.
+        Small merges into a few files are done by concatenating files (one
+        `hadoop fs -cat | hadoop fs -put` per merged file), and others by a
+        map-only job, see MERGE_CONCAT_MAX_BYTES.
+        Nothing is done if files are already near the target size.
+        :return: False if merging failed, in which case `output_tmp` is left
+            unmerged"""
+        fs = self.fs
+        sizes = dict((path, size) for path, size in fs.du(output_tmp).items()
+                     if os.path.basename(path).startswith('part-'))
+        bins = [b for b in plan_merge(sizes, self._options['merge_output']) if len(b) > 1]
+        if not bins:
+            logger.info('{} output files are near the target size, no need to merge'.format(len(sizes)))
+            return True
+
+        merge_bytes = sum(sizes[path] for b in bins for path in b)
+        logger.info('merging {} of {} output files ({} bytes) into {} files ...'.format(
+            sum(len(b) for b in bins), len(sizes), merge_bytes, len(bins)))
+
+        if (merge_bytes <= self.MERGE_CONCAT_MAX_BYTES and len(bins) <= self.MERGE_CONCAT_MAX_FILES
+                and self._can_concat_output()):
+            # named after the first file of each bin, so that files are still
+            # in order by name, e.g. part-00000-merged.gz
+            merged_paths = []
+            for paths in bins:
+                dir_name, name = os.path.split(paths[0])
+                base, dot, ext = name.partition('.')
+                merged_paths.append(os.path.join(dir_name, base + '-merged' + dot + ext))
+            try:
+                for paths, merged_path in zip(bins, merged_paths):
+                    fs.concat(paths, merged_path)
+            except FilesystemError as e:
+                logger.error(str(e))
+                fs.rm(*merged_paths)
+                return False
+            fs.rm(*[path for b in bins for path in b])
+            return True
+
+        # map-only job, whose input splits combine files of about the target size
+        merge_tmp = output_tmp.rstrip('/') + '-merge'
+        fs.rm(merge_tmp)
+        cmd_merge = self._merge_cmd(output_tmp, merge_tmp, sum(sizes.values()))
+        sys.stderr.write('\n\n')
+        logger.info('\n' + self._pretty_cmd(cmd_merge) + '\n')
+        retcode = subprocess.call(cmd_merge, stdout=None, stderr=None)
+        if retcode != 0:
+            fs.rm(merge_tmp)
+            return False
+        fs.rm(output_tmp)
+        fs.mv(merge_tmp, output_tmp)
+        return True
+
     def execute(self):
         """execute hadoop streaming command.
 
@@ -344,68 +604,66 @@ class HadoopRunner(object):
         directory untouched.
         This feature is learnt from hive(hql), which avoids mistakenly deleting
         current data in case of the job will fail.
+
+        Temp directories and output are managed through `self.fs`, and paths
+        are removed in batches, since each `hadoop fs` command starts a JVM:
+        stale temp directories before the job, and temp directories of
+        intermediate steps together with the old output after it. Output is
+        not removed before the job, so that it is left untouched if the job
+        fails. With ``fs=`` the url of WebHDFS, each operation is an HTTP
+        request instead of a JVM, which saves far more (see `WebHdfsFilesystem`).
         """
+        fs = self.fs
 
         # 使用一个临时目录保存结果
         base, end = os.path.split(self._options['output'].rstrip('/'))
         output_tmp = os.path.join(base, '__tmp_mrjob', end)
-        rm_tmp = [self._options['hadoop'], 'fs', '-rmr', output_tmp]
-        _invoke_hadoop(rm_tmp, ok_stderr=[_HADOOP_RM_NO_SUCH_FILE])
 
-        cmd = self._generate_cmd()
-        cmd[cmd.index('-output')+1] = output_tmp
-        logger.info('\n' + self._pretty_cmd(cmd) + '\n')
+        # 多步骤作业：每一步的输出写入一个临时目录，作为下一步的输入
+        step_outputs = ['{}-step-{}'.format(output_tmp, i) for i in range(len(self._steps) - 1)]
+        step_outputs.append(output_tmp)
 
-        logger.info('running hadoop streaming ...')
-        # 执行 hadoop streaming 命令，打印 stdout, stderr 到父进程的 stdout, stderr
-        retcode = subprocess.call(cmd, stdout=None, stderr=None)
+        # 一次删除上次残留的所有临时目录
+        fs.rm(*step_outputs)
 
-        # 如果作业成功，先删除 output 目录，然后将临时目录 move 到 output 目录。
-        if retcode == 0:
-            rm_output = [self._options['hadoop'], 'fs', '-rmr', self._options['output']]
-            _invoke_hadoop(rm_output, ok_stderr=[_HADOOP_RM_NO_SUCH_FILE])
+        retcode = None
+        try:
+            for step_num, step_output in enumerate(step_outputs):
+                step_input = None if step_num == 0 else [step_outputs[step_num - 1]]
 
+                cmd = self._generate_cmd(step_num, step_input, step_output)
+                logger.info('\n' + self._pretty_cmd(cmd) + '\n')
+
+                logger.info('running hadoop streaming (step {} of {}) ...'.format(step_num + 1, len(self._steps)))
+                # 执行 hadoop streaming 命令，打印 stdout, stderr 到父进程的 stdout, stderr
+                retcode = subprocess.call(cmd, stdout=None, stderr=None)
+                if retcode != 0:
+                    break
+        finally:
+            # 删除中间步骤的临时目录；如果作业成功，在同一条命令中删除 output 目录
+            stale = step_outputs[:-1]
+            if retcode == 0:
+                stale.append(self._options['output'])
+            fs.rm(*stale)
+
+        # 如果作业成功，将临时目录 move 到 output 目录。
+        if retcode == 0:
             # merge small output files if needed
-            merge_flag = ('merge_output' in self._options
-                and self._options['merge_output'] < self._jobconf.get('mapred.reduce.tasks', 0))
+            merged = True
+            if 'merge_output' in self._options:
+                merged = self._merge_output(output_tmp)
 
             # move tmp_output to output
-            cmd_mv = [self._options['hadoop'], 'fs', '-mv', output_tmp, self._options['output']]
-
-            if not merge_flag:
-                _invoke_hadoop(cmd_mv)
-            else:
-                cmd_merge = [
-                    self._options['hadoop'], 'streaming',
-                    '-jobconf', 'mapred.reduce.tasks={}'.format(self._options['merge_output']),
-                    '-input', output_tmp,
-                    '-output', self._options['output'],
-                    '-mapper', 'cat', ]
-                if 'mapred.job.queue.name' in self._jobconf:
-                    cmd_merge += ['-jobconf', 'mapred.job.queue.name={}'.format(self._jobconf['mapred.job.queue.name'])]
-                if 'mapred.job.tracker' in self._jobconf:
-                    cmd_merge += ['-jobconf', 'mapred.job.tracker={}'.format(self._jobconf['mapred.job.tracker'])]
-                sys.stderr.write('\n\n')
-                logger.info('merging output files ...')
-                logger.info('\n' + self._pretty_cmd(cmd_merge) + '\n')
-                retcode = subprocess.call(cmd_merge, stdout=None, stderr=None)
-                if retcode != 0:
-                    try:
-                        _invoke_hadoop(cmd_mv)
-                    except subprocess.CalledProcessError:
-                        raise HadoopError('Failed moving tmp_output to output')
-                    finally:
-                        raise HadoopError('Failed merging output files')
-                rm_tmp = [self._options['hadoop'], 'fs', '-rmr', output_tmp]
-                _invoke_hadoop(rm_tmp, ok_stderr=[_HADOOP_RM_NO_SUCH_FILE])
+            fs.mv(output_tmp, self._options['output'])
+            if not merged:
+                raise HadoopError('Failed merging output files, output is left unmerged')
 
             logger.info('final output: {}'.format(self._options['output']))
 
         # 如果作业失败，保持 output 目录不变，仅删除临时目录
         else:
             logger.error('hadoop streaming failed.')
-            rm_tmp = [self._options['hadoop'], 'fs', '-rmr', output_tmp]
-            _invoke_hadoop(rm_tmp, ok_stderr=[_HADOOP_RM_NO_SUCH_FILE])
+            fs.rm(output_tmp)
             raise HadoopError(
                 'hadoop streaming command returned non-zero exit status {}. '
                 'Job quited without touching output directory. \nTo debug, please '
@@ -417,49 +675,122 @@ if __name__ == '__main__':
     pass
 
 
-def bundle():
-    """bundle all python scripts of mrjob into one, so that is could be loaded
-    by hadoop streaming through `-file` option.
+# bundles of different versions of mrjob and user scripts are cached, see
+# `bundle`. only so many of them are kept, and none used within this many
+# seconds are removed.
+BUNDLE_CACHE_SIZE = 50
+BUNDLE_MIN_AGE = 24 * 3600
+
+
+def bundle(py_script=None):
+    """bundle all python scripts of mrjob into one module, `mrjob.py`, and zip
+    it together with its precompiled `mrjob.pyc`, so that it could be shipped
+    by hadoop streaming through `-file` option, and imported by tasks from
+    PYTHONPATH without compiling it.
 
-    every time after you edited the code of mrjob, make sure this function to
-    be called once, or `mrjob.py` loaded by hadoop streaming will remain unchanged.
+    the zip file is named after a hash of the sources of mrjob, `py_script`
+    (the user script) and the version of python, e.g.
+    `bundle/mrjob-0123456789ab.zip`, and is only built again when any of them
+    changes, so that tasks always run the code they are submitted with.
+    bundles of other versions are kept for other jobs, see `_prune_bundles`.
+
+    only modules used by mapper/combiner/reducer tasks are bundled, runners
+    and filesystems are left out to keep the startup of tasks short.
+
+    :return: path of the zip file
     """
-    MODULE_NAMES = (r'\.', r'\.\.', 'job', 'protocol', 'util', 'hadoop', 'local')
+    MODULE_NAMES = (r'\.', r'\.\.', 'job', 'protocol', 'util', 'fs', 'sink', 'sort', 'step', 'profiling', 'taskio', 'hadoop', 'local', 'inline')
 
-    RE_MAIN = re.compile(r'^if +__name__ *== *[\'\"]__main__[\'\"] *:')
-    RE_IMPORT = re.compile(r'import +([\._a-zA-Z]*\.)*({})'.format('|'.join(MODULE_NAMES)))
-    RE_FROM_IMPORT = re.compile(r'from +([\._a-zA-Z]*\.)*({}) +import'.format('|'.join(MODULE_NAMES)))
+    RE_MAIN = re.compile(br'^if +__name__ *== *[\'\"]__main__[\'\"] *:')
+    RE_IMPORT = re.compile(r'import +([\._a-zA-Z]*\.)*({})'.format('|'.join(MODULE_NAMES)).encode('ascii'))
+    RE_FROM_IMPORT = re.compile(r'from +([\._a-zA-Z]*\.)*({}) +import'.format('|'.join(MODULE_NAMES)).encode('ascii'))
 
     cur_dir = os.path.dirname(os.path.abspath(__file__))
     root_dir = os.path.dirname(cur_dir)
-    runner_dir = cur_dir
+
+    lines = [b'# -*- coding: utf-8 -*-\n\n']
+    for file in (
+            os.path.join(root_dir, 'protocol.py'),
+            os.path.join(root_dir, 'util.py'),
+            os.path.join(root_dir, 'sink.py'),
+            os.path.join(root_dir, 'step.py'),
+            os.path.join(root_dir, 'profiling.py'),
+            os.path.join(root_dir, 'job.py'),
+            ):
+        lines.append('# {}\n'.format(os.path.relpath(file, root_dir)).encode('utf-8'))
+
+        with open(file, 'rb') as fin:
+            for line in fin:
+                if RE_MAIN.search(line):
+                    break
+                if RE_IMPORT.search(line):
+                    continue
+                if RE_FROM_IMPORT.search(line):
+                    continue
+                lines.append(line)
+    source = b''.join(lines)
+
+    digest = hashlib.sha1(source)
+    if py_script is not None:
+        with open(py_script, 'rb') as f:
+            digest.update(f.read())
+    digest.update(sys.version.encode('utf-8'))
 
     out_dir = os.path.join(root_dir, 'bundle')
     if not os.path.isdir(out_dir):
         os.makedirs(out_dir)
-    out_file = os.path.join(out_dir, 'mrjob.py')
-
-    with open(out_file, 'wb') as fout:
-        fout.write(b'# -*- coding: utf-8 -*-\n\n')
-
-        for file in (
-                os.path.join(root_dir, 'job.py'),
-                os.path.join(root_dir, 'protocol.py'),
-                os.path.join(root_dir, 'util.py'),
-                os.path.join(runner_dir, 'hadoop.py'),
-                os.path.join(runner_dir, 'local.py'),
-                ):
-            fout.write(b'# ' + file + b'\n')
-
-            with open(file, 'rb') as fin:
-                for line in fin:
-                    if RE_MAIN.search(line):
-                        break
-                    if RE_IMPORT.search(line):
-                        continue
-                    if RE_FROM_IMPORT.search(line):
-                        continue
-                    fout.write(line)
+    out_file = os.path.join(out_dir, 'mrjob-{}.zip'.format(digest.hexdigest()[:12]))
+    if os.path.isfile(out_file):
+        # mtime tells when a bundle was used last, see `_prune_bundles`
+        os.utime(out_file, None)
+        return out_file
+
+    logger.info('building mrjob bundle {} ...'.format(out_file))
+    tmp_dir = tempfile.mkdtemp(prefix='mrjob-bundle-', dir=out_dir)
+    try:
+        py_file = os.path.join(tmp_dir, 'mrjob.py')
+        with open(py_file, 'wb') as f:
+            f.write(source)
+        # zipimport checks mtime of .pyc against the source in the zip file,
+        # whose timestamps have a resolution of 2 seconds
+        mtime = int(os.path.getmtime(py_file)) // 2 * 2
+        os.utime(py_file, (mtime, mtime))
+        pyc_file = py_file + 'c'
+        py_compile.compile(py_file, cfile=pyc_file, dfile='mrjob.py', doraise=True)
+
+        tmp_file = os.path.join(tmp_dir, 'mrjob.zip')
+        with zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.write(py_file, 'mrjob.py')
+            zf.write(pyc_file, 'mrjob.pyc')
+        # rename is atomic, in case other jobs are building the same bundle
+        os.rename(tmp_file, out_file)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    _prune_bundles(out_dir, out_file)
+    return out_file
+
+
+def _prune_bundles(out_dir, keep):
+    """remove the least recently used bundles in `out_dir` beyond the
+    BUNDLE_CACHE_SIZE latest ones, except `keep` and bundles used within
+    BUNDLE_MIN_AGE seconds, which may be shipped by jobs still running"""
+    bundles = []
+    for path in glob.glob(os.path.join(out_dir, 'mrjob-*.zip')):
+        try:
+            bundles.append((os.path.getmtime(path), path))
+        except OSError:
+            pass
+    bundles.sort(reverse=True)
+
+    now = time.time()
+    for mtime, path in bundles[BUNDLE_CACHE_SIZE:]:
+        if path == keep or now - mtime < BUNDLE_MIN_AGE:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from io import BytesIO
+import itertools
+import logging
+from operator import itemgetter
+
+from ..protocol import encode_sort_key
+from ..sort import ObjectSorter, reverse_order
+from ..util import combine_key_value, LazyValues
+from .local import LocalRunner, _split_inputs, _read_split
+
+
+logger = logging.getLogger('mrjob')
+
+
+class InlineRunner(LocalRunner):
+    """inline runner for MRJob.
+    Run Map-Reduce job in the current process, without subprocesses. Mainly
+    for unit tests and small jobs.
+
+    mapper/combiner/reducer are called directly on python objects, which are
+    grouped by an in-memory (or spilled) sort, and only the final output is
+    encoded. Keys are sorted in their natural python order, instead of the
+    byte order of their encoded form.
+
+    Notice that objects are passed between mapper/combiner/reducer without
+    being copied, so don't modify objects after yielding them.
+
+    Counters of the job are collected as those of a single step, and there
+    are no framework counters of records and bytes.
+    """
+
+    ALL_OPTS = {'input', 'output', 'sort_buffer_size', 'tmp_dir', 'output_compression'}
+
+    def _default_mr_options(self, typedbytes=False, step_num=0):
+        # mapper/combiner/reducer are called in-process, not as commands
+        return {}
+
+    def _sort(self, pairs):
+        sorter = ObjectSorter(
+            key=self._sort_key,
+            buffer_size=self._options['sort_buffer_size'],
+            tmp_dir=self._options.get('tmp_dir'))
+        sorter.extend(pairs)
+        return sorter
+
+    def _run_hook(self, step_num, fun_name):
+        fun = self.mrjob._mr_fun(fun_name, step_num)
+        if fun is None:
+            return
+        logger.info('running {} ...'.format(fun_name))
+        for out_key, out_value in fun() or ():
+            yield out_key, out_value
+        logger.info('{} completed'.format(fun_name))
+
+    def _map(self, step_num, records):
+        """run mapper (with init and final) of a step over `records`, which
+        are input lines for the first step, or pairs output by the previous
+        step for later steps"""
+        job = self.mrjob
+        for pair in self._run_hook(step_num, 'mapper_init'):
+            yield pair
+
+        has_mapper = job._has_mr_fun('mapper', step_num) or job._has_mr_fun('mapper_batch', step_num)
+        if step_num == 0:
+            read = job.input_protocol.read if has_mapper else job.internal_protocol.read
+            pairs = (read(line.rstrip(b'\r\n')) for line in records)
+        else:
+            pairs = records
+
+        # without mapper, input is passed to the next stage as it is
+        if not has_mapper:
+            for pair in pairs:
+                yield pair
+            return
+
+        logger.info('running mapper ...')
+        if job._has_mr_fun('mapper_batch', step_num):
+            for pair in job._map_batches(records):
+                yield pair
+        else:
+            mapper = job._mr_fun('mapper', step_num)
+            for key, value in pairs:
+                for out_key, out_value in mapper(key, value) or ():
+                    yield out_key, out_value
+        logger.info('mapper completed')
+
+        for pair in self._run_hook(step_num, 'mapper_final'):
+            yield pair
+
+    def _reduce(self, step_num, name, sorted_pairs, group_fields=None):
+        """run combiner or reducer (with init and final) of a step over sorted
+        pairs, grouped by key, or by the first `group_fields` fields of keys"""
+        for pair in self._run_hook(step_num, name + '_init'):
+            yield pair
+
+        group_key = itemgetter(0)
+        if group_fields is not None:
+            group_key = lambda pair: tuple(pair[0][:group_fields])
+
+        logger.info('running {} ...'.format(name))
+        fun = self.mrjob._mr_fun(name, step_num)
+        for key, kv_pairs in itertools.groupby(sorted_pairs, key=group_key):
+            for out_key, out_value in fun(key, LazyValues(kv_pairs)) or ():
+                yield out_key, out_value
+        logger.info('{} completed'.format(name))
+
+        for pair in self._run_hook(step_num, name + '_final'):
+            yield pair
+
+    def execute(self):
+        # counters are written to stderr of the job, as they are in tasks
+        stderr, self.mrjob._stderr = self.mrjob._stderr, BytesIO()
+        try:
+            self._execute()
+            self.mrjob._flush_counters()
+            self._read_stderr(None, BytesIO(self.mrjob._stderr.getvalue()))
+        finally:
+            self.mrjob._stderr = stderr
+        self._log_counters()
+
+    def _execute(self):
+        job = self.mrjob
+
+        # secondary sort: sort on the encoded fields of keys, the same way as
+        # `LocalRunner`, and group them by partition fields for reducer
+        self._sort_key = itemgetter(0)
+        group_fields = None
+        key_fields = job._key_fields()
+        if key_fields:
+            _, group_fields, sort_fields = key_fields
+            self._sort_key = lambda pair: tuple(
+                reverse_order(encode_sort_key(pair[0][i])) if reverse else encode_sort_key(pair[0][i])
+                for i, reverse in sort_fields)
+
+        lines = itertools.chain.from_iterable(
+            _read_split(split) for split in _split_inputs(self._options['input'], 1))
+
+        # objects are passed from a step to the next one as they are
+        pairs = lines
+        for step_num in range(job._num_steps()):
+            pairs = self._map(step_num, pairs)
+            if step_num in job._salted_steps:
+                pairs = job._salt_pairs(pairs)
+            if job._has_mr_fun('combiner', step_num):
+                pairs = self._reduce(step_num, 'combiner', self._sort(pairs))
+            if job._has_mr_fun('reducer', step_num):
+                pairs = self._reduce(step_num, 'reducer', self._sort(pairs), group_fields)
+
+        # encode final output, the same way as in `MRJob._run_mapper` or
+        # `MRJob._run_reducer`
+        if job._has_mr_fun('reducer', step_num):
+            write = job.output_protocol.write
+            lines = (write(None, combine_key_value(k, v)) + b'\n' for k, v in pairs)
+        else:
+            write = job.internal_protocol.write
+            lines = (write(k, v) + b'\n' for k, v in pairs)
+
+        path, = self._prepare_output(1)
+        self._write_output(lines, path)
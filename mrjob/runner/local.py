@@ -1,29 +1,125 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import fileinput
+import json
 import logging
 import glob
+from operator import itemgetter
 import os
+import re
+import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+from threading import Event, Lock, Thread
+import time
 
-from ..util import non_blocking_communicate
+from ..sort import merge_sorted, DEFAULT_SORT_BUFFER_SIZE
+from .shuffle import read_run, record_keys, run_path, sort_cmd, sort_env
+from .taskio import compress_chunks, compression_codec, iter_chunks, non_blocking_communicate
+from .taskio import read_input_split, split_lines, wait_rusage, COMPRESSION_CODECS, PIPE_CHUNK_SIZE
 
 
 logger = logging.getLogger('mrjob')
 
 
+class _Cancelled(Exception):
+    """raised by tasks which are not started, because the job is cancelled"""
+
+
+# framework counters of tasks (prefixed with the stage name), see `_add_task_stats`
+_IO_FIELDS = ('input_records', 'input_bytes', 'output_records', 'output_bytes')
+
+# counters and status written to stderr by tasks, see `MRJob.increment_counter`
+_COUNTER_RE = re.compile(br'^reporter:counter:([^,]*),([^,]*),(-?\d+)\s*$')
+_STATUS_PREFIX = b'reporter:status:'
+
+
+def _split_inputs(paths, num_splits):
+    """split input files into about `num_splits` newline-aligned byte ranges.
+    :return: a list of ``(path, start, end)`` tuples. stdin (``-``) can't be
+        split, and is returned as ``('-', 0, None)``. Neither can compressed
+        files, each of which is a split of its own, so that several of them
+        are decompressed in parallel by different mappers.
+    """
+    if paths == ['-']:
+        return [('-', 0, None)]
+
+    sizes = [os.path.getsize(path) for path in paths]
+    split_size = max(sum(sizes) // max(num_splits, 1), 1)
+
+    splits = []
+    for path, size in zip(paths, sizes):
+        if compression_codec(path):
+            splits.append((path, 0, size))
+        else:
+            splits.extend((path, start, end) for start, end in split_lines(path, split_size))
+
+    # always run at least one (empty) map task, so that mapper_init and
+    # mapper_final are called, like before
+    return splits or [(os.devnull, 0, 0)]
+
+
+def _read_split(split):
+    """read lines (with trailing newline) of an input split"""
+    path, start, end = split
+    if path == '-':
+        stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+        for line in stdin:
+            yield line
+        return
+
+    for line in read_input_split(path, start, end - start):
+        yield line
+
+
+def _read_chunks(stream):
+    """read output of a process in chunks as they come, instead of lines"""
+    return iter(lambda: stream.read1(PIPE_CHUNK_SIZE), b'')
+
+
 class LocalRunner(object):
     """local runner for MRJob.
     Run Map-Reduce job on localhost with subprocess. Mainly for testing.
+
+    Input files are split into newline-aligned byte ranges, which are processed
+    by up to `num_mappers` mapper processes concurrently. Each mapper reads its
+    split from the (memory-mapped) input file by itself, given the path and
+    byte range on its command line. Compressed (``.gz``, ``.bz2``) input files
+    are not split, but decompressed by a mapper each. Mapper output is
+    partitioned by key hash into `num_reducers` partitions and sorted by a sort
+    process of each map task (see `mrjob.runner.shuffle`), which writes a
+    sorted run of each partition to disk. The runs of each partition are merged
+    and fed into a reducer process of its own. With multiple output
+    partitions, `output` is a directory of ``part-NNNNN`` files like on hadoop.
+    With `output_compression`, output is compressed, and the part files are
+    named with the extension of the codec.
+
+    With ``io='typedbytes'``, mapper output is typed bytes instead of lines,
+    which are sorted by their raw key bytes. Like on hadoop, combiners are
+    skipped in this mode.
+
+    Secondary sort of jobs with ``KEY_FIELDS`` is emulated like hadoop's
+    ``KeyFieldBasedPartitioner`` and ``KeyFieldBasedComparator``.
+
+    Steps of multi-step jobs are streamed: output of each reducer is piped
+    into the mappers of the next steps, without being written to disk.
     """
 
-    ALL_OPTS = {'input', 'output', 'mapper', 'combiner', 'reducer'}
+    ALL_OPTS = {
+        'input', 'output',
+        'mapper', 'combiner', 'reducer',
+        'sort_buffer_size', # max bytes sorted in memory before spilling to disk
+        'tmp_dir', # where to spill sorted runs, defaults to the system temp dir
+        'num_mappers', # max number of mapper processes running concurrently
+        'num_reducers', # number of reduce partitions
+        'io', # 'text' or 'typedbytes', format of data between mapper/combiner/reducer
+        'profile', # profile mapper/combiner/reducer tasks, see `MRJob._run_task`
+        'stage_report', # path to write a JSON report of resource usage and throughput of each stage
+        'output_compression', # 'gzip' or 'bz2', compress output files
+    }
     REQUIRED_OPTS = set()
-    # local runner should not process data bigger than 500MB or 5000000 lines
-    MAX_INPUT = 500e6
-    MAX_INPUT_LINES = 5000000
 
     def __init__(self, mrjob, cmd_args=None, **kwargs):
         self.mrjob = mrjob
@@ -35,8 +131,65 @@ class LocalRunner(object):
 
         options.update(cmd_options)
         options = self._validate_options(options)
-        self._options = self._default_mr_options()
-        self._options.update(options)
+
+        has_reducer = 'reducer' in options or self.mrjob._has_reducer()
+
+        # typed bytes only affect the shuffle, so map-only jobs ignore it
+        self._typedbytes = options['io'] == 'typedbytes' and has_reducer
+
+        # secondary sort: partition and sort on fields of the key
+        self._key_fields = self.mrjob._key_fields() if has_reducer else None
+        if self._key_fields and self._typedbytes:
+            raise ValueError('secondary sort (KEY_FIELDS) is not supported with typed bytes')
+        self._record_key = record_keys(self._typedbytes, self._key_fields)[0]
+
+        self._options = options
+        self._steps = self._step_commands(options)
+
+        # mappers of the job read their input splits by themselves, unlike
+        # commands given by option "mapper"
+        self._mapper_reads_splits = 'mapper' in self._steps[0] and 'mapper' not in options
+
+        # counters of each step, collected from stderr of tasks, and
+        # statistics of tasks and sort processes, see `report`
+        self._counters = {}
+        self._lock = Lock()
+        self._task_stats = []
+        self._sort_stats = []
+        self._shuffle_dir = None
+        self._report = None
+
+        # running processes of tasks, which are killed when the job is cancelled
+        self._procs = set()
+        self._cancelled = Event()
+
+    def counters(self):
+        """get counters of the job, summed up over all tasks, as a dict of
+        ``{step_num: {group: {counter: amount}}}``"""
+        return self._counters
+
+    def _step_commands(self, options):
+        """get mapper/combiner/reducer commands of each step of the job.
+        mapper/combiner/reducer options override those of single-step jobs.
+        """
+        num_steps = self.mrjob._num_steps()
+        overrides = dict((name, options[name]) for name in ('mapper', 'combiner', 'reducer') if name in options)
+        if overrides and num_steps > 1:
+            raise ValueError('options "mapper", "combiner" and "reducer" are not supported by multi-step jobs')
+
+        steps = []
+        for step_num in range(num_steps):
+            typedbytes = self._typedbytes and (
+                'reducer' in overrides or self.mrjob._has_mr_fun('reducer', step_num))
+            step = self._default_mr_options(typedbytes, step_num)
+            step.update(overrides)
+            # like HadoopRunner, since hadoop streaming reads combiner output
+            # as text, which doesn't match typed bytes map output
+            if typedbytes and 'combiner' in step:
+                logger.warning('combiner is skipped in typedbytes mode')
+                del step['combiner']
+            steps.append(step)
+        return steps
 
     def _parse_cmd_args(self, cmd_args):
         options = {}
@@ -48,9 +201,39 @@ class LocalRunner(object):
         parser.add_argument(
             '-output', dest='output',
             help='Output location for reducer. The same as `hadoop streaming -output`.')
+        parser.add_argument(
+            '-sort_buffer_size', dest='sort_buffer_size', type=int,
+            help='Max bytes to sort in memory before spilling to disk.')
+        parser.add_argument(
+            '-tmp_dir', dest='tmp_dir', help='Directory to spill sorted data into.')
+        parser.add_argument(
+            '-jobs', dest='jobs', type=int,
+            help='Run this many mappers and reducers in parallel.')
+        parser.add_argument(
+            '-num_mappers', dest='num_mappers', type=int,
+            help='Number of mappers to run in parallel.')
+        parser.add_argument(
+            '-num_reducers', dest='num_reducers', type=int,
+            help='Number of reduce partitions.')
+        parser.add_argument(
+            '-io', dest='io', choices=('text', 'typedbytes'),
+            help='Format of data between mapper/combiner/reducer. The same as `hadoop streaming -io`.')
+        parser.add_argument(
+            '-profile', dest='profile', action='store_true',
+            help='Profile mapper/combiner/reducer tasks, and report to stderr.')
+        parser.add_argument(
+            '-stage_report', dest='stage_report',
+            help='Write a JSON report of resource usage and throughput of each stage to this path.')
+        parser.add_argument(
+            '-output_compression', dest='output_compression', choices=sorted(COMPRESSION_CODECS),
+            help='Compress output with this codec.')
         args = parser.parse_args(cmd_args)
 
-        for name in ('input', 'output'):
+        if args.jobs:
+            options['num_mappers'] = options['num_reducers'] = args.jobs
+
+        for name in ('input', 'output', 'sort_buffer_size', 'tmp_dir', 'num_mappers', 'num_reducers', 'io', 'profile',
+                     'stage_report', 'output_compression'):
             if getattr(args, name, None):
                 options[name] = getattr(args, name)
 
@@ -91,24 +274,12 @@ class LocalRunner(object):
                     continue
                 input_.append(path)
             options['input'] = input_
-
-            if sum(os.path.getsize(p) for p in options['input']) > self.MAX_INPUT:
-                raise ValueError(
-                    'LocalRunner is mainly used for testing, but the input '
-                    'data is too large(>{}bytes)'.format(self.MAX_INPUT))
         else:
             # default read from stdin
             options['input'] = ['-']
 
         # check output
-        if 'output' in options:
-            path = options['output']
-            if os.path.isdir(path):
-                raise ValueError('option "output"({}) is an existing directory'.format(path))
-            if os.path.isfile(path) and os.path.getsize(path) != 0:
-                # raise ValueError('option "output"({}) is an existing file and not empty'.format(path))
-                pass
-        else:
+        if 'output' not in options:
             # default output to stdout
             options['output'] = '-'
 
@@ -119,57 +290,485 @@ class LocalRunner(object):
             if not isinstance(options[name], basestring):
                 raise ValueError('option "{}" should be a string'.format(name))
 
+        # check sort options
+        options.setdefault('sort_buffer_size', DEFAULT_SORT_BUFFER_SIZE)
+        if not isinstance(options['sort_buffer_size'], (int, long)) or options['sort_buffer_size'] <= 0:
+            raise ValueError('option "sort_buffer_size" should be a positive integer')
+        if options.get('tmp_dir') and not os.path.isdir(options['tmp_dir']):
+            raise ValueError('option "tmp_dir"({}) is not a directory'.format(options['tmp_dir']))
+
+        # check parallelism
+        for name in ('num_mappers', 'num_reducers'):
+            options.setdefault(name, 1)
+            if not isinstance(options[name], (int, long)) or options[name] <= 0:
+                raise ValueError('option "{}" should be a positive integer'.format(name))
+
+        # check io
+        options.setdefault('io', 'text')
+        if options['io'] not in ('text', 'typedbytes'):
+            raise ValueError('option "io" should be "text" or "typedbytes"')
+
+        # check output compression
+        codec = options.get('output_compression')
+        if codec is not None and codec not in COMPRESSION_CODECS:
+            raise ValueError('option "output_compression" should be one of: {}'.format(
+                ', '.join(sorted(COMPRESSION_CODECS))))
+
         logger.info('job config OK.')
         return options
 
-    def _default_mr_options(self):
-        """get default -mapper/-combiner/-reducer options"""
+    def _default_mr_options(self, typedbytes=False, step_num=0):
+        """get default -mapper/-combiner/-reducer options of a step"""
         res = {}
         py_script = sys.argv[0]
         for name in ('mapper', 'combiner', 'reducer'):
-            if not self.mrjob._has_mr_fun(name):
+            if not self.mrjob._has_mr_step(name, step_num):
                 continue
             res[name] = 'python "{}" --{}'.format(py_script, name)
+            if self.mrjob._num_steps() > 1:
+                res[name] += ' --step-num {}'.format(step_num)
+            if typedbytes:
+                res[name] += ' --io typedbytes'
+            if self._options.get('profile'):
+                res[name] += ' --profile'
+                # save profile data next to the output
+                if self._options['output'] != '-':
+                    res[name] += ' --profile-dir "{}.profile"'.format(self._options['output'].rstrip('/'))
         return res
 
 
-    def execute(self):
-        # if not self.mrjob._has_mr_fun('mapper'):
-        #     raise ValueError('You have to implement the "mapper" method')
-
-        def generate_inputs():
-            for i, line in enumerate(
-                    fileinput.input(files=self._options['input'], mode='rb')):
-                if i >= self.MAX_INPUT_LINES:
-                    logger.warning(
-                        'LocalRunner is mainly used for testing, but the input data '
-                        'is too large(>{}lines). Exceeding lines will be ignored'
-                        .format(self.MAX_INPUT_LINES))
-                    break
-                yield line
-
-        # run mapper/combiner/reducer
-        inputs = generate_inputs()
-        outputs = None
-        names = [name for name in ('mapper', 'combiner', 'reducer') if name in self._options]
-        for i, name in enumerate(names):
-            cmd = self._options[name]
-            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, shell=True)
-            out = non_blocking_communicate(proc, inputs)
-            if i < len(names) - 1:
-                # sort out lines
-                inputs = sorted(out, key=lambda line: line.split(b'\t', 1)[0])
+    def _has_shuffle(self, step_num):
+        return 'reducer' in self._steps[step_num]
+
+    def _pipe(self, cmd, inputs, read_stderr, done, **kwargs):
+        """start process `cmd` (with `kwargs` of ``subprocess.Popen``), pipe
+        `inputs` through it, and yield chunks of its output. `read_stderr` is
+        called with lines of its stderr, and `done` with its resource usage
+        once it exits successfully."""
+        with self._lock:
+            if self._cancelled.is_set():
+                raise _Cancelled('job cancelled')
+            # in its own process group, so that the shell and the python
+            # process it runs are killed together
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, preexec_fn=os.setpgrp, **kwargs)
+            self._procs.add(proc)
+        usage = {}
+
+        def wait(proc):
+            usage['rusage'] = wait_rusage(proc)[1]
+            with self._lock:
+                self._procs.discard(proc)
+
+        for chunk in non_blocking_communicate(proc, inputs, _read_chunks, wait, read_stderr):
+            yield chunk
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+        done(usage['rusage'])
+
+    def _communicate(self, step_num, name, inputs, split=None):
+        """pipe `inputs` through the mapper/combiner/reducer command `name` of
+        a step, and yield chunks of its output. With an input `split`, the
+        mapper reads it from the input file instead of `inputs`."""
+        cmd = self._steps[step_num][name]
+        if split is not None:
+            path, offset, end = split
+            cmd += ' --split-path "{}" --split-offset {} --split-length {}'.format(path, offset, end - offset)
+        start = time.time()
+        counters = {}
+
+        def read_stderr(lines):
+            self._read_stderr(step_num, lines, counters)
+
+        def done(rusage):
+            self._add_task_stats(step_num, name, start, time.time(), rusage, counters)
+
+        for chunk in self._pipe(cmd, inputs, read_stderr, done, shell=True):
+            yield chunk
+
+    def _sort(self, step_num, name, inputs, output=None):
+        """sort `inputs` (output of a mapper or combiner) of combiner/reducer
+        `name` of a step in a sort process. With `output`, records are split
+        into the sorted runs of reduce partitions (see `run_path`), and
+        nothing is yielded; otherwise chunks of sorted records are yielded."""
+        # map-only steps (with combiner) don't shuffle, and always pass lines
+        shuffle = self._has_shuffle(step_num)
+        num_tasks = max(self._options['num_mappers'], self._options['num_reducers'])
+        work_dir = tempfile.mkdtemp(prefix='sort-', dir=self._shuffle_dir)
+        stats_path = os.path.join(work_dir, 'stats.json')
+        cmd = sort_cmd(
+            typedbytes=self._typedbytes and shuffle,
+            key_fields=self._key_fields if shuffle else None,
+            buffer_size=self._options['sort_buffer_size'] // num_tasks,
+            tmp_dir=work_dir,
+            stats=stats_path,
+            partitions=self._options['num_reducers'],
+            output=output)
+
+        def done(rusage):
+            with open(stats_path) as f:
+                stats = json.load(f)
+            stats['cpu_seconds'] = rusage.ru_utime + rusage.ru_stime
+            with self._lock:
+                self._sort_stats.append((step_num, name, stats))
+
+        try:
+            for chunk in self._pipe(cmd, inputs, lambda lines: self._read_stderr(step_num, lines), done,
+                                    env=sort_env()):
+                yield chunk
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _cancel(self):
+        """stop starting new tasks, and kill processes of running tasks"""
+        with self._lock:
+            self._cancelled.set()
+            for proc in self._procs:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def _run_tasks(self, fun, args_list, concurrency):
+        """call `fun` with each tuple of `args_list`, in up to `concurrency`
+        threads. If a task fails (or the job is interrupted), tasks not started
+        yet are skipped, processes of running tasks are killed, and the first
+        error is raised once all threads are done.
+        :return: results of the tasks, in order
+        """
+        results = [None] * len(args_list)
+        errors = []
+        tasks = iter(enumerate(args_list))
+        tasks_lock = Lock()
+
+        def worker():
+            while not self._cancelled.is_set():
+                with tasks_lock:
+                    i, args = next(tasks, (None, None))
+                if i is None:
+                    return
+                try:
+                    results[i] = fun(*args)
+                except Exception as e:
+                    if not isinstance(e, _Cancelled) and not self._cancelled.is_set():
+                        logger.error('task failed: {}, cancelling the job'.format(e))
+                    errors.append(e)
+                    self._cancel()
+
+        threads = [Thread(target=worker) for _ in range(max(min(concurrency, len(args_list)), 1))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            for t in threads:
+                # join with timeout, so that KeyboardInterrupt is not blocked
+                while t.is_alive():
+                    t.join(0.1)
+        except KeyboardInterrupt:
+            logger.error('interrupted, cancelling the job')
+            self._cancel()
+            for t in threads:
+                t.join()
+            raise
+
+        if errors:
+            raise errors[0]
+        return results
+
+    def _read_stderr(self, step_num, lines, counters=None):
+        """read lines of stderr of a task: sum up counters (into `counters`
+        too, if it's given), log status messages, and pass the other lines on
+        to stderr"""
+        if counters is None:
+            counters = {}
+        fout = getattr(sys.stderr, 'buffer', sys.stderr)
+        for line in lines:
+            m = _COUNTER_RE.match(line)
+            if m:
+                group, counter, amount = m.groups()
+                key = (group.decode('utf8'), counter.decode('utf8'))
+                counters[key] = counters.get(key, 0) + int(amount)
+            elif line.startswith(_STATUS_PREFIX):
+                status = line[len(_STATUS_PREFIX):].rstrip(b'\r\n').decode('utf8')
+                logger.info(u'status: {}'.format(status))
             else:
-                outputs = out
-
-        # write last_out to output
-        if self._options['output'] == '-':
-            fout = sys.stdout
-        else:
-            fout = open(self._options['output'], 'wb')
-
-        for line in outputs:
-            fout.write(line)
+                fout.write(line)
+                fout.flush()
+
+        with self._lock:
+            step_counters = self._counters.setdefault(step_num, {})
+            for (group, counter), amount in counters.items():
+                group_counters = step_counters.setdefault(group, {})
+                group_counters[counter] = group_counters.get(counter, 0) + amount
+
+    def _log_counters(self):
+        for step_num in sorted(self._counters):
+            if step_num is None or len(self._steps) == 1:
+                lines = ['counters:']
+            else:
+                lines = ['counters of step {}:'.format(step_num)]
+            for group, counters in sorted(self._counters[step_num].items()):
+                lines.append(u'  {}'.format(group))
+                for counter, amount in sorted(counters.items()):
+                    lines.append(u'    {}: {}'.format(counter, amount))
+            logger.info(u'\n'.join(lines))
+
+    def _add_task_stats(self, step_num, name, start, end, rusage, counters):
+        """record resource usage and throughput of a finished task. Records
+        and bytes are taken from the framework counters of the task, and are
+        None if they are not counted (e.g. by tasks of shell commands)."""
+        max_rss_kb = rusage.ru_maxrss
+        # linux reports KB, mac os reports bytes
+        if sys.platform == 'darwin':
+            max_rss_kb //= 1024
+        stats = {
+            'step': step_num,
+            'stage': name,
+            'start': start,
+            'end': end,
+            'wall_seconds': end - start,
+            'cpu_seconds': rusage.ru_utime + rusage.ru_stime,
+            'max_rss_kb': max_rss_kb,
+        }
+        for field in _IO_FIELDS:
+            stats[field] = counters.get(('mrjob', '{}_{}'.format(name, field)))
+        with self._lock:
+            self._task_stats.append(stats)
+
+    def _make_report(self, start, end):
+        """summarize statistics of tasks and sorters of each stage"""
+        steps = []
+        for step_num in range(len(self._steps)):
+            stages = {}
+            for name in ('mapper', 'combiner', 'reducer'):
+                tasks = [t for t in self._task_stats if t['step'] == step_num and t['stage'] == name]
+                if not tasks:
+                    continue
+                elapsed = max(t['end'] for t in tasks) - min(t['start'] for t in tasks)
+                stage = {
+                    'tasks': len(tasks),
+                    'elapsed_seconds': round(elapsed, 4),
+                    'wall_seconds': round(sum(t['wall_seconds'] for t in tasks), 4),
+                    'cpu_seconds': round(sum(t['cpu_seconds'] for t in tasks), 4),
+                    'max_rss_kb': max(t['max_rss_kb'] for t in tasks),
+                }
+                for field in _IO_FIELDS:
+                    values = [t[field] for t in tasks]
+                    stage[field] = None if None in values else sum(values)
+                stage['records_per_sec'] = None
+                if stage['input_records'] is not None:
+                    stage['records_per_sec'] = round(stage['input_records'] / max(elapsed, 1e-9), 1)
+                stage['task_stats'] = [
+                    dict((k, round(v, 4) if isinstance(v, float) else v) for k, v in t.items()
+                         if k not in ('step', 'stage', 'start', 'end'))
+                    for t in sorted(tasks, key=itemgetter('start'))]
+                stages[name] = stage
+
+            sorts = {}
+            for name in ('combiner', 'reducer'):
+                procs = [stats for i, n, stats in self._sort_stats if i == step_num and n == name]
+                if procs:
+                    sorts[name] = {
+                        'processes': len(procs),
+                        'sorters': sum(stats['sorters'] for stats in procs),
+                        'records': sum(stats['records'] for stats in procs),
+                        'spills': sum(stats['spills'] for stats in procs),
+                        'sort_seconds': round(sum(stats['sort_seconds'] for stats in procs), 4),
+                        'cpu_seconds': round(sum(stats['cpu_seconds'] for stats in procs), 4),
+                    }
+
+            steps.append({
+                'step': step_num,
+                'stages': stages,
+                'sort': sorts,
+                'counters': self._counters.get(step_num, {}),
+            })
+
+        return {
+            'job': type(self.mrjob).__name__,
+            'runner': type(self).__name__,
+            'options': dict((name, self._options[name])
+                            for name in ('num_mappers', 'num_reducers', 'io', 'sort_buffer_size')),
+            'wall_seconds': round(end - start, 4),
+            'steps': steps,
+        }
+
+    def _log_report(self, report):
+        for step in report['steps']:
+            for name in ('mapper', 'combiner', 'reducer'):
+                if name in step['sort']:
+                    sort = step['sort'][name]
+                    logger.info('step {} sort before {}: {} records, {} spills, {:.3f}s, cpu {:.3f}s'.format(
+                        step['step'], name, sort['records'], sort['spills'], sort['sort_seconds'],
+                        sort['cpu_seconds']))
+                if name in step['stages']:
+                    stage = step['stages'][name]
+                    logger.info('step {} {}: {} tasks in {:.3f}s, cpu {:.3f}s, max rss {}KB, '
+                                '{} records in, {} records out'.format(
+                                    step['step'], name, stage['tasks'], stage['elapsed_seconds'],
+                                    stage['cpu_seconds'], stage['max_rss_kb'],
+                                    stage['input_records'], stage['output_records']))
+
+    def report(self):
+        """get the report of the last run: wall time, cpu time, max rss,
+        and input/output records and bytes of each stage (and of each task),
+        time spent in sorting and spills before combiners and reducers (and
+        cpu time of the sort processes), and counters of each step"""
+        return self._report
+
+    def _next_shuffle(self, step_num):
+        """get the first step since `step_num` with a reducer, or None"""
+        for i in range(step_num, len(self._steps)):
+            if self._has_shuffle(i):
+                return i
+        return None
+
+    def _prepare_output(self, num_parts):
+        """decide where each output partition is written to.
+        :return: a list of paths, ``-`` means stdout."""
+        path = self._options['output']
+
+        # a single partition is written straight to the output
+        if num_parts == 1:
+            if path != '-' and os.path.isdir(path):
+                raise ValueError('option "output"({}) is an existing directory'.format(path))
+            return [path]
+
+        # partitions are written into a temp dir, and copied to stdout later
+        if path == '-':
+            self._output_tmp_dir = tempfile.mkdtemp(prefix='mrjob-output-', dir=self._options.get('tmp_dir'))
+            path = self._output_tmp_dir
+
+        if os.path.isfile(path):
+            raise ValueError('option "output"({}) is an existing file, but {} '
+                             'output partitions need a directory'.format(path, num_parts))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        # compressed partitions are named like on hadoop, e.g. part-00000.gz
+        codec = self._options.get('output_compression')
+        ext = COMPRESSION_CODECS[codec][0] if codec else ''
+        return [os.path.join(path, 'part-{:05d}{}'.format(i, ext)) for i in range(num_parts)]
+
+    def _write_output(self, lines, path):
+        codec = self._options.get('output_compression')
+        if codec:
+            lines = compress_chunks(iter_chunks(lines), codec)
+
+        if path == '-':
+            fout = getattr(sys.stdout, 'buffer', sys.stdout)
+            for line in lines:
+                fout.write(line)
+            fout.flush()
+            return
+
+        with open(path, 'wb') as fout:
+            for line in lines:
+                fout.write(line)
+
+    def _run_steps(self, step_num, lines, path=None, mapped=False):
+        """pipe `lines` through the mappers (and combiners) of steps from
+        `step_num`, until a step with a reducer. With `mapped`, `lines` are
+        output of the mapper of `step_num` already.
+        :return: the prefix of sorted runs of the reduce partitions of that
+            step (see `run_path`). If there is no such step, output is
+            written to `path` directly, and None is returned.
+        """
+        out = lines
+        first_step = step_num
+        for step_num in range(step_num, len(self._steps)):
+            step = self._steps[step_num]
+            if 'mapper' in step and not (mapped and step_num == first_step):
+                out = self._communicate(step_num, 'mapper', out)
+
+            if 'combiner' in step:
+                out = self._communicate(step_num, 'combiner', self._sort(step_num, 'combiner', out))
+
+            if 'reducer' in step:
+                output = os.path.join(tempfile.mkdtemp(prefix='map-', dir=self._shuffle_dir), 'part')
+                for _ in self._sort(step_num, 'reducer', out, output):
+                    pass
+                return output
+
+        self._write_output(out, path)
+        return None
+
+    def _run_map_task(self, split, path=None):
+        """run steps of the job over an input split, until the first shuffle.
+        The mapper reads the split from the input file by itself if it can,
+        instead of having every line piped through the runner."""
+        if self._mapper_reads_splits and split[0] != '-':
+            out = self._communicate(0, 'mapper', (), split)
+            return self._run_steps(0, out, path, mapped=True)
+        return self._run_steps(0, _read_split(split), path)
+
+    def _run_reduce_task(self, step_num, runs, path=None):
+        """merge sorted runs of a partition (one of each map task), run
+        reducer over it, and pipe its output through the following steps"""
+        typedbytes = self._typedbytes and self._has_shuffle(step_num)
+        merged = merge_sorted([read_run(run, typedbytes) for run in runs], key=self._record_key)
+        if typedbytes:
+            # typed bytes are sorted as (raw_key, raw_value) pairs
+            merged = (k + v for k, v in merged)
+        try:
+            out = self._communicate(step_num, 'reducer', merged)
+            return self._run_steps(step_num + 1, out, path)
+        finally:
+            for run in runs:
+                os.remove(run)
 
-        if self._options['output'] != '-':
-            fout.close()
+    def execute(self):
+        start = time.time()
+        num_mappers = self._options['num_mappers']
+        num_reducers = self._options['num_reducers']
+
+        splits = _split_inputs(self._options['input'], num_mappers)
+        shuffle_step = self._next_shuffle(0)
+        logger.info('running {} steps: {} map tasks with {} processes, {} reduce tasks'.format(
+            len(self._steps), len(splits), min(num_mappers, len(splits)),
+            0 if shuffle_step is None else num_reducers))
+
+        self._output_tmp_dir = None
+        # sorted runs of map tasks, and spills of sort processes
+        self._shuffle_dir = tempfile.mkdtemp(prefix='mrjob-shuffle-', dir=self._options.get('tmp_dir'))
+        try:
+            # map-only job writes one output partition for each map task
+            if shuffle_step is None:
+                paths = self._prepare_output(len(splits))
+            else:
+                paths = [None] * len(splits)
+
+            map_outputs = self._run_tasks(self._run_map_task, list(zip(splits, paths)), num_mappers)
+
+            # reducer of each step is piped into the mappers of the following
+            # steps, until the next shuffle or the final output
+            while shuffle_step is not None:
+                next_shuffle = self._next_shuffle(shuffle_step + 1)
+                if next_shuffle is None:
+                    paths = self._prepare_output(num_reducers)
+                else:
+                    paths = [None] * num_reducers
+                args = [(shuffle_step, [run_path(prefix, i) for prefix in map_outputs], path)
+                        for i, path in enumerate(paths)]
+                map_outputs = self._run_tasks(self._run_reduce_task, args, num_reducers)
+                shuffle_step = next_shuffle
+
+            # copy output partitions to stdout in order
+            if self._output_tmp_dir is not None:
+                fout = getattr(sys.stdout, 'buffer', sys.stdout)
+                for path in paths:
+                    with open(path, 'rb') as fin:
+                        shutil.copyfileobj(fin, fout)
+                fout.flush()
+        finally:
+            # remove sorted runs which are never read, e.g. when the job fails
+            shutil.rmtree(self._shuffle_dir, ignore_errors=True)
+            if self._output_tmp_dir is not None:
+                shutil.rmtree(self._output_tmp_dir, ignore_errors=True)
+
+        self._log_counters()
+        self._report = self._make_report(start, time.time())
+        self._log_report(self._report)
+        if self._options.get('stage_report'):
+            with open(self._options['stage_report'], 'w') as f:
+                json.dump(self._report, f, indent=2, sort_keys=True)
+            logger.info('report written to {}'.format(self._options['stage_report']))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""Sort process of LocalRunner: sort the output of a map task (or the input
+of a combiner) out of the runner process, so that the threads of the runner
+don't contend for the GIL with sorting, and only merge sorted runs.
+
+Records are read from stdin, and either partitioned by key into sorted runs,
+one file for each reduce partition, or written to stdout sorted::
+
+    python -m mrjob.runner.shuffle [--typedbytes | --key-fields N P FIELDS]
+        [--buffer-size BYTES] [--tmp-dir DIR] [--stats PATH]
+        [--partitions N --output PREFIX]
+
+Statistics of the sort (records, spills and sort time) are written to
+`--stats` as JSON. Command lines are made by `sort_cmd`.
+"""
+
+import argparse
+import json
+from operator import itemgetter
+import os
+import sys
+import zlib
+
+from ..protocol import read_typedbytes_pairs
+from ..sort import ExternalSorter, PairSorter, text_key, DEFAULT_SORT_BUFFER_SIZE
+from ..sort import key_fields_sort_key, key_fields_partition_key
+
+
+# never give a single sorter less memory than this
+_MIN_SORT_BUFFER_SIZE = 1024 * 1024
+
+# root of the mrjob source tree, which is put on PYTHONPATH of sort processes
+_MRJOB_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _partition(key, num_partitions):
+    """hash partitioner: choose a partition by raw `key`. Unlike ``hash``,
+    crc32 is the same in every process, so records of a key from all map tasks
+    end up in the same partition."""
+    return (zlib.crc32(key) & 0x7fffffff) % num_partitions
+
+
+def record_keys(typedbytes=False, key_fields=None):
+    """get sort and partition keys of records: ``(raw_key, raw_value)`` pairs
+    of typed bytes, or lines, which are split into fields with `key_fields`
+    (see `MRJob._key_fields`).
+    :return: a ``(sort_key, partition_key)`` tuple of functions
+    """
+    if typedbytes:
+        return itemgetter(0), itemgetter(0)
+    if key_fields:
+        num_fields, partition_fields, sort_fields = key_fields
+        return key_fields_sort_key(num_fields, sort_fields), key_fields_partition_key(partition_fields)
+    return text_key, text_key
+
+
+def run_path(prefix, partition):
+    """path of the sorted run of a reduce partition"""
+    return '{}-{:05d}'.format(prefix, partition)
+
+
+def read_run(path, typedbytes=False):
+    """read records of a sorted run"""
+    sorter_class = PairSorter if typedbytes else ExternalSorter
+    return sorter_class().read_run(path)
+
+
+def sort_cmd(typedbytes=False, key_fields=None, buffer_size=DEFAULT_SORT_BUFFER_SIZE, tmp_dir=None, stats=None,
+             partitions=None, output=None):
+    """get the command line (a list) of a sort process with these options"""
+    cmd = [sys.executable, '-m', __name__, '--buffer-size', str(buffer_size)]
+    if typedbytes:
+        cmd.append('--typedbytes')
+    if key_fields:
+        num_fields, partition_fields, sort_fields = key_fields
+        cmd.extend(['--key-fields', str(num_fields), str(partition_fields),
+                    ','.join('{}{}'.format(i, 'r' if reverse else '') for i, reverse in sort_fields)])
+    if tmp_dir:
+        cmd.extend(['--tmp-dir', tmp_dir])
+    if stats:
+        cmd.extend(['--stats', stats])
+    if output:
+        cmd.extend(['--partitions', str(partitions), '--output', output])
+    return cmd
+
+
+def sort_env(env=None):
+    """get the environment of a sort process, with mrjob on PYTHONPATH"""
+    env = dict(os.environ if env is None else env)
+    if env.get('PYTHONPATH'):
+        env['PYTHONPATH'] = '{}:{}'.format(_MRJOB_ROOT, env['PYTHONPATH'])
+    else:
+        env['PYTHONPATH'] = _MRJOB_ROOT
+    return env
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m mrjob.runner.shuffle')
+    parser.add_argument('--typedbytes', action='store_true', help='Sort typed bytes by raw key.')
+    parser.add_argument('--key-fields', nargs=3, metavar=('NUM_FIELDS', 'PARTITION_FIELDS', 'SORT_FIELDS'),
+                        help='Sort lines on fields of the key, e.g. "3 1 0,2r".')
+    parser.add_argument('--buffer-size', type=int, default=DEFAULT_SORT_BUFFER_SIZE,
+                        help='Max bytes to sort in memory before spilling to disk.')
+    parser.add_argument('--tmp-dir', help='Directory to spill sorted data into.')
+    parser.add_argument('--stats', help='Write statistics of the sort to this path.')
+    parser.add_argument('--partitions', type=int, default=1, help='Number of reduce partitions.')
+    parser.add_argument('--output', help='Write the sorted run of each partition to PREFIX-NNNNN.')
+    args = parser.parse_args(argv)
+
+    args.key_fields_spec = None
+    if args.key_fields:
+        num_fields, partition_fields, sort_fields = args.key_fields
+        args.key_fields_spec = (int(num_fields), int(partition_fields),
+                                [(int(field.rstrip('r')), field.endswith('r')) for field in sort_fields.split(',')])
+    return args
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    sort_key, partition_key = record_keys(args.typedbytes, args.key_fields_spec)
+
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    records = read_typedbytes_pairs(stdin) if args.typedbytes else stdin
+
+    num_partitions = args.partitions if args.output else 1
+    sorter_class = PairSorter if args.typedbytes else ExternalSorter
+    buffer_size = max(args.buffer_size // num_partitions, _MIN_SORT_BUFFER_SIZE)
+    sorters = [sorter_class(key=sort_key, buffer_size=buffer_size, tmp_dir=args.tmp_dir)
+               for _ in range(num_partitions)]
+    try:
+        if num_partitions == 1:
+            sorters[0].extend(records)
+        else:
+            for record in records:
+                sorters[_partition(partition_key(record), num_partitions)].add(record)
+
+        if args.output:
+            for i, sorter in enumerate(sorters):
+                sorter.dump(run_path(args.output, i))
+        else:
+            stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+            write = stdout.write
+            for record in sorters[0]:
+                if args.typedbytes:
+                    write(record[0])
+                    write(record[1])
+                else:
+                    # the last line of a task may have no newline
+                    write(record if record.endswith(b'\n') else record + b'\n')
+            stdout.flush()
+    finally:
+        for sorter in sorters:
+            sorter.cleanup()
+
+    if args.stats:
+        with open(args.stats, 'w') as f:
+            json.dump({
+                'sorters': len(sorters),
+                'records': sum(sorter.records for sorter in sorters),
+                'spills': sum(sorter.spills for sorter in sorters),
+                'sort_seconds': sum(sorter.sort_seconds for sorter in sorters),
+            }, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+"""Data of tasks: pipes to and from task processes, input splits and
+compressed files. Used by runners, and by mappers which read their own input
+splits (see `read_input_split`)."""
+
+import bz2
+import errno
+import io
+import mmap
+import os
+# imported by os.wait4 on its first call, which fails in a thread while
+# another thread holds the import lock
+import resource
+import select
+from threading import Thread
+import zlib
+
+try:
+    from cStringIO import StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
+
+
+# data is moved from and to processes in chunks of this size
+PIPE_CHUNK_SIZE = 256 * 1024
+
+# compression codecs of input and output files: file extension of each codec,
+# and functions to create its (de)compressor. gzip level 6 is the default of
+# the gzip command, level 9 costs much more cpu for a few percent of size.
+COMPRESSION_CODECS = {
+    'gzip': ('.gz', lambda: zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+             lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    'bz2': ('.bz2', bz2.BZ2Compressor, bz2.BZ2Decompressor),
+}
+
+
+class TimeoutError(IOError): pass
+
+
+def wait_rusage(proc):
+    """wait for `proc` (a `subprocess.Popen`) to exit, like ``proc.wait()``,
+    and get its resource usage, which includes its waited children.
+    :return: a tuple of ``(returncode, rusage)``"""
+    while True:
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, rusage
+
+
+def _retry_eintr(fun, *args):
+    while True:
+        try:
+            return fun(*args)
+        except (IOError, OSError) as e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+def iter_chunks(inputs, chunk_size=PIPE_CHUNK_SIZE):
+    """join `inputs`, a sequence of bytes, into chunks of about `chunk_size`
+    bytes"""
+    chunk = []
+    size = 0
+    for data in inputs:
+        chunk.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def write_chunks(fd, inputs, chunk_size=PIPE_CHUNK_SIZE):
+    """write `inputs`, a sequence of bytes, to file descriptor `fd` in chunks
+    of about `chunk_size` bytes"""
+    for chunk in iter_chunks(inputs, chunk_size):
+        _write_all(fd, chunk)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[_retry_eintr(os.write, fd, view):]
+
+
+def read_lines(fd, chunk_size=PIPE_CHUNK_SIZE):
+    """read lines (with trailing newline) from file descriptor `fd` in chunks
+    of up to `chunk_size` bytes, until EOF"""
+    chunks = iter(lambda: _retry_eintr(os.read, fd, chunk_size), b'')
+    return _split_chunks(chunks)
+
+
+def _split_chunks(chunks):
+    """yield lines (with trailing newline) of a sequence of bytes"""
+    pending = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+
+        # complete the line left from the previous chunk
+        start = 0
+        if pending:
+            start = chunk.find(b'\n') + 1
+            if not start:
+                pending += chunk
+                continue
+            yield pending + chunk[:start]
+
+        end = chunk.rfind(b'\n') + 1
+        if end > start:
+            for line in BytesIO(chunk[start:end]):
+                yield line
+        pending = chunk[max(start, end):]
+
+    if pending:
+        yield pending
+
+
+def read_split_lines(path, offset, length, chunk_size=PIPE_CHUNK_SIZE):
+    """read lines (with trailing newline) of the byte range ``[offset, offset +
+    length)`` of file `path`, which starts at the beginning of a line. The
+    file is memory-mapped, and the range is cut into chunks of about
+    `chunk_size` bytes at newlines."""
+    end = offset + length
+    with open(path, 'rb') as f:
+        end = min(end, os.fstat(f.fileno()).st_size)
+        if offset >= end:
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        start = offset
+        while start < end:
+            stop = min(start + chunk_size, end)
+            if stop < end:
+                # cut after the last newline of the chunk, or after the first
+                # one following it if the chunk is part of a long line
+                newline = mapped.rfind(b'\n', start, stop)
+                if newline < 0:
+                    newline = mapped.find(b'\n', stop, end)
+                stop = end if newline < 0 else newline + 1
+            for line in BytesIO(mapped[start:stop]):
+                yield line
+            start = stop
+    finally:
+        mapped.close()
+
+
+def compression_codec(path):
+    """:return: name of the compression codec of file `path` by its extension,
+        or None if it's not compressed"""
+    for codec, (ext, _, _) in COMPRESSION_CODECS.items():
+        if path.endswith(ext):
+            return codec
+    return None
+
+
+def compress_chunks(chunks, codec):
+    """compress `chunks`, a sequence of bytes, with `codec`, and yield
+    compressed bytes"""
+    compressor = COMPRESSION_CODECS[codec][1]()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def read_compressed_lines(path, codec=None, chunk_size=PIPE_CHUNK_SIZE):
+    """read lines (with trailing newline) of compressed file `path`. The
+    codec is detected by extension of the file if it's not given. Files of
+    several concatenated streams (e.g. by ``cat a.gz b.gz``) are read as a
+    whole, like the gzip and bzip2 commands do."""
+    make_decompressor = COMPRESSION_CODECS[codec or compression_codec(path)][2]
+
+    def decompress(f):
+        decompressor = make_decompressor()
+        for data in iter(lambda: f.read(chunk_size), b''):
+            while data:
+                try:
+                    out = decompressor.decompress(data)
+                except EOFError:
+                    # a bz2 stream ended exactly at the end of the last chunk,
+                    # and its decompressor takes no more data
+                    if not data.strip(b'\x00'):
+                        return
+                    decompressor = make_decompressor()
+                    continue
+                yield out
+                # the rest is the beginning of the next stream
+                data = decompressor.unused_data
+                if data:
+                    if not data.strip(b'\x00'):
+                        # padding after the last stream
+                        return
+                    decompressor = make_decompressor()
+
+    with open(path, 'rb') as f:
+        for line in _split_chunks(decompress(f)):
+            yield line
+
+
+def read_input_split(path, offset=0, length=None):
+    """read lines (with trailing newline) of an input split: the byte range
+    ``[offset, offset + length)`` of file `path`, up to the end of the file by
+    default. Compressed files can't be split, and are read as a whole."""
+    if compression_codec(path):
+        return read_compressed_lines(path)
+    if length is None:
+        length = os.path.getsize(path) - offset
+    return read_split_lines(path, offset, length)
+
+
+def split_lines(path, split_size):
+    """split file `path` into byte ranges of about `split_size` bytes, each of
+    which starts at the beginning of a line. The file is memory-mapped to find
+    newlines.
+    :return: a list of ``(start, end)`` tuples"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= split_size:
+            return [(0, size)] if size else []
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        bounds = [0]
+        for offset in range(split_size, size, split_size):
+            if offset <= bounds[-1]:
+                continue
+            # move the boundary to the beginning of the next line
+            newline = mapped.find(b'\n', offset - 1)
+            if newline < 0 or newline + 1 >= size:
+                break
+            bounds.append(newline + 1)
+    finally:
+        mapped.close()
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def non_blocking_communicate(proc, inputs, read_records=None, wait=None, read_stderr=None,
+                             chunk_size=PIPE_CHUNK_SIZE):
+    """non blocking version of subprocess.Popen.communicate.
+    `inputs` should be a sequence of bytes (e.g. file-like object, generator,
+    io.BytesIO, etc.), which is written to the process by a thread, in chunks
+    of about `chunk_size` bytes.
+    Output is read in chunks too, and yielded line by line, unless
+    `read_records` is given, which is called with the (buffered) output
+    stream and should yield records read from it.
+    `read_stderr` is called in another thread with lines of stderr of the
+    process, if it's given (and stderr is a pipe).
+    `wait` is called with `proc` to wait for it to exit, ``Popen.wait`` by
+    default.
+
+    Nothing is buffered beyond a chunk in each direction: the process is
+    blocked while its output isn't consumed, and so is the thread writing to
+    it. An error raised by `inputs` is raised again after the process exits
+    (its input is closed early).
+    """
+    wait = wait or (lambda proc: proc.wait())
+    errors = []
+
+    def write_proc():
+        try:
+            write_chunks(proc.stdin.fileno(), inputs, chunk_size)
+        except (IOError, OSError) as e:
+            # stop at "Broken pipe" error, or "Invalid argument" error.
+            if e.errno not in (errno.EPIPE, errno.EINVAL):
+                errors.append(e)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    threads = [Thread(target=write_proc)]
+    if read_stderr is not None:
+        threads.append(Thread(target=read_stderr, args=(read_lines(proc.stderr.fileno(), chunk_size),)))
+    for t in threads:
+        t.start()
+
+    try:
+        if read_records is not None:
+            with io.open(proc.stdout.fileno(), 'rb', buffering=chunk_size, closefd=False) as stream:
+                for record in read_records(stream):
+                    yield record
+        else:
+            for line in read_lines(proc.stdout.fileno(), chunk_size):
+                yield line
+    finally:
+        # if output is not consumed up to the end, the process gets a broken
+        # pipe, instead of blocking forever
+        proc.stdout.close()
+        wait(proc)
+        for t in threads:
+            t.join()
+        if proc.stderr is not None:
+            proc.stderr.close()
+
+    if errors:
+        raise errors[0]
+
+
+def non_breaking_communicate(proc, input, timeout=None, multiple_output=False):
+    """Communicate multiple times with a process without breaking the pipe."""
+
+    if not isinstance(input, str):
+        raise ValueError('input should be a str')
+    if not input.endswith(b'\n'):
+        input += b'\n'
+
+    proc.stdin.write(input)
+    proc.stdin.flush()
+
+    if select.select([proc.stdout], [], [], timeout)[0]:
+        res = proc.stdout.readline()
+    else:
+        raise TimeoutError('process failed giving any response in {} seconds'.format(timeout))
+
+    # there might be multiple output lines
+    if multiple_output:
+        res = [res]
+        while select.select([proc.stdout], [], [], timeout)[0]:
+            out = proc.stdout.readline()
+            res.append(out)
+
+    return res
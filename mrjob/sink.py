@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+from util import SpaceSaving
+
+# flush output in blocks of this size by default
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+
+class OutputSink(object):
+    """Encode key-value pairs with `protocol` and write them to `stream` in
+    large blocks.
+
+    Encoded records are collected in a reusable buffer, which is written to
+    the stream (and flushed) only when it grows beyond `buffer_size` bytes, or
+    when `flush` is called. Set `buffer_size` to 0 to flush every record.
+
+    Records are terminated by `delimiter`, which should be empty for
+    protocols that frame records themselves (e.g. typed bytes).
+    """
+
+    def __init__(self, stream, protocol, buffer_size=DEFAULT_BUFFER_SIZE, delimiter=b'\n'):
+        self._stream = stream
+        self._encode = protocol.write
+        self._buffer_size = buffer_size
+        self._delimiter = delimiter
+        self._buffer = bytearray()
+
+        # number of records and bytes written
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, key, value):
+        self.records += 1
+        buf = self._buffer
+        buf += self._encode(key, value)
+        buf += self._delimiter
+        if len(buf) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.bytes += len(self._buffer)
+            self._stream.write(self._buffer)
+            del self._buffer[:]
+        self._stream.flush()
+
+
+# approximate memory overhead of a key in CombiningSink's buffer
+_KEY_OVERHEAD = 128
+
+
+class CombiningSink(object):
+    """Buffer key-value pairs by key, and apply `combiner` to them before
+    passing them on to `sink` (in-mapper combining).
+
+    The buffer is combined and emptied when it holds more than `max_keys`
+    keys or (roughly estimated) `max_bytes` bytes, and when `flush` is called.
+    Pairs with unhashable keys are passed on as they are.
+    """
+
+    def __init__(self, sink, combiner, max_keys, max_bytes):
+        self._sink = sink
+        self._combiner = combiner
+        self._max_keys = max_keys
+        self._max_bytes = max_bytes
+        self._buffer = {}
+        self._size = 0
+
+        # number of pairs written into and out of this sink
+        self.input_records = 0
+        self.output_records = 0
+
+    def write(self, key, value):
+        self.input_records += 1
+        try:
+            values = self._buffer.get(key)
+        except TypeError:
+            self.output_records += 1
+            self._sink.write(key, value)
+            return
+
+        if values is None:
+            values = self._buffer[key] = []
+            self._size += sys.getsizeof(key) + _KEY_OVERHEAD
+        values.append(value)
+        self._size += sys.getsizeof(value)
+
+        if len(self._buffer) >= self._max_keys or self._size >= self._max_bytes:
+            self.combine()
+
+    def combine(self):
+        """apply combiner to buffered pairs, and pass on its output"""
+        buf, self._buffer, self._size = self._buffer, {}, 0
+        write = self._sink.write
+        for key, values in buf.items():
+            for out_key, out_value in self._combiner(key, iter(values)) or ():
+                self.output_records += 1
+                write(out_key, out_value)
+
+    def flush(self):
+        self.combine()
+        self._sink.flush()
+
+
+class SaltingSink(object):
+    """Salt keys of mapper output which turn out to be hot (skewed), before
+    passing them on to `sink`, so that their records are spread over many
+    reducers instead of one.
+
+    Keys are counted by a `SpaceSaving` sketch of `sketch_size` keys. A key
+    becomes hot once it has been seen more than `min_records` times, and in
+    more than `hot_fraction` of the records so far. Each key is passed on as
+    ``(key, salt)`` (see `salt`), where `salt` is None for keys which are not hot (yet),
+    and takes turns from 0 to ``num_salts - 1`` for hot keys.
+    Unhashable keys are never salted.
+    """
+
+    def __init__(self, sink, num_salts, sketch_size, hot_fraction, min_records):
+        self._sink = sink
+        self._num_salts = num_salts
+        self._sketch = SpaceSaving(sketch_size)
+        self._hot_fraction = hot_fraction
+        self._min_records = min_records
+
+        # hot key: salt of its next record
+        self.hot_keys = {}
+
+        # number of pairs written, and how many of them are salted
+        self.records = 0
+        self.salted_records = 0
+
+    def salt(self, key):
+        """count `key`.
+        :return: the salted key, ``(key, salt)``"""
+        self.records += 1
+        hot_keys = self.hot_keys
+        try:
+            salt = hot_keys.get(key)
+        except TypeError:
+            return key, None
+
+        if salt is None:
+            count = self._sketch.add(key)
+            if count <= self._min_records or count <= self._hot_fraction * self.records:
+                return key, None
+            salt = 0
+
+        hot_keys[key] = (salt + 1) % self._num_salts
+        self.salted_records += 1
+        return key, salt
+
+    def write(self, key, value):
+        self._sink.write(self.salt(key), value)
+
+    def flush(self):
+        self._sink.flush()
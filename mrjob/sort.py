@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import logging
+from operator import itemgetter
+import os
+import shutil
+import string
+import struct
+import sys
+import tempfile
+import time
+
+try:
+    import cPickle
+except ImportError:
+    import pickle as cPickle
+
+
+# sort at most this many bytes in memory before spilling to disk (like
+# hadoop's `io.sort.mb`)
+DEFAULT_SORT_BUFFER_SIZE = 100 * 1024 * 1024
+
+# merge at most this many spill files at once (like hadoop's `io.sort.factor`)
+DEFAULT_MERGE_FACTOR = 100
+
+# approximate per-record memory overhead of a bytes object in a list
+_RECORD_OVERHEAD = 64
+
+logger = logging.getLogger('mrjob')
+
+
+def text_key(line):
+    """sort key of a streaming text line: everything before the first tab"""
+    return line.split(b'\t', 1)[0]
+
+
+# translation table that maps each byte to its complement
+_COMPLEMENT = string.maketrans(bytes(bytearray(range(256))), bytes(bytearray(range(255, -1, -1))))
+
+
+def reverse_order(data):
+    """map `data` to bytes that sort in the reverse order of `data`.
+    `data` must not contain null bytes (encoded sort keys never do)."""
+    return data.translate(_COMPLEMENT) + b'\xff'
+
+
+def key_fields_sort_key(num_fields, sort_fields):
+    """make a sort key of streaming text lines, whose first `num_fields`
+    tab-separated fields are the key, like hadoop's ``KeyFieldBasedComparator``.
+    `sort_fields` is a sequence of ``(index, reverse)`` tuples of the fields
+    to compare in turn.
+    """
+    def key(line):
+        fields = line.split(b'\t', num_fields)
+        return tuple(reverse_order(fields[i]) if reverse else fields[i]
+                     for i, reverse in sort_fields)
+    return key
+
+
+def key_fields_partition_key(partition_fields):
+    """make a partition key of streaming text lines: their first
+    `partition_fields` tab-separated fields, like hadoop's
+    ``KeyFieldBasedPartitioner``"""
+    def key(line):
+        return b'\t'.join(line.split(b'\t', partition_fields)[:partition_fields])
+    return key
+
+
+def merge_sorted(iterables, key=text_key):
+    """k-way merge already sorted iterables of records into one sorted stream.
+    Records with equal keys keep the order of `iterables`.
+    """
+    def decorate(records, i):
+        for record in records:
+            yield key(record), i, record
+
+    merged = heapq.merge(*[decorate(it, i) for i, it in enumerate(iterables)])
+    for _, _, record in merged:
+        yield record
+
+
+class ExternalSorter(object):
+    """Sort a stream of records with bounded memory.
+
+    Records are collected in memory until they take up more than
+    `buffer_size` bytes, then the buffer is sorted and spilled to a temporary
+    file as a sorted run. Iterating the sorter merges all runs into a single
+    sorted stream, and removes the temporary files once it is exhausted.
+
+    The sort is stable: records with equal keys keep their input order.
+    Records are newline-terminated lines, as read from a streaming task.
+    """
+
+    def __init__(self, key=text_key, buffer_size=DEFAULT_SORT_BUFFER_SIZE,
+                 tmp_dir=None, merge_factor=DEFAULT_MERGE_FACTOR):
+        self._key = key
+        self._buffer_size = buffer_size
+        self._tmp_dir = tmp_dir
+        self._merge_factor = max(merge_factor, 2)
+
+        self._records = []
+        self._size = 0
+        self._runs = []
+        self._run_count = 0
+        self._work_dir = None
+
+        # number of runs spilled to disk, number of records sorted, and time
+        # spent in sorting buffers, writing runs and merging them into fewer
+        # runs (excluding the final merge, which is streamed to the reader)
+        self.spills = 0
+        self.records = 0
+        self.sort_seconds = 0.0
+
+    def _sizeof(self, record):
+        return len(record) + _RECORD_OVERHEAD
+
+    def add(self, record):
+        self._records.append(record)
+        self._size += self._sizeof(record)
+        if self._size >= self._buffer_size:
+            self._spill()
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def flush(self):
+        """spill records buffered in memory to disk, so that the sorter holds
+        no memory until it is read"""
+        if self._records:
+            self._spill()
+
+    def _new_run_path(self):
+        if self._work_dir is None:
+            self._work_dir = tempfile.mkdtemp(prefix='mrjob-sort-', dir=self._tmp_dir)
+        self._run_count += 1
+        return os.path.join(self._work_dir, 'run-{:05d}'.format(self._run_count))
+
+    def _write_run(self, records, path=None):
+        if path is None:
+            path = self._new_run_path()
+        with open(path, 'wb') as f:
+            for record in records:
+                if not record.endswith(b'\n'):
+                    record += b'\n'
+                f.write(record)
+        return path
+
+    def dump(self, path):
+        """write all records, sorted, into a single run at `path`, which can
+        be read back with `read_run`, e.g. by another process"""
+        self._write_run(iter(self), path)
+
+    def read_run(self, path):
+        """read records of a run written by `dump`"""
+        return self._read_run(path)
+
+    def _read_run(self, path):
+        with open(path, 'rb') as f:
+            for record in f:
+                yield record
+
+    def _spill(self):
+        start = time.time()
+        self._records.sort(key=self._key)
+        self._runs.append(self._write_run(self._records))
+        logger.debug('spilled {} records ({} bytes) to disk'.format(len(self._records), self._size))
+        self.records += len(self._records)
+        self._records = []
+        self._size = 0
+        self.spills += 1
+        self.sort_seconds += time.time() - start
+
+    def _merge_runs(self):
+        """merge spilled runs, in several passes if there are too many of them"""
+        start = time.time()
+        runs = self._runs
+        while len(runs) > self._merge_factor:
+            batch, runs = runs[:self._merge_factor], runs[self._merge_factor:]
+            merged = self._write_run(merge_sorted(
+                [self._read_run(path) for path in batch], key=self._key))
+            for path in batch:
+                os.remove(path)
+            # keep the merged run in front so that the sort remains stable
+            runs = [merged] + runs
+        self._runs = runs
+        self.sort_seconds += time.time() - start
+        return merge_sorted([self._read_run(path) for path in runs], key=self._key)
+
+    def __iter__(self):
+        try:
+            if not self._runs:
+                start = time.time()
+                self._records.sort(key=self._key)
+                self.records += len(self._records)
+                self.sort_seconds += time.time() - start
+                records, self._records = self._records, []
+                for record in records:
+                    yield record
+            else:
+                if self._records:
+                    self._spill()
+                for record in self._merge_runs():
+                    yield record
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        """remove spilled runs"""
+        self._records = []
+        self._runs = []
+        if self._work_dir is not None:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+
+
+class ObjectSorter(ExternalSorter):
+    """Sort ``(key, value)`` pairs of python objects by key with bounded
+    memory. Spilled runs are pickled, so keys and values must be picklable.
+    """
+
+    def __init__(self, key=itemgetter(0), **kwargs):
+        super(ObjectSorter, self).__init__(key=key, **kwargs)
+
+    def _sizeof(self, record):
+        # a rough estimate, nested objects are not taken into account
+        return sys.getsizeof(record[0]) + sys.getsizeof(record[1]) + _RECORD_OVERHEAD
+
+    def _write_run(self, records, path=None):
+        if path is None:
+            path = self._new_run_path()
+        with open(path, 'wb') as f:
+            for record in records:
+                cPickle.dump(record, f, cPickle.HIGHEST_PROTOCOL)
+        return path
+
+    def _read_run(self, path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    yield cPickle.load(f)
+                except EOFError:
+                    break
+
+
+class PairSorter(ExternalSorter):
+    """Sort ``(raw_key, raw_value)`` pairs of bytes by raw key with bounded
+    memory, e.g. typed bytes records, which can't be split into lines.
+    """
+
+    _LENGTHS = struct.Struct('>ii')
+
+    def __init__(self, key=itemgetter(0), **kwargs):
+        super(PairSorter, self).__init__(key=key, **kwargs)
+
+    def _sizeof(self, record):
+        return len(record[0]) + len(record[1]) + _RECORD_OVERHEAD
+
+    def _write_run(self, records, path=None):
+        if path is None:
+            path = self._new_run_path()
+        pack = self._LENGTHS.pack
+        with open(path, 'wb') as f:
+            for key, value in records:
+                f.write(pack(len(key), len(value)))
+                f.write(key)
+                f.write(value)
+        return path
+
+    def _read_run(self, path):
+        unpack = self._LENGTHS.unpack
+        size = self._LENGTHS.size
+        with open(path, 'rb') as f:
+            while True:
+                head = f.read(size)
+                if not head:
+                    break
+                key_len, value_len = unpack(head)
+                yield f.read(key_len), f.read(value_len)
+
+
+def external_sort(records, key=text_key, **kwargs):
+    """sort `records` with an `ExternalSorter`, and return an iterator of
+    sorted records"""
+    sorter = ExternalSorter(key=key, **kwargs)
+    sorter.extend(records)
+    return iter(sorter)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+
+class MRStep(object):
+    """A step of a multi-step job, see ``MRJob.steps``.
+
+    Functions of the step are passed as keyword arguments, usually bound methods
+    of the job, e.g. ``MRStep(mapper=self.mapper_words, reducer=self.reducer_count)``.
+    A step should have at least one of mapper (or mapper_batch) and reducer.
+    """
+
+    FUN_NAMES = (
+        'mapper', 'mapper_batch', 'mapper_init', 'mapper_final',
+        'combiner', 'combiner_init', 'combiner_final',
+        'reducer', 'reducer_init', 'reducer_final',
+    )
+
+    def __init__(self, **kwargs):
+        for name in kwargs:
+            if name not in self.FUN_NAMES:
+                raise ValueError('unknown function of step: "{}"'.format(name))
+        self._funs = dict((name, fun) for name, fun in kwargs.items() if fun)
+
+    def get(self, fun_name):
+        """get function `fun_name` of this step, or None if it's not set"""
+        return self._funs.get(fun_name)
+
+    def __repr__(self):
+        return 'MRStep({})'.format(', '.join(sorted(self._funs)))
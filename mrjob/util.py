@@ -1,81 +1,104 @@
 # -*- coding: utf-8 -*-
 
 from collections import Iterable
-import errno
-import os
-import re
-import select
-from threading import Thread
+import heapq
+from operator import itemgetter
 
 
-class TimeoutError(IOError): pass
-
-
-def non_blocking_communicate(proc, inputs):
-    """non blocking version of subprocess.Popen.communicate.
-    `inputs` should be a sequence of bytes (e.g. file-like object, generator,
-    io.BytesIO, etc.).
+def flatten(lst):
+    """flatten irregular nested list.
+    see: https://stackoverflow.com/questions/2158395/flatten-an-irregular-list-of-lists
     """
+    for el in lst:
+        if isinstance(el, Iterable) and not isinstance(el, basestring):
+            for sub in flatten(el):
+                yield sub
+        else:
+            yield el
 
-    def write_proc(proc, inputs):
-        for line in inputs:
-            try:
-                proc.stdin.write(line)
-            except IOError as e:
-                # break at "Broken pipe" error, or "Invalid argument" error.
-                if e.errno == errno.EPIPE or e.errno == errno.EINVAL:
-                    break
-                else:
-                    raise
-        proc.stdin.close()
-
-    t = Thread(target=write_proc, args=(proc, inputs))
-    t.start()
 
-    while proc.poll() is None:
-        if select.select([proc.stdout], [], [])[0]:
-            line = proc.stdout.readline()
-            if not line:
-                break
-            yield line
+class LazyValues(object):
+    """Iterator of the values of a group of ``(raw_key, raw_value)`` pairs,
+    which decodes each value with `loads` only when it is consumed. Values are
+    passed as they are if `loads` is None.
 
-    proc.wait()
-    t.join()
+    Values that are never consumed are never decoded, e.g. use `count` to get
+    the number of (remaining) values without decoding them.
+    """
 
+    def __init__(self, raw_pairs, loads=None):
+        self._raw_pairs = raw_pairs
+        if loads is None:
+            self._values = (value for _, value in raw_pairs)
+        else:
+            self._values = (loads(raw_value) for _, raw_value in raw_pairs)
 
-def non_breaking_communicate(proc, input, timeout=None, multiple_output=False):
-    """Communicate multiple times with a process without breaking the pipe."""
+    def __iter__(self):
+        return self._values
 
-    if not isinstance(input, str):
-        raise ValueError('input should be a str')
-    if not input.endswith(b'\n'):
-        input += b'\n'
+    def next(self):
+        return next(self._values)
 
-    proc.stdin.write(input)
-    proc.stdin.flush()
+    __next__ = next
 
-    if select.select([proc.stdout], [], [], timeout)[0]:
-        res = proc.stdout.readline()
-    else:
-        raise TimeoutError('process failed giving any response in {} seconds'.format(timeout))
+    def count(self):
+        """consume the remaining values without decoding them, and return how
+        many there were"""
+        return sum(1 for _ in self._raw_pairs)
 
-    # there might be multiple output lines
-    if multiple_output:
-        res = [res]
-        while select.select([proc.stdout], [], [], timeout)[0]:
-            out = proc.stdout.readline()
-            res.append(out)
 
-    return res
+class SpaceSaving(object):
+    """Approximate counts of the most frequent keys of a stream, in bounded
+    memory (the space-saving algorithm, with evictions done in batches).
 
+    Up to ``2 * capacity`` keys are counted. When there are more, only the
+    `capacity` most frequent ones are kept, and keys seen later start counting
+    from the largest count evicted so far (the error of their counts). Any key
+    with more than ``1 / capacity`` of the stream is always counted.
+    """
 
-def flatten(lst):
-    """flatten irregular nested list.
-    see: https://stackoverflow.com/questions/2158395/flatten-an-irregular-list-of-lists
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError('capacity of SpaceSaving should be positive')
+        self.capacity = capacity
+        # key: [count, error]
+        self._counts = {}
+        self._floor = 0
+
+    def add(self, key):
+        """count `key` once.
+        :return: a lower bound of its count so far"""
+        entry = self._counts.get(key)
+        if entry is None:
+            if len(self._counts) >= 2 * self.capacity:
+                self._evict()
+            entry = self._counts[key] = [self._floor, self._floor]
+        entry[0] += 1
+        return entry[0] - entry[1]
+
+    def _evict(self):
+        # entries are compared by count first
+        top = heapq.nlargest(self.capacity + 1, self._counts.items(), key=itemgetter(1))
+        self._floor = max(self._floor, top[-1][1][0])
+        self._counts = dict(top[:-1])
+
+    def top(self, n=None):
+        """:return: a list of ``(key, count)`` of the `n` (all by default)
+            most frequent keys, with upper bounds of their counts"""
+        items = [(key, entry[0]) for key, entry in self._counts.items()]
+        items.sort(key=itemgetter(1), reverse=True)
+        return items if n is None else items[:n]
+
+
+def combine_key_value(key, value):
+    """combine a `(key, value)` pair yielded by reducer into one output value.
+
+    out_key or out_value might be None and should not be output when being None,
+    so we merge out_key into out_value and use TextValueProtocol, instead of
+    TextProtocol, as the output protocol.
     """
-    for el in lst:
-        if isinstance(el, Iterable) and not isinstance(el, basestring):
-            for sub in flatten(el):
-                yield sub
-        else:
-            yield el
+    if key is None and value is None:
+        raise ValueError('reducer should return `(key, value)` pairs, and at least one is not None.')
+    if key is None: return value
+    if value is None: return key
+    return flatten([key, value])
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the filesystems of mrjob.fs. `HadoopFilesystem` runs a fake
+``hadoop`` script, which logs its arguments and prints canned output. Run
+from the root of the repository:
+
+    python -m unittest discover -s test
+"""
+
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from mrjob.fs import FilesystemError, HadoopFilesystem, LocalFilesystem
+
+
+logging.getLogger('mrjob').setLevel(logging.CRITICAL)
+
+FAKE_HADOOP = '''#!/bin/sh
+echo "$@" >> "{log}"
+case "$2" in
+-lsr)
+    echo "drwxr-xr-x   - user group          0 2020-01-01 00:00 /out"
+    echo "-rw-r--r--   3 user group        100 2020-01-01 00:00 /out/part-00000"
+    echo "-rw-r--r--   3 user group          0 2020-01-01 00:00 /out/_SUCCESS"
+    ;;
+-du)
+    echo "Found 2 items"
+    echo "100  300  /out/part-00000"
+    echo "0  0  /out/_SUCCESS"
+    ;;
+-test)
+    exit 1
+    ;;
+-mv)
+    echo "mv: failed" >&2
+    exit 255
+    ;;
+esac
+'''
+
+
+class LocalFilesystemTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='mrjob-test-')
+        self.fs = LocalFilesystem(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, data):
+        local_path = os.path.join(self.root, path.lstrip('/'))
+        if not os.path.isdir(os.path.dirname(local_path)):
+            os.makedirs(os.path.dirname(local_path))
+        with open(local_path, 'wb') as f:
+            f.write(data)
+
+    def test_ls_and_du(self):
+        self.write('/out/part-00000', b'a' * 10)
+        self.write('/out/part-00001', b'b' * 20)
+        self.write('/out/logs/x', b'c')
+        self.assertEqual(sorted(self.fs.ls('/out')), ['/out/logs/x', '/out/part-00000', '/out/part-00001'])
+        self.assertEqual(self.fs.ls('hdfs://namenode:9000/out/part-00000'),
+                         ['hdfs://namenode:9000/out/part-00000'])
+        self.assertEqual(self.fs.du('/out'), {'/out/part-00000': 10, '/out/part-00001': 20, '/out/logs': 1})
+        self.assertEqual(self.fs.du('/out/part-00001'), {'/out/part-00001': 20})
+        self.assertRaises(FilesystemError, self.fs.ls, '/missing')
+        self.assertRaises(FilesystemError, self.fs.du, '/missing')
+
+    def test_rm_and_exists(self):
+        self.write('/a/b', b'')
+        self.write('/c', b'')
+        self.assertTrue(self.fs.exists('/a/b'))
+        self.fs.rm('/a', '/c', '/missing')
+        self.assertFalse(self.fs.exists('/a'))
+        self.assertFalse(self.fs.exists('/c'))
+
+    def test_mv(self):
+        self.write('/a', b'x')
+        self.write('/dir/y', b'')
+        self.fs.mv('/a', '/dir')
+        self.assertEqual(b''.join(self.fs.cat('/dir/a')), b'x')
+        self.fs.mv('/dir/a', '/b')
+        self.assertTrue(self.fs.exists('/b'))
+        self.assertRaises(FilesystemError, self.fs.mv, '/missing', '/c')
+
+    def test_put_and_concat(self):
+        local_path = os.path.join(self.root, 'local')
+        with open(local_path, 'wb') as f:
+            f.write(b'1\n')
+        self.fs.put(local_path, '/in/a')
+        self.write('/in/b', b'2\n')
+        self.fs.concat(['/in/a', '/in/b', '/in/a'], '/merged/out')
+        self.assertEqual(b''.join(self.fs.cat('/merged/out')), b'1\n2\n1\n')
+
+
+class HadoopFilesystemTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+        self.log = os.path.join(self.tmp_dir, 'log')
+        hadoop = os.path.join(self.tmp_dir, 'hadoop')
+        with open(hadoop, 'w') as f:
+            f.write(FAKE_HADOOP.format(log=self.log))
+        os.chmod(hadoop, stat.S_IRWXU)
+        self.fs = HadoopFilesystem(hadoop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def commands(self):
+        with open(self.log) as f:
+            return [line.split() for line in f]
+
+    def test_ls_skips_directories(self):
+        self.assertEqual(self.fs.ls('/out'), ['/out/part-00000', '/out/_SUCCESS'])
+
+    def test_du(self):
+        self.assertEqual(self.fs.du('/out'), {'/out/part-00000': 100, '/out/_SUCCESS': 0})
+
+    def test_exists(self):
+        self.assertFalse(self.fs.exists('/out'))
+
+    def test_rm_in_one_command(self):
+        self.fs.rm('/a', '/b', '/c')
+        self.fs.rm()
+        self.assertEqual(self.commands(), [['fs', '-rmr', '/a', '/b', '/c']])
+
+    def test_failed_command(self):
+        self.assertRaises(FilesystemError, self.fs.mv, '/a', '/b')
+
+
+if __name__ == '__main__':
+    unittest.main()
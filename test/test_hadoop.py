@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of HadoopRunner, which check the generated commands and the bundle
+of mrjob, so that no hadoop is needed. Run from the root of the repository:
+
+    python -m unittest discover -s test
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mrjob import MRJob
+from mrjob.fs import LocalFilesystem
+from mrjob.runner import hadoop
+from mrjob.runner.hadoop import HadoopError, HadoopRunner, bundle, plan_merge
+from mrjob.step import MRStep
+
+
+logging.getLogger('mrjob').setLevel(logging.WARNING)
+
+
+class WordCount(MRJob):
+
+    def mapper(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def reducer(self, word, counts):
+        yield word, sum(counts)
+
+
+def make_runner(**kwargs):
+    options = dict(hadoop='/bin/true', input='/in', output='/out')
+    options.update(kwargs)
+    return HadoopRunner(WordCount(), **options)
+
+
+class PlanMergeTestCase(unittest.TestCase):
+
+    def test_few_files_are_not_merged(self):
+        self.assertEqual(plan_merge({'b': 1, 'a': 2}, 2), [['a'], ['b']])
+        self.assertEqual(plan_merge({'a': 1}, 4), [['a']])
+
+    def test_files_of_equal_size(self):
+        sizes = dict(('part-{:05d}'.format(i), 100) for i in range(10))
+        bins = plan_merge(sizes, 2)
+        self.assertEqual(bins, [sorted(sizes)[:5], sorted(sizes)[5:]])
+
+    def test_large_file_stays_alone(self):
+        sizes = {'a': 10, 'b': 10, 'c': 1000, 'd': 10, 'e': 10}
+        self.assertEqual(plan_merge(sizes, 2), [['a', 'b'], ['c'], ['d', 'e']])
+
+    def test_bins_keep_the_order_of_names(self):
+        sizes = dict(('part-{:05d}'.format(i), (i * 37) % 101) for i in range(50))
+        for num_files in (1, 3, 7, 20):
+            bins = plan_merge(sizes, num_files)
+            self.assertEqual(sum(bins, []), sorted(sizes))
+            target = sum(sizes.values()) / float(num_files)
+            for b in bins:
+                # only a single file may make a bin larger than 1.5 times the target
+                if len(b) > 1:
+                    self.assertTrue(sum(sizes[path] for path in b) <= target * 1.5)
+
+    def test_empty_files(self):
+        sizes = dict(('part-{:05d}'.format(i), 0) for i in range(4))
+        self.assertEqual(plan_merge(sizes, 2), [sorted(sizes)])
+
+
+class MergeCmdTestCase(unittest.TestCase):
+
+    def test_map_only_merge_keeps_lines(self):
+        cmd = make_runner(merge_output=4)._merge_cmd('/out-tmp', '/out-tmp-merge', 4000)
+        jobconf = [cmd[i + 1] for i, arg in enumerate(cmd) if arg == '-jobconf']
+
+        self.assertIn('mapred.reduce.tasks=0', jobconf)
+        # CombineTextInputFormat passes byte offsets as keys to the mapper
+        self.assertIn('stream.map.input.ignoreKey=true', jobconf)
+        self.assertIn('mapred.max.split.size=1001', jobconf)
+        self.assertEqual(cmd[cmd.index('-inputformat') + 1], HadoopRunner.MERGE_INPUT_FORMAT)
+        self.assertEqual(cmd[cmd.index('-mapper') + 1], 'cat')
+        self.assertEqual(cmd[cmd.index('-input') + 1], '/out-tmp')
+        self.assertEqual(cmd[cmd.index('-output') + 1], '/out-tmp-merge')
+
+
+class MergeOutputTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def merge(self, num_files, **kwargs):
+        """merge `num_files` output files into 2 files (or 1 file of each bin
+        of 2 files with MERGE_CONCAT_MAX_FILES).
+        :return: the result of `_merge_output`, and names of files left"""
+        out_dir = os.path.join(self.root, 'out')
+        os.makedirs(out_dir)
+        for i in range(num_files):
+            with open(os.path.join(out_dir, 'part-{:05d}'.format(i)), 'wb') as f:
+                f.write(b'x' * 10)
+        # the merge job fails, so files are left unmerged if it is chosen
+        runner = make_runner(hadoop='/bin/false', merge_output=num_files // 2,
+                             fs=LocalFilesystem(self.root), **kwargs)
+        return runner._merge_output('/out'), sorted(os.listdir(out_dir))
+
+    def test_concat(self):
+        self.assertEqual(self.merge(4), (True, ['part-00000-merged', 'part-00002-merged']))
+
+    def test_concat_compressed_files(self):
+        for codec in ('gzip', 'bz2'):
+            self.assertTrue(self.merge(4, output_compression=codec)[0])
+            shutil.rmtree(os.path.join(self.root, 'out'))
+
+    def test_merge_job_of_many_files(self):
+        num_files = (HadoopRunner.MERGE_CONCAT_MAX_FILES + 1) * 2
+        result, names = self.merge(num_files)
+        self.assertFalse(result)
+        self.assertEqual(len(names), num_files)
+
+    def test_merge_job_of_codecs_which_cannot_be_concatenated(self):
+        for codec in ('default', 'snappy'):
+            self.assertEqual(self.merge(4, output_compression=codec), (False, [
+                'part-00000', 'part-00001', 'part-00002', 'part-00003']))
+            shutil.rmtree(os.path.join(self.root, 'out'))
+        # compression set by jobconf
+        self.assertFalse(self.merge(4, jobconf={'mapred.output.compress': 'true'})[0])
+
+
+class TwoStepWordCount(WordCount):
+
+    def steps(self):
+        return [MRStep(mapper=self.mapper, reducer=self.reducer), MRStep(reducer=self.reducer)]
+
+
+class RecordingFilesystem(LocalFilesystem):
+    """a local filesystem which records the paths of each `rm`"""
+
+    def __init__(self, root):
+        super(RecordingFilesystem, self).__init__(root)
+        self.removed = []
+
+    def rm(self, *paths):
+        self.removed.append(list(paths))
+        super(RecordingFilesystem, self).rm(*paths)
+
+
+class ExecuteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='mrjob-test-')
+        # the bundle of mrjob is not needed
+        self.bundle = hadoop.bundle
+        hadoop.bundle = lambda *args: os.path.join(self.root, 'mrjob.zip')
+
+    def tearDown(self):
+        hadoop.bundle = self.bundle
+        shutil.rmtree(self.root)
+
+    def execute(self, hadoop_bin=None):
+        if hadoop_bin is None:
+            # a hadoop which only makes the output directory of each step
+            hadoop_bin = os.path.join(self.root, 'hadoop')
+            with open(hadoop_bin, 'w') as f:
+                f.write('#!/bin/sh\nwhile [ $# -gt 0 ]; do\n'
+                        '    [ "$1" = -output ] && mkdir -p "{}$2"\n    shift\ndone\n'.format(self.root))
+            os.chmod(hadoop_bin, 0o755)
+        fs = RecordingFilesystem(self.root)
+        os.makedirs(os.path.join(self.root, 'out'))
+        runner = HadoopRunner(TwoStepWordCount(), hadoop=hadoop_bin, input='/in', output='/out', fs=fs)
+        runner.execute()
+        return fs.removed
+
+    def test_paths_are_removed_in_batches(self):
+        removed = self.execute()
+        self.assertEqual(removed, [['/__tmp_mrjob/out-step-0', '/__tmp_mrjob/out'],
+                                   ['/__tmp_mrjob/out-step-0', '/out']])
+        self.assertEqual(os.listdir(os.path.join(self.root, '__tmp_mrjob')), [])
+        self.assertTrue(os.path.isdir(os.path.join(self.root, 'out')))
+
+    def test_output_is_kept_if_the_job_fails(self):
+        self.assertRaises(HadoopError, self.execute, '/bin/false')
+        self.assertTrue(os.path.isdir(os.path.join(self.root, 'out')))
+
+
+class BundleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_script(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_bundles_of_other_scripts_are_kept(self):
+        a = bundle(self.make_script('a.py', '# a'))
+        b = bundle(self.make_script('b.py', '# b'))
+        try:
+            self.assertNotEqual(a, b)
+            self.assertTrue(os.path.isfile(a))
+            self.assertTrue(os.path.isfile(b))
+            self.assertEqual(bundle(os.path.join(self.tmp_dir, 'a.py')), a)
+        finally:
+            os.remove(a)
+            os.remove(b)
+
+    def test_prune_least_recently_used(self):
+        now = time.time()
+        paths = []
+        for i in range(5):
+            path = self.make_script('mrjob-{:012d}.zip'.format(i), '')
+            # the last two were used recently
+            mtime = now - (5 - i) * 3600 * 24 * 10 if i < 3 else now
+            os.utime(path, (mtime, mtime))
+            paths.append(path)
+
+        cache_size = hadoop.BUNDLE_CACHE_SIZE
+        hadoop.BUNDLE_CACHE_SIZE = 1
+        try:
+            hadoop._prune_bundles(self.tmp_dir, keep=paths[0])
+        finally:
+            hadoop.BUNDLE_CACHE_SIZE = cache_size
+
+        self.assertEqual([os.path.isfile(path) for path in paths], [True, False, False, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of MRJob. Run from the root of the repository:
+
+    python -m unittest discover -s test
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    from cStringIO import StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
+
+from mrjob import MRJob
+from mrjob.job import TASK_DEFAULTS, _parse_task_args
+from mrjob.protocol import BinaryPickleProtocol
+from mrjob.runner.inline import InlineRunner
+from mrjob.step import MRStep
+
+
+logging.getLogger('mrjob').setLevel(logging.WARNING)
+
+
+def run_task(job, name, data):
+    """run mapper/combiner/reducer of `job` in-process over input `data`.
+    :return: its output"""
+    job._stdin = BytesIO(data)
+    job._stdout = BytesIO()
+    getattr(job, '_run_' + name)()
+    return job._stdout.getvalue()
+
+
+class WordCount(MRJob):
+
+    def mapper(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def combiner(self, word, counts):
+        yield word, sum(counts)
+
+    def reducer(self, word, counts):
+        yield word, sum(counts)
+
+
+class MostUsedWord(MRJob):
+
+    def mapper_words(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def combiner_count(self, word, counts):
+        yield word, sum(counts)
+
+    def reducer_count(self, word, counts):
+        yield None, (sum(counts), word)
+
+    def reducer_max(self, _, count_words):
+        yield max(count_words)
+
+    def steps(self):
+        return [MRStep(mapper=self.mapper_words, combiner=self.combiner_count, reducer=self.reducer_count),
+                MRStep(reducer=self.reducer_max)]
+
+
+class ParseTaskArgsTestCase(unittest.TestCase):
+
+    def parse_args(self, args):
+        """parse `args` with argparse, like `MRJob.run` without the shortcut"""
+        argv = sys.argv
+        sys.argv = ['job.py'] + args
+        try:
+            options, unrecognized = MRJob()._parse_args()
+        finally:
+            sys.argv = argv
+        self.assertEqual(unrecognized, [])
+        self.assertEqual(options.pop('runner'), None)
+        return options
+
+    def assertSameAsArgparse(self, args):
+        options = _parse_task_args(args)
+        self.assertNotEqual(options, None, args)
+        self.assertEqual(options, self.parse_args(args), args)
+
+    def test_same_as_argparse(self):
+        for args in [
+            ['--mapper'],
+            ['--combiner'],
+            ['--reducer'],
+            ['--reducer', '--step-num', '2'],
+            ['--reducer', '--step-num=2'],
+            ['--mapper', '--io', 'typedbytes'],
+            ['--io=typedbytes', '--combiner'],
+            ['--mapper', '--profile', '--profile-dir', '/tmp/out.profile'],
+            ['--mapper', '--split-path', '/tmp/a b.txt', '--split-offset', '100', '--split-length', '50'],
+            ['--mapper', '--split-path=/tmp/a.gz'],
+            ['--mapper', '--step-num', '1', '--step-num', '3'],
+            ['--step-num', '-1', '--mapper'],
+        ]:
+            self.assertSameAsArgparse(args)
+
+    def test_defaults(self):
+        self.assertEqual(_parse_task_args(['--mapper']), dict(TASK_DEFAULTS, run_mapper=True))
+
+    def test_left_to_argparse(self):
+        for args in [
+            [],
+            ['-r', 'local'],
+            ['--mapper', '-r', 'inline'],
+            ['--mapper', '-input', 'a.txt'],
+            ['--mapper', '--io', 'json'],
+            ['--mapper', '--step-num', 'x'],
+            ['--mapper', '--step-num'],
+            ['--mapper=1'],
+            ['--profile'],
+        ]:
+            self.assertEqual(_parse_task_args(args), None, args)
+
+    def test_tasks_import_no_runners_or_profilers(self):
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = 'import sys, mrjob; print(" ".join(sorted(sys.modules)))'
+        modules = subprocess.check_output([sys.executable, '-c', code],
+                                          env=dict(os.environ, PYTHONPATH=root_dir)).split()
+        self.assertIn(b'mrjob.job', modules)
+        for name in (b'mrjob.runner', b'mrjob.runner.taskio', b'mrjob.profiling', b'cProfile', b'pstats',
+                     b'argparse', b'subprocess'):
+            self.assertNotIn(name, modules)
+
+
+class MultiStepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_steps_are_chained(self):
+        input_path = os.path.join(self.tmp_dir, 'input')
+        with open(input_path, 'w') as f:
+            f.write('a b c\nb c\nc\n')
+        output_path = os.path.join(self.tmp_dir, 'output')
+        job = MostUsedWord()
+        InlineRunner(job, cmd_args=[], input=input_path, output=output_path).execute()
+
+        self.assertEqual(job._num_steps(), 2)
+        with open(output_path) as f:
+            self.assertEqual(f.read(), '3\tc\n')
+
+    def test_invalid_steps(self):
+        self.assertRaises(ValueError, MRStep, mapper=len, reduce=len)
+
+        job = MRJob()
+        job.steps = lambda: [MRStep(mapper=len), MRStep(combiner=len)]
+        self.assertRaises(ValueError, job._num_steps)
+
+        job = MRJob()
+        job.steps = lambda: [MRStep(mapper=len), MRStep(mapper_batch=len)]
+        self.assertRaises(ValueError, job._num_steps)
+
+        job = MRJob()
+        job.steps = lambda: []
+        self.assertRaises(ValueError, job._num_steps)
+
+
+class CombiningWordCount(WordCount):
+
+    MAPPER_COMBINE = True
+    MAPPER_COMBINE_MAX_KEYS = 3
+
+
+class MapperCombineTestCase(unittest.TestCase):
+
+    def run_job(self, job_class, data):
+        mapped = run_task(job_class(), 'mapper', data)
+        # the shuffle: a stable sort by key
+        lines = sorted(mapped.splitlines(True), key=lambda line: line.split(b'\t', 1)[0])
+        return mapped, run_task(job_class(), 'reducer', b''.join(lines))
+
+    def test_same_output_as_without_combining(self):
+        data = b'a b a b a b c\n' * 20
+        mapped, output = self.run_job(WordCount, data)
+        combined, combined_output = self.run_job(CombiningWordCount, data)
+        self.assertEqual(combined_output, output)
+        self.assertEqual(output, b'a\t60\nb\t60\nc\t20\n')
+        self.assertTrue(len(combined.splitlines()) < len(mapped.splitlines()) // 2)
+
+
+class LineLengths(MRJob):
+    """output the length of each input line, in batches of 3 lines"""
+
+    MAPPER_BATCH_SIZE = 3
+
+    def mapper_batch(self, lines):
+        self.batches.append(lines)
+        return lines, [len(line) for line in lines]
+
+
+class LineLengthsGenerator(LineLengths):
+
+    def mapper_batch(self, lines):
+        self.batches.append(lines)
+        for line in lines:
+            yield line, len(line)
+
+
+class LineLengthsNone(LineLengths):
+
+    def mapper_batch(self, lines):
+        self.batches.append(lines)
+
+
+class MapBatchesTestCase(unittest.TestCase):
+
+    LINES = [b'a\n', b'bb\n', b'ccc\r\n', b'\n', b'eeeee\n', b'f\n', b'gg']
+
+    def map_batches(self, job_class):
+        job = job_class()
+        job.batches = []
+        out = list(job._map_batches(iter(self.LINES)))
+        # the last batch is shorter
+        self.assertEqual([len(batch) for batch in job.batches], [3, 3, 1])
+        return job, out
+
+    def test_tuple_of_keys_and_values(self):
+        _, out = self.map_batches(LineLengths)
+        self.assertEqual(out, [(b'a', 1), (b'bb', 2), (b'ccc', 3), (b'', 0), (b'eeeee', 5), (b'f', 1), (b'gg', 2)])
+
+    def test_generator(self):
+        _, out = self.map_batches(LineLengthsGenerator)
+        self.assertEqual(out, [(b'a', 1), (b'bb', 2), (b'ccc', 3), (b'', 0), (b'eeeee', 5), (b'f', 1), (b'gg', 2)])
+
+    def test_none(self):
+        _, out = self.map_batches(LineLengthsNone)
+        self.assertEqual(out, [])
+
+    def test_input_counters(self):
+        job, _ = self.map_batches(LineLengthsNone)
+        self.assertEqual(job._counters[('mrjob', 'mapper_input_records')], 7)
+        # each line is counted with a single newline
+        self.assertEqual(job._counters[('mrjob', 'mapper_input_bytes')], 21)
+
+
+class CountingProtocol(BinaryPickleProtocol):
+    """records the values it decodes"""
+
+    def __init__(self):
+        super(CountingProtocol, self).__init__()
+        self.decoded = []
+
+    def _loads(self, value):
+        value = super(CountingProtocol, self)._loads(value)
+        self.decoded.append(value)
+        return value
+
+
+class FirstValue(MRJob):
+
+    def reducer(self, key, values):
+        yield key, next(values)
+
+
+class CountValues(MRJob):
+
+    def reducer(self, key, values):
+        yield key, values.count()
+
+
+class SecondarySort(MRJob):
+
+    KEY_FIELDS = 2
+
+    def reducer(self, key, values):
+        self.groups.append((key, list(values)))
+
+
+class ReadGroupsTestCase(unittest.TestCase):
+
+    PAIRS = [(u'a', 1), (u'a', 2), (u'a', 3), (u'b', 4), (u'b', 5), (u'c', 6)]
+
+    def run_reducer(self, job_class):
+        job = job_class()
+        protocol = job.internal_protocol = CountingProtocol()
+        output = run_task(job, 'reducer', b''.join(protocol.write(k, v) + b'\n' for k, v in self.PAIRS))
+        # keys are decoded too
+        return output, [value for value in protocol.decoded if isinstance(value, int)]
+
+    def test_values_are_decoded_when_consumed(self):
+        # groups which are consumed partially still move on to the next key
+        output, decoded = self.run_reducer(FirstValue)
+        self.assertEqual(output, b'a\t1\nb\t4\nc\t6\n')
+        self.assertEqual(decoded, [1, 4, 6])
+
+    def test_count(self):
+        output, decoded = self.run_reducer(CountValues)
+        self.assertEqual(output, b'a\t3\nb\t2\nc\t1\n')
+        self.assertEqual(decoded, [])
+
+    def test_group_fields(self):
+        job = SecondarySort()
+        job.groups = []
+        protocol = job.internal_protocol
+        keys = [(u'a', 1), (u'a', u'x'), (u'a\t', 1), (u'b', 1), (u'b', 2)]
+        data = sorted(protocol.write(key, i) + b'\n' for i, key in enumerate(keys))
+        run_task(job, 'reducer', b''.join(data))
+        # grouped by the first field of raw keys, which may contain tabs
+        # before they are encoded
+        self.assertEqual(job.groups, [((u'a',), [0, 1]), ((u'a\t',), [2]), ((u'b',), [3, 4])])
+
+
+class CountingJob(MRJob):
+
+    COUNTER_FLUSH_INTERVAL = 3600
+
+    def mapper(self, _, line):
+        self.increment_counter('lines', 'total')
+        self.increment_counter('lines', 'bytes,chars', len(line))
+        yield line, 1
+
+
+class CountersTestCase(unittest.TestCase):
+
+    def test_reporter_lines(self):
+        job = CountingJob()
+        job._stderr = BytesIO()
+        job.increment_counter('g', 'c', 2)
+        job.increment_counter('g', 'c')
+        job.increment_counter(u'g,h', 'b')
+        job.set_status('half\ndone')
+        self.assertEqual(job._stderr.getvalue(), b'')
+
+        job._flush_counters()
+        expected = b'reporter:counter:g,c,3\nreporter:counter:g;h,b,1\nreporter:status:half done\n'
+        self.assertEqual(job._stderr.getvalue(), expected)
+        # counters are reset after each flush
+        job._flush_counters()
+        self.assertEqual(job._stderr.getvalue(), expected)
+
+    def test_flush_interval(self):
+        job = CountingJob()
+        job.COUNTER_FLUSH_INTERVAL = 0.2
+        job._next_counter_flush = time.time() + job.COUNTER_FLUSH_INTERVAL
+        job._stderr = BytesIO()
+        job.increment_counter('g', 'c')
+        self.assertEqual(job._stderr.getvalue(), b'')
+        time.sleep(0.3)
+        job.increment_counter('g', 'c')
+        self.assertEqual(job._stderr.getvalue(), b'reporter:counter:g,c,2\n')
+        job.increment_counter('g', 'c')
+        self.assertEqual(job._stderr.getvalue(), b'reporter:counter:g,c,2\n')
+
+    def test_final_flush_at_task_end(self):
+        job = CountingJob()
+        job._stdin = BytesIO(b'ab\ncd e\n')
+        job._stdout = BytesIO()
+        job._stderr = BytesIO()
+        job._run_task('mapper')
+        lines = job._stderr.getvalue().splitlines()
+        self.assertIn(b'reporter:counter:lines,total,2', lines)
+        self.assertIn(b'reporter:counter:lines,bytes;chars,6', lines)
+        self.assertIn(b'reporter:counter:mrjob,mapper_input_records,2', lines)
+        self.assertIn(b'reporter:counter:mrjob,mapper_output_records,2', lines)
+
+    def test_invalid_counters(self):
+        job = CountingJob()
+        self.assertRaises(ValueError, job.increment_counter, 'g', 1)
+        self.assertRaises(ValueError, job.increment_counter, 'g', 'c', 1.5)
+        self.assertRaises(ValueError, job.set_status, None)
+
+
+class SkewedWordCount(WordCount):
+
+    SALT_HOT_KEYS = True
+    HOT_KEY_SALTS = 4
+    HOT_KEY_FRACTION = 0.1
+    HOT_KEY_MIN_RECORDS = 10
+
+
+class MapperOnly(MRJob):
+
+    SALT_HOT_KEYS = True
+
+    def mapper(self, _, line):
+        yield line, 1
+
+
+class ReducerOnly(MRJob):
+
+    SALT_HOT_KEYS = True
+
+    def reducer(self, key, values):
+        yield key, sum(values)
+
+
+class SaltHotKeysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_job(self, job):
+        input_path = os.path.join(self.tmp_dir, 'input')
+        with open(input_path, 'w') as f:
+            for i in range(500):
+                f.write('hot w{} hot\n'.format(i % 30))
+        output_path = os.path.join(self.tmp_dir, 'output')
+        runner = InlineRunner(job, cmd_args=[], input=input_path, output=output_path)
+        runner.execute()
+        with open(output_path) as f:
+            return runner, sorted(f)
+
+    def test_same_output_as_without_salting(self):
+        job = SkewedWordCount()
+        self.assertEqual(job._num_steps(), 2)
+        self.assertEqual(job._salted_steps, set([0]))
+
+        runner, output = self.run_job(job)
+        _, unsalted_output = self.run_job(WordCount())
+        self.assertEqual(output, unsalted_output)
+        self.assertIn('hot\t1000\n', output)
+
+        counters = runner.counters()[None]['mrjob']
+        self.assertEqual(counters['hot_keys'], 1)
+        self.assertTrue(counters['salted_records'] > 900, counters)
+
+    def test_unsupported_jobs(self):
+        for job_class in [
+            type('KeyFields', (SkewedWordCount,), {'KEY_FIELDS': 2}),
+            type('NoSalts', (SkewedWordCount,), {'HOT_KEY_SALTS': 0}),
+            type('ReducerFinal', (SkewedWordCount,), {'reducer_final': lambda self: ()}),
+            ReducerOnly,
+            MapperOnly,
+        ]:
+            self.assertRaises(ValueError, job_class()._num_steps)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of LocalRunner. Mapper and reducer are given as shell commands, so
+that no job script is needed. Run from the root of the repository:
+
+    python -m unittest discover -s test
+"""
+
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from functools import cmp_to_key
+from threading import Lock
+
+from mrjob import MRJob
+from mrjob.runner import hadoop
+from mrjob.runner.hadoop import HadoopRunner, KEY_FIELD_COMPARATOR, KEY_FIELD_PARTITIONER
+from mrjob.runner.local import LocalRunner
+
+
+logging.getLogger('mrjob').setLevel(logging.WARNING)
+
+
+class WordCount(MRJob):
+
+    def mapper(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def reducer(self, word, counts):
+        yield word, sum(counts)
+
+
+class SortMemoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_inputs(self, num_files):
+        lines = []
+        for i in range(num_files):
+            path = os.path.join(self.tmp_dir, 'input-{:03d}.txt'.format(i))
+            with open(path, 'w') as f:
+                for j in range(10):
+                    line = 'key{:03d}\t{}\n'.format((i * 7 + j) % 50, i)
+                    f.write(line)
+                    lines.append(line)
+        return lines
+
+    def run_job(self, num_files, **kwargs):
+        lines = self.write_inputs(num_files)
+        output = os.path.join(self.tmp_dir, 'output')
+        runner = LocalRunner(WordCount(), cmd_args=[], input=os.path.join(self.tmp_dir, 'input-*'),
+                             output=output, mapper='cat', reducer='cat', **kwargs)
+        runner.execute()
+        with open(output) as f:
+            result = f.readlines()
+        # sorted by key only, values of a key come in any order
+        self.assertEqual([line.split('\t')[0] for line in result],
+                         sorted(line.split('\t')[0] for line in lines))
+        self.assertEqual(sorted(result), sorted(lines))
+        return runner.report()['steps'][0]['sort']['reducer']
+
+    def test_many_input_files(self):
+        # one map task for each file, more than can run at once. each is
+        # sorted by a process of its own into a run on disk, so that nothing
+        # is kept in memory until the reduce phase
+        sort = self.run_job(20, sort_buffer_size=1024, num_mappers=2, num_reducers=1)
+        self.assertEqual(sort['processes'], 20)
+        self.assertEqual(sort['sorters'], 20)
+        self.assertEqual(sort['spills'], 0)
+
+    def test_large_map_output_spills(self):
+        path = os.path.join(self.tmp_dir, 'input-000.txt')
+        with open(path, 'w') as f:
+            for i in range(40000):
+                f.write('key{:05d}\t{}\n'.format(i * 7919 % 40000, 'x' * 40))
+        output = os.path.join(self.tmp_dir, 'output')
+        runner = LocalRunner(WordCount(), cmd_args=[], input=path, output=output, mapper='cat', reducer='cat',
+                             sort_buffer_size=1024, num_reducers=2)
+        runner.execute()
+        # each sorter gets at least 1MB, and spills the rest
+        sort = runner.report()['steps'][0]['sort']['reducer']
+        self.assertEqual(sort['sorters'], 2)
+        self.assertTrue(sort['spills'] >= 2, sort)
+        keys = []
+        for name in sorted(os.listdir(output)):
+            with open(os.path.join(output, name)) as f:
+                part = [line.split('\t')[0] for line in f]
+            self.assertEqual(part, sorted(part))
+            keys.extend(part)
+        self.assertEqual(sorted(keys), ['key{:05d}'.format(i) for i in range(40000)])
+
+    def test_few_input_files_are_sorted_in_memory(self):
+        sort = self.run_job(2, sort_buffer_size=1024 * 1024, num_mappers=2, num_reducers=1)
+        self.assertEqual(sort['sorters'], 2)
+        self.assertEqual(sort['spills'], 0)
+
+
+class SecondarySort(MRJob):
+
+    KEY_FIELDS = 3
+    PARTITION_FIELDS = 2
+    SORT_FIELDS = [1, 0, (2, True)]
+
+    def reducer(self, key, values):
+        yield key, list(values)
+
+
+class KeyFieldsTestCase(unittest.TestCase):
+    """LocalRunner partitions and sorts like hadoop does with the jobconf
+    generated by HadoopRunner"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def hadoop_key_fields(self):
+        """parse the key field settings of the hadoop streaming command"""
+        runner = HadoopRunner(SecondarySort(), hadoop='/bin/true', input='/in', output='/out')
+        # the bundle of mrjob is not needed
+        bundle = hadoop.bundle
+        hadoop.bundle = lambda *args: os.path.join(self.tmp_dir, 'mrjob.zip')
+        try:
+            cmd = runner._generate_cmd()
+        finally:
+            hadoop.bundle = bundle
+        jobconf = dict(cmd[i + 1].split('=', 1) for i, arg in enumerate(cmd) if arg == '-jobconf')
+        self.assertEqual(cmd[cmd.index('-partitioner') + 1], KEY_FIELD_PARTITIONER)
+        self.assertEqual(jobconf['mapred.output.key.comparator.class'], KEY_FIELD_COMPARATOR)
+
+        num_fields = int(jobconf['stream.num.map.output.key.fields'])
+        partition_fields = int(re.match(r'^-k1,(\d+)$', jobconf['mapred.text.key.partitioner.options']).group(1))
+        sort_fields = [(int(i) - 1, bool(r)) for i, j, r in
+                       re.findall(r'-k(\d+),(\d+)(r?)', jobconf['mapred.text.key.comparator.options'])]
+        return num_fields, partition_fields, sort_fields
+
+    def test_same_as_hadoop(self):
+        num_fields, partition_fields, sort_fields = self.hadoop_key_fields()
+        self.assertEqual((num_fields, partition_fields), (3, 2))
+
+        def compare(a, b):
+            # like KeyFieldBasedComparator, on raw bytes of the fields
+            a, b = a.split('\t', num_fields), b.split('\t', num_fields)
+            for i, reverse in sort_fields:
+                c = (a[i] > b[i]) - (a[i] < b[i])
+                if c:
+                    return -c if reverse else c
+            return 0
+
+        rng = random.Random(0)
+        lines = ['{}\t{}\t{}\t{}\n'.format(rng.choice('abcdef'), rng.choice('wxyz'), rng.randint(0, 20), i)
+                 for i in range(300)]
+        input_path = os.path.join(self.tmp_dir, 'input')
+        with open(input_path, 'w') as f:
+            f.writelines(lines)
+        output = os.path.join(self.tmp_dir, 'output')
+        LocalRunner(SecondarySort(), cmd_args=[], input=input_path, output=output,
+                    mapper='cat', reducer='cat', num_reducers=3).execute()
+
+        partitions = []
+        result = []
+        for name in sorted(os.listdir(output)):
+            with open(os.path.join(output, name)) as f:
+                part = f.readlines()
+            keys = [line.split('\t', num_fields)[:num_fields] for line in part]
+            self.assertEqual(keys, [line.split('\t', num_fields)[:num_fields]
+                                    for line in sorted(part, key=cmp_to_key(compare))])
+            partitions.append(set(tuple(key[:partition_fields]) for key in keys))
+            result.extend(part)
+        self.assertEqual(sorted(result), sorted(lines))
+        # each partition key goes to a single partition
+        self.assertEqual(sum(len(keys) for keys in partitions), len(set.union(*partitions)))
+        self.assertTrue(all(partitions))
+
+
+class CombiningWordCount(WordCount):
+
+    def combiner(self, word, counts):
+        yield word, sum(counts)
+
+
+class WarningHandler(logging.Handler):
+    """keeps messages of warnings"""
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TypedBytesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+        self.handler = WarningHandler()
+        logging.getLogger('mrjob').addHandler(self.handler)
+
+    def tearDown(self):
+        logging.getLogger('mrjob').removeHandler(self.handler)
+        shutil.rmtree(self.tmp_dir)
+
+    def hadoop_stages(self, io):
+        runner = HadoopRunner(CombiningWordCount(), hadoop='/bin/true', input='/in', output='/out', io=io)
+        # the bundle of mrjob is not needed
+        bundle = hadoop.bundle
+        hadoop.bundle = lambda *args: os.path.join(self.tmp_dir, 'mrjob.zip')
+        try:
+            cmd = runner._generate_cmd()
+        finally:
+            hadoop.bundle = bundle
+        return [name for name in ('mapper', 'combiner', 'reducer') if '-' + name in cmd]
+
+    def test_combiner_is_skipped_like_on_hadoop(self):
+        for io in ('text', 'typedbytes'):
+            runner = LocalRunner(CombiningWordCount(), cmd_args=[], io=io)
+            stages = [name for name in ('mapper', 'combiner', 'reducer') if name in runner._steps[0]]
+            self.assertEqual(stages, self.hadoop_stages(io))
+        self.assertEqual(stages, ['mapper', 'reducer'])
+        self.assertEqual(self.handler.messages, ['combiner is skipped in typedbytes mode'] * 2)
+
+    def test_combiner_option(self):
+        runner = LocalRunner(WordCount(), cmd_args=[], mapper='cat', combiner='cat', reducer='cat',
+                             io='typedbytes')
+        self.assertNotIn('combiner', runner._steps[0])
+
+
+class CountersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_counters_are_summed_over_tasks(self):
+        for i in range(3):
+            with open(os.path.join(self.tmp_dir, 'input-{}'.format(i)), 'w') as f:
+                f.write('line\n' * 10)
+        mapper = ('''wc -l | awk '{print "reporter:counter:group,lines," $1}' >&2; '''
+                  'echo "reporter:status:done" >&2')
+        runner = LocalRunner(WordCount(), cmd_args=[], input=os.path.join(self.tmp_dir, 'input-*'),
+                             output=os.path.join(self.tmp_dir, 'output'), mapper=mapper, reducer='cat',
+                             num_mappers=3, num_reducers=1)
+        runner.execute()
+        self.assertEqual(runner.counters()[0], {u'group': {u'lines': 30}})
+
+
+class RunTasksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+        input_path = os.path.join(self.tmp_dir, 'input')
+        with open(input_path, 'w') as f:
+            f.write('a\n')
+        self.runner = LocalRunner(WordCount(), cmd_args=[], input=input_path,
+                                  output=os.path.join(self.tmp_dir, 'output'), mapper='sleep 30')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_failure_cancels_the_other_tasks(self):
+        started = []
+
+        def task(i):
+            started.append(i)
+            if i == 0:
+                time.sleep(0.5)
+                raise ValueError('task failed')
+            # a long running process, which is killed
+            return list(self.runner._communicate(0, 'mapper', []))
+
+        start = time.time()
+        self.assertRaises(ValueError, self.runner._run_tasks, task, [(i,) for i in range(4)], 2)
+        self.assertTrue(time.time() - start < 10)
+        # pending tasks are not started
+        self.assertEqual(sorted(started), [0, 1])
+        self.assertEqual(self.runner._procs, set())
+
+    def test_concurrency(self):
+        lock = Lock()
+        running = [0]
+        peak = [0]
+
+        def task(i):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return i * 2
+
+        results = self.runner._run_tasks(task, [(i,) for i in range(10)], 3)
+        self.assertEqual(results, [i * 2 for i in range(10)])
+        self.assertEqual(peak[0], 3)
+
+
+
+WORD_COUNT_SCRIPT = """
+from mrjob import MRJob
+
+
+class WordCount(MRJob):
+
+    def mapper(self, _, line):
+        for word in line.split():
+            yield word, 1
+
+    def combiner(self, word, counts):
+        yield word, sum(counts)
+
+    def reducer(self, word, counts):
+        yield word, sum(counts)
+
+
+if __name__ == '__main__':
+    WordCount().run()
+"""
+
+
+class ReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_records_and_bytes_of_stages(self):
+        script = os.path.join(self.tmp_dir, 'wc.py')
+        with open(script, 'w') as f:
+            f.write(WORD_COUNT_SCRIPT)
+        input_path = os.path.join(self.tmp_dir, 'input')
+        with open(input_path, 'w') as f:
+            f.write('a b a\nc\n' * 10)
+        # tasks import mrjob of this source tree
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        options = dict((name, 'PYTHONPATH="{}" "{}" "{}" --{}'.format(root_dir, sys.executable, script, name))
+                       for name in ('mapper', 'combiner', 'reducer'))
+        runner = LocalRunner(WordCount(), cmd_args=[], input=input_path,
+                             output=os.path.join(self.tmp_dir, 'output'), **options)
+        runner.execute()
+
+        stages = runner.report()['steps'][0]['stages']
+        mapper, combiner, reducer = stages['mapper'], stages['combiner'], stages['reducer']
+        self.assertEqual((mapper['input_records'], mapper['input_bytes']), (20, 80))
+        self.assertEqual(mapper['output_records'], 40)
+        # each stage reads what the previous one writes
+        self.assertEqual((combiner['input_records'], combiner['input_bytes']),
+                         (mapper['output_records'], mapper['output_bytes']))
+        self.assertEqual((reducer['input_records'], reducer['input_bytes']),
+                         (combiner['output_records'], combiner['output_bytes']))
+        self.assertEqual(reducer['output_records'], 3)
+        for stage in (mapper, combiner, reducer):
+            self.assertEqual(stage['tasks'], len(stage['task_stats']))
+            self.assertTrue(stage['records_per_sec'] > 0)
+            self.assertTrue(stage['cpu_seconds'] >= 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of TaskProfiler. Run from the root of the repository:
+
+    python -m unittest discover -s test
+"""
+
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+from mrjob.profiling import TaskProfiler
+
+
+class TaskProfilerTestCase(unittest.TestCase):
+
+    def run_task(self, profiler):
+        def read_lines():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+
+        @profiler.timed_user_fun
+        def mapper(i):
+            # values read lazily by user code are not counted as user time
+            for line in profiler.timed_iter('read', read_lines()):
+                time.sleep(0.02)
+                yield line
+
+        write = profiler.timed('write', lambda line: time.sleep(0.03))
+
+        def task():
+            for line in mapper(None):
+                write(line)
+
+        profiler.run(task)
+
+    def test_phases(self):
+        profiler = TaskProfiler()
+        self.run_task(profiler)
+        seconds = profiler.seconds
+        self.assertTrue(seconds['read'] >= 0.025, seconds)
+        self.assertTrue(seconds['write'] >= 0.085, seconds)
+        # 0.06s of user code, and 0.03s more if reading were counted twice
+        self.assertTrue(0.055 <= seconds['user'] < 0.085, seconds)
+        self.assertAlmostEqual(sum(seconds.values()), profiler.total_seconds, places=3)
+
+    def test_user_fun_returning_no_iterator(self):
+        profiler = TaskProfiler()
+        profiler._since = time.time()
+        self.assertEqual(profiler.timed_user_fun(lambda: None)(), None)
+        self.assertEqual(profiler.timed_user_fun(lambda: (1, 2))(), (1, 2))
+
+    def test_report_and_dump_stats(self):
+        profiler = TaskProfiler()
+        self.run_task(profiler)
+        report = profiler.report('mapper of step 0')
+        self.assertTrue(report.startswith('profile of mapper of step 0: '))
+        for phase in TaskProfiler.PHASES:
+            self.assertIn('  {} '.format(phase), report)
+
+        tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+        try:
+            path = os.path.join(tmp_dir, 'out.profile', 'mapper-0')
+            profiler.dump_stats(path)
+            self.assertTrue(pstats.Stats(path).total_calls > 0)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the protocols of mrjob.protocol. Run from the root of the
+repository:
+
+    python -m unittest discover -s test
+"""
+
+import unittest
+
+try:
+    from cStringIO import StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
+
+from mrjob.protocol import (BinaryPickleProtocol, KeyFieldProtocol, SortKeyProtocol, TypedBytesProtocol,
+                            decode_sort_key, encode_sort_key, read_typedbytes)
+
+
+# awkward bytes for line based protocols: tabs, newlines, carriage returns,
+# backslashes and escape sequences
+AWKWARD = [b'', b'\t', b'\n', b'\r\n', b'\\', b'\\t', b'\\0', b'a\tb\nc\\d', b'\x00\x01\x02\xff']
+
+VALUES = AWKWARD + [
+    None, True, False, 0, 1, -1, 2 ** 70, -2 ** 70, 1.5, -0.0, float('inf'),
+    u'', u'中文\t', (), (1, u'a', (None, b'\n')),
+]
+
+
+class BinaryPickleProtocolTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        protocol = BinaryPickleProtocol()
+        for value in VALUES + [[1, 2], {b'a': [b'\t']}]:
+            line = protocol.write(value, value)
+            self.assertNotIn(b'\n', line)
+            self.assertNotIn(b'\r', line)
+            self.assertEqual(line.count(b'\t'), 1)
+            self.assertEqual(protocol.read(line), (value, value))
+
+    def test_generator_is_written_as_list(self):
+        protocol = BinaryPickleProtocol()
+        line = protocol.write(b'k', (i for i in range(3)))
+        self.assertEqual(protocol.read(line), (b'k', [0, 1, 2]))
+
+    def test_equal_keys_are_equal_bytes(self):
+        # keys are grouped by their bytes, so memoization must not change them
+        protocol = BinaryPickleProtocol()
+        key = (b'a', b'a', [b'a'])
+        line = protocol.write(key, 1)
+        self.assertEqual(protocol.write((b'a', b'a', [b'a']), 2).split(b'\t')[0], line.split(b'\t')[0])
+
+    def test_read_raw_pairs(self):
+        protocol = BinaryPickleProtocol()
+        lines = [protocol.write(b'k', i) + b'\n' for i in range(3)]
+        pairs = list(protocol.read_raw_pairs(lines))
+        self.assertEqual([protocol._loads(value) for _, value in pairs], [0, 1, 2])
+        self.assertEqual(set(key for key, _ in pairs), set([lines[0].split(b'\t')[0]]))
+
+
+class SortKeyTestCase(unittest.TestCase):
+
+    def assertSortsLike(self, keys):
+        """encoded keys sort in the same order as the keys themselves"""
+        encoded = [encode_sort_key(key) for key in keys]
+        self.assertEqual([decode_sort_key(data) for data in sorted(encoded)], sorted(keys))
+
+    def test_round_trip(self):
+        for key in VALUES + [[1, [2]]]:
+            data = encode_sort_key(key)
+            for c in (b'\t', b'\n', b'\r'):
+                self.assertNotIn(c, data)
+            expected = (1, (2,)) if key == [1, [2]] else key
+            self.assertEqual(decode_sort_key(data), expected)
+
+    def test_int_order(self):
+        self.assertSortsLike([0, 1, -1, 9, 10, -9, -10, 15, 16, 255, 256, 2 ** 31, -2 ** 31,
+                              2 ** 64, -2 ** 64, 2 ** 200, -2 ** 200, 12345, -12345])
+
+    def test_float_order(self):
+        self.assertSortsLike([0.0, 1.5, -1.5, 1e-300, -1e-300, 1e300, -1e300, 2.0, 10.0,
+                              float('inf'), float('-inf')])
+
+    def test_string_order(self):
+        # prefixes sort first, and escaped bytes keep their order
+        self.assertSortsLike([b'', b'a', b'ab', b'b', b'a\x00', b'a\x01', b'a\x0f', b'a\x10', b'\xff'])
+        self.assertSortsLike([u'', u'a', u'ab', u'\xe9', u'中', u'\U0001f600'])
+
+    def test_tuple_order(self):
+        self.assertSortsLike([(), (1,), (1, 2), (1, -2), (2,), (2, u'a', -1.5), (2, u'a', 2.0)])
+        self.assertSortsLike([((1,), 0), ((), 5), ((1, 2), -1), ((1,), -1)])
+
+    def test_type_order(self):
+        keys = [(), u'a', b'a', 1.0, 1, True, False, None]
+        self.assertEqual(sorted(keys, key=encode_sort_key), list(reversed(keys)))
+
+    def test_unsupported_type(self):
+        self.assertRaises(TypeError, encode_sort_key, {1: 2})
+
+    def test_trailing_bytes(self):
+        self.assertRaises(ValueError, decode_sort_key, encode_sort_key(1) + b'x')
+
+    def test_protocol_sorts_lines_by_key(self):
+        protocol = SortKeyProtocol()
+        keys = [10, 9, -3, 100, 0]
+        lines = sorted(protocol.write(key, str(key)) for key in keys)
+        self.assertEqual([protocol.read(line) for line in lines], [(k, str(k)) for k in sorted(keys)])
+
+
+class KeyFieldProtocolTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        protocol = KeyFieldProtocol(3)
+        key = (u'a\tb', -2, (1, None))
+        line = protocol.write(key, b'\t\n')
+        self.assertEqual(line.count(b'\t'), 3)
+        self.assertNotIn(b'\n', line)
+        self.assertEqual(protocol.read(line), (key, b'\t\n'))
+        self.assertEqual(list(protocol.read_raw_pairs([line + b'\n'])), [line.rsplit(b'\t', 1)])
+
+    def test_fields_sort_in_natural_order(self):
+        protocol = KeyFieldProtocol(2)
+        keys = [(u'b', 10), (u'a', 9), (u'a', 10), (u'a', -1), (u'b', 2)]
+        # like KeyFieldBasedComparator, which compares the fields in turn
+        lines = sorted((protocol.write(key, None) for key in keys), key=lambda line: line.split(b'\t')[:2])
+        self.assertEqual([protocol.read(line)[0] for line in lines], sorted(keys))
+
+    def test_wrong_number_of_fields(self):
+        protocol = KeyFieldProtocol(2)
+        self.assertRaises(ValueError, protocol.write, (1, 2, 3), None)
+        self.assertRaises(ValueError, protocol.write, 1, None)
+
+
+class TypedBytesProtocolTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        protocol = TypedBytesProtocol()
+        values = AWKWARD + [
+            True, False, 0, -1, 2 ** 31, -2 ** 63, 1.5, (), (1, b'a'), [1, [b'x', 2.0]],
+            {b'a': 1, 2: (3,)}, bytearray(b'\x00\xff'), None, set([1]), 2 ** 70,
+        ]
+        for value in values:
+            self.assertEqual(protocol.read(protocol.write(value, value)), (value, value))
+
+    def test_unicode_is_written_as_utf8(self):
+        protocol = TypedBytesProtocol()
+        self.assertEqual(protocol.read(protocol.write(u'中', 1)), (u'中'.encode('utf8'), 1))
+
+    def test_read_pairs(self):
+        protocol = TypedBytesProtocol()
+        pairs = [(b'a', 1), (b'a', [2, 3]), ((b'b', 1), {b'c': None})]
+        stream = BytesIO(b''.join(protocol.write(k, v) for k, v in pairs))
+        self.assertEqual(list(protocol.read_pairs(stream)), pairs)
+
+    def test_read_raw_pairs(self):
+        protocol = TypedBytesProtocol()
+        pairs = [([1, (2, b'\xff')], {1: [b'']}), (b'k', 0.5)]
+        stream = BytesIO(b''.join(protocol.write(k, v) for k, v in pairs))
+        raw_pairs = list(protocol.read_raw_pairs(stream))
+        self.assertEqual([(protocol._loads(k), protocol._loads(v)) for k, v in raw_pairs], pairs)
+        self.assertEqual(read_typedbytes(stream), b'')
+
+    def test_truncated_stream(self):
+        protocol = TypedBytesProtocol()
+        data = protocol.write(b'key', [1, 2])
+        for end in (1, 3, len(data) - 1):
+            stream = BytesIO(data[:end])
+            self.assertRaises(EOFError, list, protocol.read_raw_pairs(stream))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the sort process of LocalRunner. Run from the root of the
+repository:
+
+    python -m unittest discover -s test
+"""
+
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from mrjob.protocol import TypedBytesProtocol
+from mrjob.runner.shuffle import _partition, read_run, record_keys, run_path, sort_cmd, sort_env
+
+
+class ShuffleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def sort(self, data, **kwargs):
+        stats = os.path.join(self.tmp_dir, 'stats.json')
+        proc = subprocess.Popen(sort_cmd(tmp_dir=self.tmp_dir, stats=stats, **kwargs), env=sort_env(),
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        out = proc.communicate(data)[0]
+        self.assertEqual(proc.returncode, 0)
+        with open(stats) as f:
+            return out, json.load(f)
+
+    def test_partition_is_deterministic(self):
+        self.assertEqual(_partition(b'a', 10), 9)
+        # the same in other processes, whatever their hash seed
+        keys = [str(i).encode('ascii') for i in range(100)]
+        code = 'from mrjob.runner.shuffle import _partition; print([_partition(str(i), 7) for i in range(100)])'
+        out = subprocess.check_output([sys.executable, '-R', '-c', code], env=sort_env())
+        self.assertEqual(out.strip(), str([_partition(key, 7) for key in keys]).encode('ascii'))
+
+    def test_typedbytes_partitions(self):
+        protocol = TypedBytesProtocol()
+        rng = random.Random(0)
+        pairs = [(u'key{}'.format(rng.randint(0, 30)), i) for i in range(200)]
+        prefix = os.path.join(self.tmp_dir, 'part')
+        out, stats = self.sort(b''.join(protocol.write(k, v) for k, v in pairs),
+                               typedbytes=True, partitions=3, output=prefix)
+        self.assertEqual(out, b'')
+        self.assertEqual((stats['sorters'], stats['records']), (3, 200))
+
+        read = []
+        for i in range(3):
+            run = list(read_run(run_path(prefix, i), typedbytes=True))
+            # sorted by raw key, and stable
+            self.assertEqual(run, sorted(run, key=lambda pair: pair[0]))
+            self.assertTrue(all(_partition(raw_key, 3) == i for raw_key, _ in run))
+            read.extend(protocol.read(k + v) for k, v in run)
+        self.assertEqual(sorted(read, key=lambda pair: pair[1]), pairs)
+
+    def test_key_fields_to_stdout(self):
+        key_fields = (3, 2, [(1, False), (0, False), (2, True)])
+        lines = [b'\t'.join([a, b, c, str(i).encode('ascii')]) + b'\n'
+                 for i, (a, b, c) in enumerate((a, b, c) for a in b'xy' for b in b'ab' for c in b'pq')]
+        random.Random(0).shuffle(lines)
+        out, stats = self.sort(b''.join(lines), key_fields=key_fields)
+        self.assertEqual(out.splitlines(True), sorted(lines, key=record_keys(key_fields=key_fields)[0]))
+        self.assertEqual((stats['sorters'], stats['records'], stats['spills']), (1, 8, 0))
+
+    def test_last_line_without_newline(self):
+        out, _ = self.sort(b'b\t1\na\t2', partitions=2)
+        self.assertEqual(out, b'a\t2\nb\t1\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
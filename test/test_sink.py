@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the output sinks of mrjob.sink. Run from the root of the
+repository:
+
+    python -m unittest discover -s test
+"""
+
+import unittest
+
+from mrjob.protocol import TextProtocol
+from mrjob.sink import CombiningSink, OutputSink, SaltingSink
+
+
+class Stream(object):
+    """a stream which records its writes and flushes"""
+
+    def __init__(self):
+        self.writes = []
+        self.flushes = 0
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    def flush(self):
+        self.flushes += 1
+
+
+class ListSink(object):
+    """a sink which keeps the pairs written into it"""
+
+    def __init__(self):
+        self.pairs = []
+        self.flushes = 0
+
+    def write(self, key, value):
+        self.pairs.append((key, value))
+
+    def flush(self):
+        self.flushes += 1
+
+
+def sum_combiner(key, values):
+    yield key, sum(values)
+
+
+class OutputSinkTestCase(unittest.TestCase):
+
+    def test_flush_at_buffer_size(self):
+        stream = Stream()
+        sink = OutputSink(stream, TextProtocol(), buffer_size=10)
+        sink.write(b'a', b'1')
+        sink.write(b'b', b'2')
+        self.assertEqual(stream.writes, [])
+        # the buffer is written once it reaches buffer_size
+        sink.write(b'c', b'3')
+        self.assertEqual(stream.writes, [b'a\t1\nb\t2\nc\t3\n'])
+        self.assertEqual(stream.flushes, 1)
+        sink.write(b'd', b'4')
+        self.assertEqual(len(stream.writes), 1)
+
+    def test_final_flush(self):
+        stream = Stream()
+        sink = OutputSink(stream, TextProtocol(), buffer_size=1024)
+        for i in range(3):
+            sink.write(b'k', str(i).encode('ascii'))
+        self.assertEqual(stream.writes, [])
+        sink.flush()
+        self.assertEqual(stream.writes, [b'k\t0\nk\t1\nk\t2\n'])
+        # nothing is left to write, but the stream is still flushed
+        sink.flush()
+        self.assertEqual(len(stream.writes), 1)
+        self.assertEqual(stream.flushes, 2)
+
+    def test_unbuffered(self):
+        stream = Stream()
+        sink = OutputSink(stream, TextProtocol(), buffer_size=0)
+        sink.write(b'a', b'1')
+        sink.write(b'b', b'2')
+        self.assertEqual(stream.writes, [b'a\t1\n', b'b\t2\n'])
+        self.assertEqual(stream.flushes, 2)
+
+    def test_records_and_bytes(self):
+        sink = OutputSink(Stream(), TextProtocol(), buffer_size=10)
+        for i in range(5):
+            sink.write(b'k', str(i).encode('ascii'))
+        # bytes are counted as they are written to the stream
+        self.assertEqual((sink.records, sink.bytes), (5, 12))
+        sink.flush()
+        self.assertEqual((sink.records, sink.bytes), (5, 20))
+
+
+class CombiningSinkTestCase(unittest.TestCase):
+
+    def test_combine_at_max_keys(self):
+        out = ListSink()
+        sink = CombiningSink(out, sum_combiner, max_keys=3, max_bytes=1 << 30)
+        for key in [b'a', b'b', b'a']:
+            sink.write(key, 1)
+        self.assertEqual(out.pairs, [])
+        sink.write(b'c', 1)
+        self.assertEqual(sorted(out.pairs), [(b'a', 2), (b'b', 1), (b'c', 1)])
+        # the buffer is emptied
+        sink.write(b'a', 5)
+        self.assertEqual(len(out.pairs), 3)
+        self.assertEqual(out.flushes, 0)
+
+    def test_combine_at_max_bytes(self):
+        out = ListSink()
+        sink = CombiningSink(out, sum_combiner, max_keys=1 << 30, max_bytes=2000)
+        for _ in range(1000):
+            sink.write(b'a', 1)
+        # combined several times, each time over many values
+        self.assertTrue(1 < len(out.pairs) < 100, out.pairs)
+        sink.flush()
+        self.assertEqual(sum(value for _, value in out.pairs), 1000)
+
+    def test_final_flush(self):
+        out = ListSink()
+        sink = CombiningSink(out, sum_combiner, max_keys=100, max_bytes=1 << 30)
+        for i in range(10):
+            sink.write(i % 3, i)
+        self.assertEqual(out.pairs, [])
+        sink.flush()
+        self.assertEqual(sorted(out.pairs), [(0, 18), (1, 12), (2, 15)])
+        self.assertEqual(out.flushes, 1)
+        self.assertEqual((sink.input_records, sink.output_records), (10, 3))
+
+    def test_unhashable_keys_are_passed_on(self):
+        out = ListSink()
+        sink = CombiningSink(out, sum_combiner, max_keys=100, max_bytes=1 << 30)
+        sink.write([1], 2)
+        self.assertEqual(out.pairs, [([1], 2)])
+
+
+class SaltingSinkTestCase(unittest.TestCase):
+
+    def test_only_hot_keys_are_salted(self):
+        out = ListSink()
+        sink = SaltingSink(out, num_salts=4, sketch_size=10, hot_fraction=0.1, min_records=20)
+        for i in range(200):
+            sink.write(b'hot', 1)
+            sink.write(b'cold-' + str(i).encode('ascii'), 1)
+
+        hot = [key for key, _ in out.pairs if key[0] == b'hot']
+        cold = [key for key, _ in out.pairs if key[0] != b'hot']
+        # a key is hot once it has more than min_records records, and its
+        # records take turns over the salts from then on
+        self.assertEqual(hot[:20], [(b'hot', None)] * 20)
+        self.assertEqual(hot[20:], [(b'hot', i % 4) for i in range(180)])
+        self.assertEqual(set(salt for _, salt in cold), set([None]))
+        self.assertEqual(list(sink.hot_keys), [b'hot'])
+        self.assertEqual((sink.records, sink.salted_records), (400, 180))
+
+    def test_hot_fraction(self):
+        # evenly spread keys are never hot, however many records they have
+        sink = SaltingSink(ListSink(), num_salts=4, sketch_size=100, hot_fraction=0.1, min_records=5)
+        for i in range(1000):
+            self.assertEqual(sink.salt(i % 20), (i % 20, None))
+
+    def test_unhashable_keys_are_not_salted(self):
+        sink = SaltingSink(ListSink(), num_salts=4, sketch_size=10, hot_fraction=0, min_records=0)
+        for _ in range(10):
+            self.assertEqual(sink.salt([1]), ([1], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
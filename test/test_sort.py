@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of the external sorters of mrjob.sort. Run from the root of the
+repository:
+
+    python -m unittest discover -s test
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from mrjob.sort import (ExternalSorter, ObjectSorter, PairSorter, external_sort, key_fields_sort_key,
+                        merge_sorted, reverse_order)
+
+
+def make_lines(n, seed=0):
+    """lines of few distinct keys, numbered to check that the sort is stable"""
+    rng = random.Random(seed)
+    return [b'key' + str(rng.randint(0, 20)).encode('ascii') + b'\t' + str(i).encode('ascii') + b'\n'
+            for i in range(n)]
+
+
+def stable_sorted(lines):
+    return sorted(lines, key=lambda line: line.split(b'\t', 1)[0])
+
+
+class ExternalSorterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sort_in_memory(self):
+        lines = make_lines(100)
+        sorter = ExternalSorter(tmp_dir=self.tmp_dir)
+        sorter.extend(lines)
+        self.assertEqual(list(sorter), stable_sorted(lines))
+        self.assertEqual(sorter.spills, 0)
+        self.assertEqual(sorter.records, 100)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_spill_and_merge(self):
+        lines = make_lines(1000)
+        sorter = ExternalSorter(buffer_size=1000, tmp_dir=self.tmp_dir)
+        sorter.extend(lines)
+        self.assertTrue(sorter.spills > 1)
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+        self.assertEqual(list(sorter), stable_sorted(lines))
+        self.assertEqual(sorter.records, 1000)
+        # spilled runs are removed once they are read
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_merge_in_several_passes(self):
+        lines = make_lines(1000)
+        sorter = ExternalSorter(buffer_size=500, tmp_dir=self.tmp_dir, merge_factor=3)
+        sorter.extend(lines)
+        self.assertTrue(sorter.spills > 9)
+        self.assertEqual(list(sorter), stable_sorted(lines))
+
+    def test_flush(self):
+        lines = make_lines(10)
+        sorter = ExternalSorter(tmp_dir=self.tmp_dir)
+        sorter.extend(lines[:5])
+        sorter.flush()
+        sorter.flush()
+        sorter.extend(lines[5:])
+        self.assertEqual(sorter.spills, 1)
+        self.assertEqual(list(sorter), stable_sorted(lines))
+
+    def test_lines_without_trailing_newline(self):
+        sorter = ExternalSorter(buffer_size=1, tmp_dir=self.tmp_dir)
+        sorter.extend([b'b\t1', b'a\t2\n'])
+        self.assertEqual(list(sorter), [b'a\t2\n', b'b\t1\n'])
+
+    def test_cleanup_unread_runs(self):
+        sorter = ExternalSorter(buffer_size=100, tmp_dir=self.tmp_dir)
+        sorter.extend(make_lines(100))
+        self.assertNotEqual(os.listdir(self.tmp_dir), [])
+        sorter.cleanup()
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_custom_key(self):
+        lines = make_lines(200)
+        key = key_fields_sort_key(2, [(1, True)])
+        self.assertEqual(list(external_sort(lines, key=key, buffer_size=300, tmp_dir=self.tmp_dir)),
+                         sorted(lines, key=lambda line: line.split(b'\t')[1], reverse=True))
+
+    def test_pair_sorter(self):
+        pairs = [(b'k\t' + str(i % 7).encode('ascii'), b'\n\x00' + str(i).encode('ascii')) for i in range(300)]
+        sorter = PairSorter(buffer_size=200, tmp_dir=self.tmp_dir)
+        sorter.extend(pairs)
+        self.assertTrue(sorter.spills > 1)
+        self.assertEqual(list(sorter), sorted(pairs, key=lambda pair: pair[0]))
+
+    def test_object_sorter(self):
+        pairs = [((i % 5, u'a'), {b'i': i}) for i in range(300)]
+        sorter = ObjectSorter(buffer_size=2000, tmp_dir=self.tmp_dir)
+        sorter.extend(pairs)
+        self.assertTrue(sorter.spills > 1)
+        self.assertEqual(list(sorter), sorted(pairs, key=lambda pair: pair[0]))
+
+
+class MergeSortedTestCase(unittest.TestCase):
+
+    def test_merge_is_stable(self):
+        runs = [[b'a\t0\n', b'b\t0\n'], [b'a\t1\n', b'c\t1\n'], [], [b'b\t3\n']]
+        self.assertEqual(list(merge_sorted(runs)),
+                         [b'a\t0\n', b'a\t1\n', b'b\t0\n', b'b\t3\n', b'c\t1\n'])
+
+    def test_reverse_order(self):
+        keys = [b'', b'a', b'ab', b'b', b'\xff']
+        self.assertEqual(sorted(keys, key=reverse_order), sorted(keys, reverse=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of mrjob.runner.taskio. Run from the root of the repository:
+
+    python -m unittest discover -s test
+"""
+
+import bz2
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from mrjob.runner.taskio import non_blocking_communicate, read_compressed_lines, read_split_lines, split_lines
+
+
+def popen(cmd):
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class NonBlockingCommunicateTestCase(unittest.TestCase):
+
+    def test_records_across_chunk_boundaries(self):
+        lines = [b'a\n', b'bb\n', b'\n', b'c' * 20 + b'\n', b'ddddd\n', b'e']
+        for chunk_size in (1, 2, 3, 7, 100):
+            out = list(non_blocking_communicate(popen(['cat']), iter(lines), chunk_size=chunk_size))
+            self.assertEqual(out, lines, chunk_size)
+
+    def test_child_closes_stdin_early(self):
+        # the child exits after reading a few bytes, so writing the rest of
+        # its input fails with EPIPE, which is not an error
+        proc = popen(['head', '-c', '10'])
+        inputs = (b'x' * 1000 + b'\n' for _ in range(10000))
+        self.assertEqual(list(non_blocking_communicate(proc, inputs)), [b'x' * 10])
+        self.assertEqual(proc.returncode, 0)
+
+    def test_input_error_reaches_the_caller(self):
+        def inputs():
+            yield b'a\n'
+            raise ValueError('bad input')
+
+        proc = popen(['cat'])
+        out = []
+        with self.assertRaises(ValueError):
+            for line in non_blocking_communicate(proc, inputs(), chunk_size=2):
+                out.append(line)
+        self.assertEqual(out, [b'a\n'])
+        # the error is raised after the process exits
+        self.assertEqual(proc.returncode, 0)
+
+    def test_stderr_is_drained_while_stdout_is_blocked(self):
+        # far more stderr than a pipe holds, before any stdout
+        proc = popen([sys.executable, '-c', 'import sys; sys.stderr.write("e\\n" * 500000); print("out")'])
+        stderr = []
+        out = list(non_blocking_communicate(proc, [], read_stderr=lambda lines: stderr.extend(lines)))
+        self.assertEqual(out, [b'out\n'])
+        self.assertEqual(len(stderr), 500000)
+
+
+class SplitLinesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, data):
+        path = os.path.join(self.tmp_dir, 'input')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def assertReadOnce(self, data):
+        """every line of `data` is read exactly once, from the splits of any
+        size, each read in chunks of any size"""
+        path = self.write(data)
+        lines = data.splitlines(True)
+        for split_size in range(1, len(data) + 2):
+            splits = split_lines(path, split_size)
+            self.assertEqual([start for start, _ in splits], [0] + [end for _, end in splits[:-1]])
+            self.assertEqual(splits[-1][1], len(data))
+            for chunk_size in (1, 4, 1000):
+                out = []
+                for start, end in splits:
+                    # each split starts at the beginning of a line
+                    self.assertTrue(start == 0 or data[start - 1:start] == b'\n', (split_size, start))
+                    out.extend(read_split_lines(path, start, end - start, chunk_size=chunk_size))
+                self.assertEqual(out, lines, (split_size, chunk_size))
+
+    def test_boundaries_mid_line_and_on_newlines(self):
+        self.assertReadOnce(b'a\nbb\n\nccc\ndddd\n' + b'e' * 10 + b'\nf\n')
+
+    def test_no_trailing_newline(self):
+        self.assertReadOnce(b'a\nbb\nccc')
+        self.assertReadOnce(b'abc')
+
+    def test_empty_file(self):
+        path = self.write(b'')
+        self.assertEqual(split_lines(path, 10), [])
+        self.assertEqual(list(read_split_lines(path, 0, 10)), [])
+
+    def test_length_past_the_end(self):
+        path = self.write(b'a\nb')
+        self.assertEqual(list(read_split_lines(path, 2, 100)), [b'b'])
+
+
+class ReadCompressedLinesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mrjob-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def gzip_compress(self, data):
+        path = os.path.join(self.tmp_dir, 'member.gz')
+        f = gzip.open(path, 'wb')
+        f.write(data)
+        f.close()
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_concatenated_bz2(self):
+        a, b = bz2.compress(b'a\nb\n'), bz2.compress(b'c\nd\n')
+        path = self.write('input.bz2', a + b)
+        self.assertEqual(list(read_compressed_lines(path)), [b'a\n', b'b\n', b'c\n', b'd\n'])
+
+    def test_bz2_member_ends_at_chunk_boundary(self):
+        a, b = bz2.compress(b'a\nb\n'), bz2.compress(b'c\nd\n')
+        path = self.write('input.bz2', a + b + a)
+        for chunk_size in (len(a), len(a) + len(b)):
+            self.assertEqual(list(read_compressed_lines(path, chunk_size=chunk_size)),
+                             [b'a\n', b'b\n', b'c\n', b'd\n', b'a\n', b'b\n'])
+
+    def test_bz2_padding_at_chunk_boundary(self):
+        a = bz2.compress(b'a\nb\n')
+        path = self.write('input.bz2', a + b'\x00' * 16)
+        self.assertEqual(list(read_compressed_lines(path, chunk_size=len(a))), [b'a\n', b'b\n'])
+
+    def test_gzip_member_ends_at_chunk_boundary(self):
+        a, b = self.gzip_compress(b'a\nb\n'), self.gzip_compress(b'c\nd\n')
+        path = self.write('input.gz', a + b)
+        self.assertEqual(list(read_compressed_lines(path, chunk_size=len(a))), [b'a\n', b'b\n', b'c\n', b'd\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
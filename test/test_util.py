@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+"""Tests of mrjob.util. Run from the root of the repository:
+
+    python -m unittest discover -s test
+"""
+
+import random
+import unittest
+from collections import Counter
+
+from mrjob.util import SpaceSaving
+
+
+class SpaceSavingTestCase(unittest.TestCase):
+
+    def test_error_bound(self):
+        rng = random.Random(0)
+        stream = [int(rng.paretovariate(0.8)) for _ in range(20000)]
+        capacity = 50
+        sketch = SpaceSaving(capacity)
+        counts = Counter()
+        for key in stream:
+            counts[key] += 1
+            # lower bounds never overestimate
+            self.assertTrue(sketch.add(key) <= counts[key])
+
+        top = sketch.top()
+        self.assertTrue(len(top) <= 2 * capacity)
+        for key, count in top:
+            # upper bounds never underestimate, and are off by at most
+            # 1 / capacity of the stream
+            self.assertTrue(counts[key] <= count <= counts[key] + len(stream) // capacity, key)
+
+        # keys with more than 1 / capacity of the stream are always counted
+        frequent = set(key for key, count in counts.items() if count > len(stream) // capacity)
+        self.assertTrue(frequent)
+        self.assertTrue(frequent <= set(key for key, _ in top))
+
+    def test_top(self):
+        sketch = SpaceSaving(2)
+        for key in 'abacabda':
+            sketch.add(key)
+        self.assertEqual(sketch.top(2), [('a', 4), ('b', 2)])
+
+    def test_invalid_capacity(self):
+        self.assertRaises(ValueError, SpaceSaving, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
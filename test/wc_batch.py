@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+from collections import Counter
+
+from mrjob import MRJob
+
+
+logging.basicConfig(level=logging.DEBUG)
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class WordCountBatch(MRJob):
+    """A word-count job which processes input lines in batches"""
+
+    MAPPER_BATCH_SIZE = 1000
+
+    def mapper_batch(self, lines):
+        # count words of the whole batch at once, and emit one pair per word
+        counts = Counter(b' '.join(lines).split())
+        return list(counts.keys()), list(counts.values())
+
+    def combiner(self, key, values):
+        yield key, sum(values)
+
+    def reducer(self, key, values):
+        yield key, sum(values)
+
+
+if __name__ == '__main__':
+    job = WordCountBatch()
+
+    if job.is_launched():
+        job.run()
+        exit()
+
+    job.run(runner='local', input=os.path.join(cur_dir, 'data.txt'))